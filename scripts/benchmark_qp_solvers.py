@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import argparse
+from time import time
+
+import numpy as np
+
+from giskardpy.exceptions import QPSolverException
+from giskardpy.qp_problem_builder import BIG_NUMBER
+from giskardpy.qp_recorder import load_recording
+from giskardpy.qp_solver import get_qp_solver_class
+
+
+def make_problems(joints, soft_constraints, cycles, seed=0):
+    """
+    Creates a sequence of slowly changing problems with the structure of giskard's qp:
+    every soft constraint depends on a short chain of joints and has its own slack variable.
+    :return: (h, j, s), list of (H, g, A, lb, ub, lbA, ubA)
+    :rtype: tuple
+    """
+    rng = np.random.RandomState(seed)
+    c, s = joints, soft_constraints
+    weights = np.concatenate((np.full(c, 0.001), np.full(s, 1.)))
+    A = np.zeros((s, c + s))
+    chain_length = min(7, c)
+    for i in range(s):
+        start = rng.randint(0, c - chain_length + 1)
+        A[i, start:start + chain_length] = rng.uniform(-1, 1, chain_length)
+    A[:, c:] = np.eye(s)
+    lb = np.concatenate((np.full(c, -0.5), np.full(s, -BIG_NUMBER)))
+    ub = -lb
+    lbA = rng.uniform(-0.1, 0.1, s)
+    problems = []
+    for t in range(cycles):
+        drift = 0.01 * np.sin(0.1 * t)
+        next_A = A.copy()
+        next_A[:, :c] *= 1 + drift
+        problems.append((np.diag(weights), np.zeros(c + s), next_A, lb, ub, lbA + drift, lbA + drift + 1))
+    return (0, c, s), problems
+
+
+def benchmark(backend, dimensions, problems):
+    """
+    :return: solve times in s, solutions, number of failed cycles
+    :rtype: tuple
+    """
+    solver = get_qp_solver_class(backend)(*dimensions)
+    times = []
+    solutions = []
+    failures = 0
+    for H, g, A, lb, ub, lbA, ubA in problems:
+        # the solvers are allowed to fix nans in place
+        args = [x.copy() for x in (H, g, A, lb, ub, lbA, ubA)]
+        t = time()
+        try:
+            xdot_full = solver.solve(*args)
+        except QPSolverException:
+            failures += 1
+            solutions.append(None)
+            continue
+        times.append(time() - t)
+        solutions.append(np.array(xdot_full, copy=True))
+    return np.array(times), solutions, failures
+
+
+def compare(problem_sets, backends):
+    """
+    :param problem_sets: list of (name, dimensions, problems)
+    :type problem_sets: list
+    :type backends: list
+    """
+    for name, dimensions, problems in problem_sets:
+        print(u'{}: h={} j={} s={}, {} cycles'.format(name, dimensions[0], dimensions[1], dimensions[2],
+                                                      len(problems)))
+        reference = None
+        for backend in backends:
+            times, solutions, failures = benchmark(backend, dimensions, problems)
+            if reference is None:
+                reference = solutions
+                deviation = 0
+            else:
+                deviation = max([np.max(np.abs(a[:dimensions[1]] - b[:dimensions[1]]))
+                                 for a, b in zip(reference, solutions) if a is not None and b is not None] or [0])
+            if len(times) == 0:
+                print(u'  {:>8}: all cycles failed'.format(backend))
+                continue
+            print(u'  {:>8}: mean {:.3f}ms median {:.3f}ms max {:.3f}ms, first {:.3f}ms, {} failed, '
+                  u'max joint deviation from {} {:.2e}'.format(backend,
+                                                               times.mean() * 1000,
+                                                               np.median(times) * 1000,
+                                                               times.max() * 1000,
+                                                               times[0] * 1000,
+                                                               failures,
+                                                               backends[0],
+                                                               deviation))
+
+
+if __name__ == u'__main__':
+    parser = argparse.ArgumentParser(description=u'Compares the qp solver backends.')
+    parser.add_argument(u'recordings', nargs=u'*', help=u'recorded with qp_solver/record: True, '
+                                                          u'synthetic problems are used if none are given')
+    parser.add_argument(u'--backends', nargs=u'+', default=[u'qpoases', u'osqp'])
+    parser.add_argument(u'--joints', type=int, default=40)
+    parser.add_argument(u'--soft_constraints', type=int, nargs=u'+', default=[20, 100, 400])
+    parser.add_argument(u'--cycles', type=int, default=400)
+    args = parser.parse_args()
+
+    problem_sets = []
+    for recording in args.recordings:
+        header, cycles = load_recording(recording)
+        problem_sets.append((recording, header[u'dimensions'], list(cycles)))
+    if not args.recordings:
+        for s in args.soft_constraints:
+            dimensions, problems = make_problems(args.joints, s, args.cycles)
+            problem_sets.append((u'synthetic', dimensions, problems))
+    compare(problem_sets, args.backends)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import argparse
+from time import time
+
+import numpy as np
+
+from giskardpy.exceptions import QPSolverException
+from giskardpy.qp_recorder import load_recording
+from giskardpy.qp_solver import get_qp_solver_class
+
+
+def replay(file_name, backend, nWSR=None, verbose=True):
+    """
+    Solves every problem of a recording and prints solve time, iterations and whether the problem was warm started.
+    :type file_name: str
+    :param backend: name of the qp solver backend
+    :type backend: str
+    :param nWSR: max number of working set recalculations, None for the qpoases estimation
+    :type nWSR: int
+    :return: solve times
+    :rtype: np.array
+    """
+    header, cycles = load_recording(file_name)
+    solver = get_qp_solver_class(backend)(*header[u'dimensions'])
+    h, j, s = header[u'dimensions']
+    print(u'{}: robot {}, recorded with {}, h={} j={} s={}'.format(file_name, header.get(u'robot'),
+                                                                   header.get(u'backend'), h, j, s))
+    if verbose:
+        print(u'{:>6} {:>10} {:>10} {:>9}'.format(u'cycle', u'time[ms]', u'nWSR used', u'start'))
+    times = []
+    failures = 0
+    for i, (H, g, A, lb, ub, lbA, ubA) in enumerate(cycles):
+        number_of_inits = solver.number_of_inits
+        t = time()
+        try:
+            solver.solve(H, g, A, lb, ub, lbA, ubA, nWSR)
+        except QPSolverException as e:
+            failures += 1
+            print(u'{:>6} failed: {}'.format(i, e))
+            continue
+        times.append(time() - t)
+        if verbose:
+            print(u'{:>6} {:>10.3f} {:>10} {:>9}'.format(i, times[-1] * 1000, solver.iterations,
+                                                         u'cold' if solver.number_of_inits > number_of_inits
+                                                         else u'hotstart'))
+    times = np.array(times)
+    if len(times) > 0:
+        print(u'{} cycles, {} failed; total {:.3f}ms, mean {:.3f}ms, max {:.3f}ms'.format(len(times) + failures,
+                                                                                        failures,
+                                                                                        times.sum() * 1000,
+                                                                                        times.mean() * 1000,
+                                                                                        times.max() * 1000))
+    print(u'{} cold inits, {} hotstarts'.format(solver.number_of_inits, solver.number_of_hotstarts))
+    return times
+
+
+if __name__ == u'__main__':
+    parser = argparse.ArgumentParser(description=u'Replays qp problems recorded with qp_solver/record: True.')
+    parser.add_argument(u'recordings', nargs=u'+')
+    parser.add_argument(u'--backend', default=u'qpoases')
+    parser.add_argument(u'--nWSR', type=int, default=None)
+    parser.add_argument(u'--quiet', action=u'store_true', help=u'only print the summary')
+    args = parser.parse_args()
+    for recording in args.recordings:
+        replay(recording, args.backend, args.nWSR, not args.quiet)
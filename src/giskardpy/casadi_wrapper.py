@@ -1,5 +1,10 @@
+import hashlib
+import json
 import os
-import pickle
+import shutil
+import subprocess
+import tempfile
+from time import time
 
 import casadi as ca
 import numpy as np
@@ -130,6 +135,14 @@ def zeros(x, y):
     return ca.SX.zeros(x, y)
 
 
+def densify(matrix):
+    """
+    :return: matrix without structural zeros
+    :rtype: Matrix
+    """
+    return ca.densify(matrix)
+
+
 def Abs(x):
     return ca.fabs(x)
 
@@ -371,22 +384,188 @@ def if_eq(a, b, if_result, else_result):
     return ca.if_else(ca.eq(a,b), if_result, else_result)
 
 
-def safe_compiled_function(f, file_name):
+# increase if the file format or the layout of compiled functions changes, to invalidate old files
+COMPILED_FUNCTION_VERSION = 1
+COMPILED_FUNCTION_SUFFIX = u'.casadi'
+SHARED_OBJECT_SUFFIX = u'.so'
+# the least recently used functions get deleted, when their total size exceeds this limit
+COMPILED_FUNCTION_CACHE_SIZE = 512 * 1024 * 1024
+# files and folders with this prefix are still being written, they are left behind if the process gets killed
+TEMPORARY_FILE_PREFIX = u'.tmp_'
+# temporary files and folders older than this many seconds get deleted during the eviction
+STALE_TEMPORARY_FILE_AGE = 60 * 60
+
+
+def compiled_function_file_name(file_name):
+    """
+    Adds the versions of the file format and casadi to file_name, such that incompatible functions are never loaded.
+    :type file_name: str
+    :rtype: str
+    """
+    return u'{}_v{}_casadi{}{}'.format(file_name, COMPILED_FUNCTION_VERSION, ca.__version__, COMPILED_FUNCTION_SUFFIX)
+
+
+def safe_compiled_function(f, file_name, max_cache_size=COMPILED_FUNCTION_CACHE_SIZE):
+    """
+    Saves f with casadi's serializer. The file is written atomically, such that other processes never see
+    half written functions. Afterwards, the least recently used functions in the same folder are deleted until their
+    total size is below max_cache_size.
+    :type f: Union[CompiledFunction, CompiledSparseFunction]
+    :type file_name: str
+    :param max_cache_size: in bytes
+    :type max_cache_size: int
+    """
+    file_name = compiled_function_file_name(file_name)
     create_path(file_name)
-    with open(file_name, 'w') as file:
-        pickle.dump(f, file)
-        logging.loginfo(u'saved {}'.format(file_name))
+    payload = f.fast_f.serialize()
+    header = {u'version': COMPILED_FUNCTION_VERSION,
+              u'casadi': ca.__version__,
+              u'sha1': hashlib.sha1(payload).hexdigest(),
+              u'length': len(payload),
+              u'str_params': f.str_params}
+    if isinstance(f, CompiledFunction):
+        header[u'shape'] = f.shape
+    fd, tmp_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name), prefix=TEMPORARY_FILE_PREFIX)
+    try:
+        with os.fdopen(fd, u'wb') as file:
+            file.write(json.dumps(header))
+            file.write(b'\n')
+            file.write(payload)
+        os.rename(tmp_file_name, file_name)
+    except:
+        os.remove(tmp_file_name)
+        raise
+    logging.loginfo(u'saved {}'.format(file_name))
+    evict_compiled_functions(os.path.dirname(file_name), max_cache_size)
 
 
 def load_compiled_function(file_name):
+    """
+    :type file_name: str
+    :return: the function saved with safe_compiled_function or None, if there is none or it is corrupted.
+    :rtype: Union[CompiledFunction, CompiledSparseFunction, None]
+    """
+    file_name = compiled_function_file_name(file_name)
     if os.path.isfile(file_name):
         try:
-            with open(file_name, u'r') as file:
-                fast_f = pickle.load(file)
-                return fast_f
-        except EOFError as e:
+            with open(file_name, u'rb') as file:
+                header_line = file.readline()
+                payload = file.read()
+        except IOError as e:
+            # not necessarily corrupted, e.g. someone else is still writing it, so don't delete it
+            logging.logwarn(u'failed to read {}: {}'.format(file_name, e))
+            return None
+        try:
+            header = json.loads(header_line)
+            if header[u'version'] != COMPILED_FUNCTION_VERSION or header[u'casadi'] != ca.__version__ or \
+                    header[u'length'] != len(payload) or header[u'sha1'] != hashlib.sha1(payload).hexdigest():
+                raise ValueError(u'checksum or version mismatch')
+            fast_f = ca.Function.deserialize(payload)
+            # update the modification time, which is used to find the least recently used functions
+            os.utime(file_name, None)
+            if u'shape' in header:
+                return CompiledFunction(header[u'str_params'], fast_f, 0, tuple(header[u'shape']))
+            return CompiledSparseFunction(header[u'str_params'], fast_f)
+        except (ValueError, KeyError, TypeError, RuntimeError) as e:
+            # ValueError for broken json or a checksum mismatch, KeyError and TypeError for a broken header and
+            # RuntimeError if casadi fails to deserialize the payload
+            try:
+                os.remove(file_name)
+                logging.logerr(u'{} deleted because it was corrupted: {}'.format(file_name, e))
+            except OSError:
+                # deleted by someone else in the mean time
+                pass
+
+
+def compile_native(f, file_name, compiler=u'gcc', flags=(u'-O1',), max_cache_size=COMPILED_FUNCTION_CACHE_SIZE):
+    """
+    Generates c code for f and compiles it into a shared object beside file_name, which is loaded with ca.external.
+    The name of the shared object contains a checksum of f, such that it is only reused for the same function.
+    :type f: Union[CompiledFunction, CompiledSparseFunction]
+    :type file_name: str
+    :param compiler: name of the c compiler
+    :type compiler: str
+    :param flags: compiler flags, higher optimization levels take very long for big functions
+    :type flags: tuple
+    :return: a version of f that evaluates native code or f, if the compilation or loading failed
+    :rtype: Union[CompiledFunction, CompiledSparseFunction]
+    """
+    checksum = hashlib.sha1(f.fast_f.serialize()).hexdigest()[:16]
+    so_file_name = u'{}_{}_{}{}'.format(compiled_function_file_name(file_name)[:-len(COMPILED_FUNCTION_SUFFIX)],
+                                        checksum, compiler, SHARED_OBJECT_SUFFIX)
+    if not os.path.isfile(so_file_name):
+        create_path(so_file_name)
+        folder = tempfile.mkdtemp(dir=os.path.dirname(so_file_name), prefix=TEMPORARY_FILE_PREFIX)
+        try:
+            t = time()
+            code_generator = ca.CodeGenerator(u'f.c')
+            code_generator.add(f.fast_f)
+            code_generator.generate(folder + u'/')
+            tmp_so_file_name = os.path.join(folder, u'f' + SHARED_OBJECT_SUFFIX)
+            subprocess.check_output([compiler, u'-fPIC', u'-shared'] + list(flags) +
+                                    [os.path.join(folder, u'f.c'), u'-o', tmp_so_file_name],
+                                    stderr=subprocess.STDOUT)
+            os.rename(tmp_so_file_name, so_file_name)
+            logging.loginfo(u'compiling c code with {} took {}'.format(compiler, time() - t))
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.logwarn(u'failed to compile c code with {}, using casadi\'s virtual machine: {}'.format(compiler, e))
+            return f
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        evict_compiled_functions(os.path.dirname(so_file_name), max_cache_size)
+    try:
+        fast_f = ca.external(f.fast_f.name(), so_file_name)
+    except RuntimeError as e:
+        os.remove(so_file_name)
+        logging.logerr(u'{} deleted because it could not be loaded: {}'.format(so_file_name, e))
+        return f
+    os.utime(so_file_name, None)
+    logging.loginfo(u'loaded {}'.format(so_file_name))
+    if isinstance(f, CompiledFunction):
+        return CompiledFunction(f.str_params, fast_f, 0, f.shape)
+    return CompiledSparseFunction(f.str_params, fast_f)
+
+
+def evict_compiled_functions(folder, max_cache_size=COMPILED_FUNCTION_CACHE_SIZE):
+    """
+    Deletes the least recently used compiled functions in folder, until their total size is below max_cache_size.
+    Also deletes temporary files and folders that are older than STALE_TEMPORARY_FILE_AGE.
+    :type folder: str
+    :param max_cache_size: in bytes
+    :type max_cache_size: int
+    """
+    files = []
+    for file_name in os.listdir(folder):
+        if file_name.startswith(TEMPORARY_FILE_PREFIX):
+            file_name = os.path.join(folder, file_name)
+            try:
+                if time() - os.stat(file_name).st_mtime > STALE_TEMPORARY_FILE_AGE:
+                    if os.path.isdir(file_name):
+                        shutil.rmtree(file_name)
+                    else:
+                        os.remove(file_name)
+                    logging.loginfo(u'deleted stale {}'.format(file_name))
+            except OSError:
+                # deleted by someone else in the mean time
+                pass
+        elif file_name.endswith(COMPILED_FUNCTION_SUFFIX) or file_name.endswith(SHARED_OBJECT_SUFFIX):
+            file_name = os.path.join(folder, file_name)
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                # deleted by someone else in the mean time
+                continue
+            files.append((stat.st_mtime, stat.st_size, file_name))
+    total_size = sum(size for _, size, _ in files)
+    for _, size, file_name in sorted(files):
+        if total_size <= max_cache_size:
+            break
+        try:
             os.remove(file_name)
-            logging.logerr(u'{} deleted because it was corrupted'.format(file_name))
+            logging.loginfo(u'deleted least recently used {}'.format(file_name))
+        except OSError:
+            pass
+        total_size -= size
 
 
 class CompiledFunction(object):
@@ -409,7 +588,7 @@ class CompiledFunction(object):
         :return:
         """
 
-        filtered_args = np.array(filtered_args, dtype=float)
+        filtered_args = np.ascontiguousarray(filtered_args, dtype=float)
         self.buf.set_arg(0, memoryview(filtered_args))
         self.f_eval()
         return self.out
@@ -423,6 +602,74 @@ def speed_up(function, parameters, backend=u'clang'):
     return CompiledFunction(str_params, f, 0, function.shape)
 
 
+class CompiledSparseFunction(object):
+    """
+    Evaluates a function with several outputs, but only computes their structural non zeros.
+    The non zeros are written into buffers, which can be replaced with views of preallocated arrays.
+    """
+    def __init__(self, str_params, fast_f):
+        self.str_params = str_params
+        self.fast_f = fast_f
+        self.buf, self.f_eval = fast_f.buffer()
+        self.out = []
+        for i in range(fast_f.n_out()):
+            self.out.append(None)
+            self.set_out(i, np.zeros(fast_f.nnz_out(i)))
+
+    def nnz(self, i):
+        """
+        :return: number of structural non zeros of output i
+        :rtype: int
+        """
+        return self.fast_f.nnz_out(i)
+
+    def sparsity(self, i):
+        """
+        :return: row and column indices of the structural non zeros of output i, in the order they are written
+        :rtype: tuple
+        """
+        rows, columns = self.fast_f.sparsity_out(i).get_triplet()
+        return np.array(rows, dtype=int), np.array(columns, dtype=int)
+
+    def set_out(self, i, array):
+        """
+        Changes the buffer, which receives the non zeros of output i.
+        :param array: contiguous float array with nnz(i) entries, a reference is kept
+        :type array: np.ndarray
+        """
+        assert array.dtype == np.float64 and array.flags.c_contiguous and len(array) == self.nnz(i)
+        self.out[i] = array
+        self.buf.set_res(i, memoryview(array))
+
+    def __call__(self, **kwargs):
+        filtered_args = [kwargs[k] for k in self.str_params]
+        return self.call2(filtered_args)
+
+    def call2(self, filtered_args):
+        """
+        :param filtered_args: parameter values in the same order as in self.str_params
+        :type filtered_args: list
+        :return: the non zeros of each output
+        :rtype: list
+        """
+        filtered_args = np.ascontiguousarray(filtered_args, dtype=float)
+        self.buf.set_arg(0, memoryview(filtered_args))
+        self.f_eval()
+        return self.out
+
+
+def speed_up_sparse(functions, parameters):
+    """
+    Like speed_up, but the outputs are not densified, such that only their structural non zeros get evaluated.
+    :type functions: list
+    :type parameters: list
+    :rtype: CompiledSparseFunction
+    """
+    str_params = [str(x) for x in parameters]
+    f = ca.Function('f', [Matrix(parameters)], functions)
+    return CompiledSparseFunction(str_params, f)
+
+
 def cross(u, v):
     """
     :param u: 1d matrix
@@ -624,6 +871,15 @@ def eye(size):
     return ca.SX.eye(size)
 
 
+def vstack(list_of_matrices):
+    """
+    :type list_of_matrices: list
+    :return: the matrices stacked on top of each other
+    :rtype: Matrix
+    """
+    return ca.vertcat(*list_of_matrices)
+
+
 def inverse_frame(frame):
     """
     :param frame: 4x4 Matrix
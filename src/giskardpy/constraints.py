@@ -13,6 +13,7 @@ from tf.transformations import quaternion_matrix, quaternion_from_matrix
 
 import giskardpy.identifier as identifier
 from giskardpy import symbolic_wrapper as w
+from giskardpy.data_types import Collisions
 from giskardpy.exceptions import GiskardException
 from giskardpy.input_system import PoseStampedInput, Point3Input, Vector3Input, Vector3StampedInput, FrameInput, \
     PointStampedInput, TranslationInput
@@ -550,38 +551,32 @@ class ExternalCollisionAvoidance(Constraint):
                   self.C: C, }
         self.save_params_on_god_map(params)
 
+    def get_closest_point_prefix(self):
+        return identifier.closest_point + [u'external_collisions', self.joint_name, self.idx]
+
     def get_distance_to_closest_object(self):
-        return self.get_god_map().to_symbol(identifier.closest_point + [u'get_external_collisions',
-                                                                        (self.joint_name,),
-                                                                        self.idx,
-                                                                        u'min_dist'])
+        return self.get_god_map().to_symbol(self.get_closest_point_prefix() + [Collisions.MIN_DIST])
 
     def get_contact_normal_on_b(self):
+        c = Collisions.CONTACT_NORMAL
         return Vector3Input(self.god_map.to_symbol,
-                            prefix=identifier.closest_point + [u'get_external_collisions',
-                                                               (self.joint_name,),
-                                                               self.idx,
-                                                               u'contact_normal']).get_expression()
+                            prefix=self.get_closest_point_prefix(),
+                            x=(c,), y=(c + 1,), z=(c + 2,)).get_expression()
 
     def get_closest_point_on_a(self):
+        c = Collisions.POSITION_ON_A
         return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions',
-                                                              (self.joint_name,),
-                                                              self.idx,
-                                                              u'position_on_a']).get_expression()
+                           prefix=self.get_closest_point_prefix(),
+                           x=(c,), y=(c + 1,), z=(c + 2,)).get_expression()
 
     def get_closest_point_on_b(self):
+        c = Collisions.POSITION_ON_B
         return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions',
-                                                              (self.joint_name,),
-                                                              self.idx,
-                                                              u'position_on_b']).get_expression()
+                           prefix=self.get_closest_point_prefix(),
+                           x=(c,), y=(c + 1,), z=(c + 2,)).get_expression()
 
     def get_actual_distance(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_external_collisions',
-                                                                  (self.joint_name,),
-                                                                  self.idx,
-                                                                  u'contact_distance'])
+        return self.god_map.to_symbol(self.get_closest_point_prefix() + [Collisions.CONTACT_DISTANCE])
 
     def get_constraint(self):
         soft_constraints = OrderedDict()
@@ -654,29 +649,30 @@ class SelfCollisionAvoidance(Constraint):
                   self.C: C, }
         self.save_params_on_god_map(params)
 
+    def get_closest_point_prefix(self):
+        return identifier.closest_point + [u'self_collisions', self.link_a, self.link_b, 0]
+
     def get_contact_normal_on_b(self):
+        c = Collisions.CONTACT_NORMAL
         return Vector3Input(self.god_map.to_symbol,
-                            prefix=identifier.closest_point + [u'get_self_collisions',
-                                                               (self.link_a, self.link_b),
-                                                               0,
-                                                               u'contact_normal']).get_expression()
+                            prefix=self.get_closest_point_prefix(),
+                            x=(c,), y=(c + 1,), z=(c + 2,)).get_expression()
 
     def get_closest_point_on_a(self):
+        c = Collisions.POSITION_ON_A
         return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_self_collisions',
-                                                              (self.link_a, self.link_b), 0,
-                                                              u'position_on_a']).get_expression()
+                           prefix=self.get_closest_point_prefix(),
+                           x=(c,), y=(c + 1,), z=(c + 2,)).get_expression()
 
     def get_r_T_pb(self):
-        return TranslationInput(self.god_map.to_symbol,
-                                prefix=identifier.closest_point + [u'get_self_collisions',
-                                                                   (self.link_a, self.link_b), 0,
-                                                                   u'position_on_b']).get_frame()
+        c = Collisions.POSITION_ON_B
+        r_P_pb = Point3Input(self.god_map.to_symbol,
+                             prefix=self.get_closest_point_prefix(),
+                             x=(c,), y=(c + 1,), z=(c + 2,))
+        return w.translation3(r_P_pb.x, r_P_pb.y, r_P_pb.z)
 
     def get_actual_distance(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_self_collisions',
-                                                                  (self.link_a, self.link_b), 0,
-                                                                  u'contact_distance'])
+        return self.god_map.to_symbol(self.get_closest_point_prefix() + [Collisions.CONTACT_DISTANCE])
 
     def get_constraint(self):
         soft_constraints = OrderedDict()
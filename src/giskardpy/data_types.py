@@ -1,6 +1,6 @@
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, Mapping
 
-from sortedcontainers import SortedKeyList
+import numpy as np
 
 
 class SingleJointState(object):
@@ -14,6 +14,189 @@ class SingleJointState(object):
         return u'{}: {}, {}, {}'.format(self.name, self.position, self.velocity, self.effort)
 
 
+class JointStateView(object):
+    """
+    Behaves like a SingleJointState, but reads and writes the arrays of a JointStates.
+    """
+    __slots__ = [u'_joint_states', u'_index']
+
+    def __init__(self, joint_states, index):
+        """
+        :type joint_states: JointStates
+        :type index: int
+        """
+        self._joint_states = joint_states
+        self._index = index
+
+    @property
+    def name(self):
+        return self._joint_states.names[self._index]
+
+    @property
+    def position(self):
+        return self._joint_states.position[self._index]
+
+    @position.setter
+    def position(self, value):
+        self._joint_states.position[self._index] = value
+
+    @property
+    def velocity(self):
+        return self._joint_states.velocity[self._index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self._joint_states.velocity[self._index] = value
+
+    @property
+    def effort(self):
+        return self._joint_states.effort[self._index]
+
+    @effort.setter
+    def effort(self, value):
+        self._joint_states.effort[self._index] = value
+
+    def __str__(self):
+        return u'{}: {}, {}, {}'.format(self.name, self.position, self.velocity, self.effort)
+
+
+class JointStates(Mapping):
+    """
+    Maps joint names to joint states, like a dict of SingleJointStates. The states are saved in aligned position,
+    velocity and effort arrays, such that they can be updated with numpy operations. Items are views into these
+    arrays and only created on access.
+    Copies share the list of names, which must not be changed.
+    """
+
+    def __init__(self, names=(), position=None, velocity=None, effort=None, name_to_index=None):
+        """
+        :type names: list
+        :param position: defaults to zeros
+        :type position: np.ndarray
+        :param velocity: defaults to zeros
+        :type velocity: np.ndarray
+        :param effort: defaults to zeros
+        :type effort: np.ndarray
+        :param name_to_index: index of every name, only pass it together with the names it was created for
+        :type name_to_index: dict
+        """
+        self.names = list(names) if not isinstance(names, list) else names
+        if name_to_index is None:
+            name_to_index = {name: i for i, name in enumerate(self.names)}
+        self._name_to_index = name_to_index
+        self.position = self._to_array(position)
+        self.velocity = self._to_array(velocity)
+        self.effort = self._to_array(effort)
+
+    def _to_array(self, values):
+        if values is None:
+            return np.zeros(len(self.names))
+        return np.asarray(values, dtype=float)
+
+    @classmethod
+    def from_dict(cls, joint_states):
+        """
+        :param joint_states: joint name -> SingleJointState
+        :type joint_states: dict
+        :rtype: JointStates
+        """
+        if isinstance(joint_states, JointStates):
+            return joint_states
+        names = list(joint_states.keys())
+        states = [joint_states[name] for name in names]
+        return cls(names,
+                   [sjs.position for sjs in states],
+                   [sjs.velocity for sjs in states],
+                   [sjs.effort for sjs in states])
+
+    def to_dict(self):
+        """
+        :return: independent copy of the joint states
+        :rtype: OrderedDict[str, SingleJointState]
+        """
+        return OrderedDict((name, SingleJointState(name, position, velocity, effort)) for name, position, velocity, effort
+                           in zip(self.names, self.position.tolist(), self.velocity.tolist(), self.effort.tolist()))
+
+    def copy(self, position=None, velocity=None, effort=None):
+        """
+        :param position: replaces the positions of the copy, if not None
+        :param velocity: replaces the velocities of the copy, if not None
+        :param effort: replaces the efforts of the copy, if not None
+        :return: joint states with the same names and copies of the other arrays
+        :rtype: JointStates
+        """
+        return JointStates(self.names,
+                           self.position.copy() if position is None else position,
+                           self.velocity.copy() if velocity is None else velocity,
+                           self.effort.copy() if effort is None else effort,
+                           self._name_to_index)
+
+    def merge(self, other):
+        """
+        :param other: joint name -> SingleJointState, its values overwrite those of self
+        :type other: dict
+        :return: joint states with the joints of self and other, self and other are not changed
+        :rtype: JointStates
+        """
+        other = JointStates.from_dict(other)
+        if other.names is self.names or other.names == self.names:
+            return other
+        if all(name in other for name in self.names):
+            return other
+        names = self.names + [name for name in other.names if name not in self]
+        result = JointStates(names,
+                             np.concatenate((self.position, np.zeros(len(names) - len(self)))),
+                             np.concatenate((self.velocity, np.zeros(len(names) - len(self)))),
+                             np.concatenate((self.effort, np.zeros(len(names) - len(self)))))
+        indices = result.get_indices(other.names)
+        result.position[indices] = other.position
+        result.velocity[indices] = other.velocity
+        result.effort[indices] = other.effort
+        return result
+
+    def get_index(self, name):
+        """
+        :rtype: int
+        """
+        return self._name_to_index[name]
+
+    def get_indices(self, names):
+        """
+        :type names: list
+        :return: index of each name in the arrays
+        :rtype: np.ndarray
+        """
+        return np.array([self._name_to_index[name] for name in names], dtype=int)
+
+    def __getitem__(self, name):
+        return JointStateView(self, self._name_to_index[name])
+
+    def __contains__(self, name):
+        return name in self._name_to_index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other):
+        if not isinstance(other, JointStates):
+            return super(JointStates, self).__eq__(other)
+        if set(self.names) != set(other.names):
+            return False
+        indices = other.get_indices(self.names)
+        return np.array_equal(self.position, other.position[indices]) and \
+               np.array_equal(self.velocity, other.velocity[indices]) and \
+               np.array_equal(self.effort, other.effort[indices])
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return u'\n'.join(str(self[name]) for name in self.names)
+
+
 class Trajectory(object):
     def __init__(self):
         self._points = OrderedDict()
@@ -43,7 +226,9 @@ class Trajectory(object):
 
 
 class ClosestPointInfo(object):
-    # TODO why no named tuple?
+    __slots__ = [u'position_on_a', u'position_on_b', u'contact_distance', u'contact_normal', u'min_dist', u'link_a',
+                 u'body_b', u'link_b', u'old_key', u'frame']
+
     def __init__(self, position_on_a, position_on_b, contact_distance, min_dist, link_a, body_b, link_b, contact_normal,
                  old_key, frame=u'base_footprint'):
         self.position_on_a = position_on_a
@@ -59,87 +244,171 @@ class ClosestPointInfo(object):
 
 
 class Collisions(object):
-    def __init__(self, robot):
+    """
+    Closest points of the robot, saved as one row per closest point in a numpy array.
+    Position on a is in the frame of the child link of the movable parent joint of link a, position on b and the
+    contact normal are in the robot root frame, once World.transform_contact_info was called.
+    For the controller, the closest points are sorted into fixed slots per movable joint and per self collision pair,
+    such that god map paths like ['external_collisions', joint_name, idx, Collisions.CONTACT_DISTANCE] point directly
+    into these arrays.
+    """
+    # columns of a closest point
+    POSITION_ON_A = 0
+    POSITION_ON_B = 3
+    CONTACT_NORMAL = 6
+    CONTACT_DISTANCE = 9
+    MIN_DIST = 10
+    SIZE = 11
+
+    def __init__(self, robot, keys=(), data=None, number_of_external_collisions=20):
         """
         :type robot: giskardpy.symengine_robot.Robot
+        :param keys: (link_a, body_b, link_b) of each closest point
+        :type keys: list
+        :param data: one row per closest point, see the column constants
+        :type data: np.ndarray
+        :param number_of_external_collisions: slots per movable joint
+        :type number_of_external_collisions: int
         """
         self.robot = robot
+        self.keys = list(keys)
+        if data is None:
+            data = np.empty((0, self.SIZE))
+        self.data = data
+        self.number_of_external_collisions = number_of_external_collisions
+        robot_name = robot.get_name()
+        # movable joint -> rows of external collisions
+        self._external_rows = defaultdict(list)
+        # (link_a, link_b) -> rows of self collisions
+        self._self_rows = defaultdict(list)
+        self.frames = []
+        for i, (link_a, body_b, link_b) in enumerate(self.keys):
+            movable_joint = robot.get_controlled_parent_joint(link_a)
+            self.frames.append(robot.get_child_link_of_joint(movable_joint))
+            if body_b == robot_name:
+                self._self_rows[link_a, link_b].append(i)
+            else:
+                self._external_rows[movable_joint].append(i)
+        self._external_collisions = None
+        # movable joint -> rows in the slots of external_collisions
+        self._external_slot_rows = {}
+        self._self_collisions = None
 
-        # FIXME I'm assuming that self collisions only has collisions for pairs of objects
-        #   which results in a list of length 1 always, which is why I don't sort to safe time
-        #   I start with a list of default collisions in case there was none
-        def f1():
-            return [self._default_collision('', '', '')]
-
-        self.self_collisions = defaultdict(f1)
-
-        def f2():
-            return SortedKeyList([self._default_collision('', '', '')] * 20,
-                                 key=lambda x: x.contact_distance)
-
-        self.external_collision = defaultdict(f2)
-        self.all_collisions = set()
-
-    def add(self, key, contact):
-        """
-        :type key: list
-        :type contact: ClosestPointInfo
-        :return:
-        """
-        body_b = key[1]
-        movable_joint = self.robot.get_controlled_parent_joint(key[0])
-        self.all_collisions.add(contact)
-
-        if body_b == self.robot.get_name():
-            # self.self_collisions[key].add(contact)
-            # self.self_collisions[key[:-1]].add(contact)
-            # self.self_collisions[key[:-2]].add(contact)
-            self.self_collisions[key[0], key[2]].insert(0, contact)
-            # self.self_collisions[movable_joint].add(contact)
-        else:
-            # self.external_collision[key].add(contact)
-            # self.external_collision[key[:-1]].add(contact)
-            # self.external_collision[key[:-2]].add(contact)
-            self.external_collision[movable_joint].add(contact)
-
-    def _default_collision(self, link_a, body_b, link_b):
-        return ClosestPointInfo([0, 0, 0],
-                                [0, 0, 0],
-                                100,
-                                0,
-                                link_a,
-                                body_b,
-                                link_b,
-                                [0, 0, 1],
-                                (link_a, body_b, link_b))
-
-    # def get(self, key):
-    #     if key in self.external_collision:
-    #         return self.external_collision[key]
-    #     elif key in self.self_collisions:
-    #         return self. self_collisions[key]
+    @classmethod
+    def _default_collisions(cls, number):
+        """
+        :return: closest points that are far away
+        :rtype: np.ndarray
+        """
+        default = np.zeros((number, cls.SIZE))
+        default[:, cls.CONTACT_NORMAL + 2] = 1
+        default[:, cls.CONTACT_DISTANCE] = 100
+        return default
+
+    def _sort(self):
+        number = self.number_of_external_collisions
+        external_default = self._default_collisions(number)
+        self._external_collisions = defaultdict(lambda: external_default)
+        slots = np.tile(external_default, (len(self._external_rows), 1, 1))
+        for block, (joint_name, rows) in zip(slots, self._external_rows.items()):
+            rows = np.array(rows)
+            distances = self.data[rows, self.CONTACT_DISTANCE]
+            if len(rows) > number:
+                closest = np.argpartition(distances, number - 1)[:number]
+                rows = rows[closest]
+                distances = distances[closest]
+            rows = rows[np.argsort(distances)]
+            block[:len(rows)] = self.data[rows]
+            self._external_collisions[joint_name] = block
+            self._external_slot_rows[joint_name] = rows
+
+        self_default = self._default_collisions(1)
+        self._self_collisions = defaultdict(lambda: defaultdict(lambda: self_default))
+        for (link_a, link_b), rows in self._self_rows.items():
+            closest = rows[np.argmin(self.data[rows, self.CONTACT_DISTANCE])]
+            self._self_collisions[link_a][link_b] = self.data[closest:closest + 1].copy()
+
+    @property
+    def external_collisions(self):
+        """
+        :return: movable joint -> array with the closest points sorted by contact distance
+        :rtype: dict
+        """
+        if self._external_collisions is None:
+            self._sort()
+        return self._external_collisions
+
+    @property
+    def self_collisions(self):
+        """
+        :return: link_a -> link_b -> array with the closest point
+        :rtype: dict
+        """
+        if self._self_collisions is None:
+            self._sort()
+        return self._self_collisions
+
+    def transform(self, root_T_map):
+        """
+        Transforms the closest points from map into the frames described in the class doc.
+        :type root_T_map: np.ndarray
+        """
+        robot_root = self.robot.get_root()
+        frame_rows = defaultdict(list)
+        for i, frame in enumerate(self.frames):
+            frame_rows[frame].append(i)
+        a = slice(self.POSITION_ON_A, self.POSITION_ON_A + 3)
+        for frame, rows in frame_rows.items():
+            f_T_map = np.dot(self.robot.get_fk_np(frame, robot_root), root_T_map)
+            self.data[rows, a] = np.dot(self.data[rows, a], f_T_map[:3, :3].T) + f_T_map[:3, 3]
+        b = slice(self.POSITION_ON_B, self.POSITION_ON_B + 3)
+        self.data[:, b] = np.dot(self.data[:, b], root_T_map[:3, :3].T) + root_T_map[:3, 3]
+        n = slice(self.CONTACT_NORMAL, self.CONTACT_NORMAL + 3)
+        self.data[:, n] = np.dot(self.data[:, n], root_T_map[:3, :3].T)
+        self._external_collisions = None
+        self._self_collisions = None
+
+    def _closest_point_info(self, row, key, frame):
+        return ClosestPointInfo(row[self.POSITION_ON_A:self.POSITION_ON_A + 3],
+                                row[self.POSITION_ON_B:self.POSITION_ON_B + 3],
+                                row[self.CONTACT_DISTANCE],
+                                row[self.MIN_DIST],
+                                key[0],
+                                key[1],
+                                key[2],
+                                row[self.CONTACT_NORMAL:self.CONTACT_NORMAL + 3],
+                                key,
+                                frame)
 
     def get_external_collisions(self, joint_name):
         """
         Collisions are saved as a list for each movable robot joint, sorted by contact distance
         :type joint_name: str
-        :rtype: ClosestPointInfo
+        :rtype: list
         """
-        return self.external_collision[joint_name]
+        frame = self.robot.get_child_link_of_joint(joint_name)
+        slots = self.external_collisions[joint_name]
+        keys = [self.keys[i] for i in self._external_slot_rows.get(joint_name, [])]
+        keys += [(u'', u'', u'')] * (len(slots) - len(keys))
+        return [self._closest_point_info(row, key, frame) for row, key in zip(slots, keys)]
 
     def get_self_collisions(self, link_a, link_b):
         """
         Make sure that link_a < link_b, the reverse collision is not saved.
         :type link_a: str
         :type link_b: str
-        :return:
-        :rtype: ClosestPointInfo
+        :rtype: list
         """
-        # FIXME maybe check for reverse key?
-        return self.self_collisions[link_a, link_b]
+        frame = self.robot.get_child_link_of_joint(self.robot.get_controlled_parent_joint(link_a))
+        return [self._closest_point_info(row, (link_a, self.robot.get_name(), link_b), frame)
+                for row in self.self_collisions[link_a][link_b]]
 
     def __contains__(self, item):
-        return item in self.self_collisions or item in self.external_collision
+        return item in self._self_rows or item in self._external_rows
 
     def items(self):
-        return self.all_collisions
+        """
+        :return: a ClosestPointInfo for every closest point, they are views on the underlying array
+        :rtype: list
+        """
+        return [self._closest_point_info(row, key, frame) for row, key, frame in zip(self.data, self.keys, self.frames)]
@@ -20,6 +20,7 @@ from giskardpy.plugin_action_server import GoalReceived, SendResult, GoalCancele
 from giskardpy.plugin_attached_tf_publicher import TFPlugin
 from giskardpy.plugin_cleanup import CleanUp
 from giskardpy.plugin_collision_checker import CollisionChecker
+from giskardpy.plugin_compile_controller import CompileController
 from giskardpy.plugin_configuration import ConfigurationPlugin
 from giskardpy.plugin_cpi_marker import CPIMarker
 from giskardpy.plugin_goal_reached import GoalReachedPlugin
@@ -57,6 +58,14 @@ def initialize_god_map():
         nWSR = None
     god_map.safe_set_data(identifier.nWSR, nWSR)
 
+    # fix compiler
+    if god_map.safe_get_data(identifier.qp_compiler) in [u'None', 0]:
+        god_map.safe_set_data(identifier.qp_compiler, None)
+
+    # default qp solver backend
+    if not god_map.safe_get_data(identifier.qp_solver_backend):
+        god_map.safe_set_data(identifier.qp_solver_backend, u'qpoases')
+
     pbw.start_pybullet(god_map.safe_get_data(identifier.gui))
     while not rospy.is_shutdown():
         try:
@@ -82,7 +91,8 @@ def initialize_god_map():
     joint_acc_symbols = process_joint_specific_params(identifier.joint_acc, identifier.default_joint_acc, god_map)
 
     world = PyBulletWorld(god_map.safe_get_data(identifier.gui),
-                          blackboard.god_map.safe_get_data(identifier.data_folder))
+                          blackboard.god_map.safe_get_data(identifier.data_folder),
+                          god_map.safe_get_data(identifier.number_of_collision_workers))
     god_map.safe_set_data(identifier.world, world)
     robot = WorldObject(god_map.safe_get_data(identifier.robot_description),
                         None,
@@ -149,6 +159,7 @@ def grow_tree():
     # ----------------------------------------------
     planning_1 = success_is_failure(Sequence)(u'planning I')
     planning_1.add_child(GoalToConstraints(u'update constraints', action_server_name))
+    planning_1.add_child(CompileController(u'compile controller', action_server_name))
     planning_1.add_child(planning_2)
     # ----------------------------------------------
     # ----------------------------------------------
@@ -1,30 +1,46 @@
 import copy
 from copy import copy
-from multiprocessing import Lock
+from threading import Condition, Lock
+from weakref import WeakSet
+
+import numpy as np
 
 from giskardpy import symbolic_wrapper as w
 
-def get_member(identifier, member):
+ITEM, INDEX, CALL, ATTRIBUTE = range(4)
+
+
+def get_member_and_access(identifier, member):
     """
-    :param identifier:
-    :type identifier: Union[None, dict, list, tuple, object]
-    :param member:
-    :type member: str
-    :return:
+    Like get_member, but also returns how the member was accessed.
+    :return: member, one of ITEM, INDEX, CALL, ATTRIBUTE or None
+    :rtype: tuple
     """
     try:
-        return identifier[member]
+        return identifier[member], ITEM
     except TypeError:
         if callable(identifier):
-            return identifier(*member)
+            return identifier(*member), CALL
         try:
-            return getattr(identifier, member)
+            return getattr(identifier, member), ATTRIBUTE
         except TypeError:
             pass
     except IndexError:
-        return identifier[int(member)]
+        return identifier[int(member)], INDEX
     except RuntimeError:
         pass
+    return None, None
+
+
+def get_member(identifier, member):
+    """
+    :param identifier:
+    :type identifier: Union[None, dict, list, tuple, object]
+    :param member:
+    :type member: str
+    :return:
+    """
+    return get_member_and_access(identifier, member)[0]
 
 
 def get_data(identifier, data, default_value=0.0):
@@ -56,11 +72,185 @@ def get_data(identifier, data, default_value=0.0):
     return result
 
 
+class AccessorNode(object):
+    """
+    One member of an identifier in an AccessorPlan, identifiers with the same prefix share nodes.
+    """
+    __slots__ = [u'member', u'children', u'output_indices', u'parent_type', u'access', u'volatile', u'has_volatile']
+
+    def __init__(self, member, volatile=False):
+        self.member = member
+        self.children = []
+        self.output_indices = []
+        # lists and tuples are parameters of function calls, whose results can change without a write to the god map
+        self.volatile = volatile or isinstance(member, (list, tuple))
+        # whether this node or one of its descendants is volatile
+        self.has_volatile = self.volatile
+        # type of the parent value and how the member was accessed last time, to skip get_member's try except chain
+        self.parent_type = None
+        self.access = None
+
+    def resolve(self, parent):
+        """
+        :return: the member of parent, behaves like get_member
+        """
+        if type(parent) is self.parent_type:
+            try:
+                if self.access == ITEM:
+                    return parent[self.member]
+                if self.access == ATTRIBUTE:
+                    return getattr(parent, self.member)
+                if self.access == CALL:
+                    return parent(*self.member)
+                if self.access == INDEX:
+                    return parent[int(self.member)]
+            except (TypeError, IndexError, RuntimeError):
+                pass
+        result, self.access = get_member_and_access(parent, self.member)
+        self.parent_type = type(parent)
+        return result
+
+
+class AccessorPlan(object):
+    """
+    Evaluates a list of identifiers at once. The identifiers are stored as a tree, such that every shared prefix,
+    including function calls, is only resolved once per evaluation.
+    Entries are only reevaluated, if their namespace was written since the last evaluation or if they are the result
+    of a function call. Changes to the god map without set_data are therefore not noticed.
+    """
+
+    def __init__(self, identifiers, default_value=0.0):
+        """
+        :param identifiers: list of identifiers, see get_data
+        :type identifiers: list
+        """
+        self.default_value = default_value
+        self.root = AccessorNode(None)
+        for i, identifier in enumerate(identifiers):
+            node = self.root
+            for member in identifier:
+                for child in node.children:
+                    if child.member == member:
+                        node = child
+                        break
+                else:
+                    child = AccessorNode(member, node.volatile)
+                    node.children.append(child)
+                    node = child
+            node.output_indices.append(i)
+        self.init_has_volatile(self.root)
+        self.out = np.zeros(len(identifiers))
+        # versions of the namespaces at the last evaluation
+        self.versions = {}
+
+    def init_has_volatile(self, node):
+        for child in node.children:
+            node.has_volatile |= self.init_has_volatile(child)
+        return node.has_volatile
+
+    def get_values(self, data, versions):
+        """
+        :param data: the data of a god map
+        :type data: dict
+        :param versions: maps namespaces to the version of their last write
+        :type versions: dict
+        :return: the values of the identifiers, missing entries are default_value and non numbers nan.
+                 The array is reused by the next call and must not be changed.
+        :rtype: np.ndarray
+        """
+        out = self.out
+        stack = []
+        for child in self.root.children:
+            version = versions.get(child.member)
+            if child.member not in self.versions or self.versions[child.member] != version:
+                self.versions[child.member] = version
+                stack.append((child, data, False))
+            elif child.has_volatile:
+                stack.append((child, data, True))
+        while stack:
+            node, parent, only_volatile = stack.pop()
+            try:
+                value = node.resolve(parent)
+            except (AttributeError, KeyError, IndexError):
+                self.set_default(node)
+                continue
+            if not only_volatile or node.volatile:
+                for i in node.output_indices:
+                    try:
+                        out[i] = value
+                    except (TypeError, ValueError):
+                        out[i] = np.nan
+            for child in node.children:
+                if not only_volatile or child.has_volatile:
+                    stack.append((child, value, only_volatile))
+        return out
+
+    def set_default(self, node):
+        self.out[node.output_indices] = self.default_value
+        for child in node.children:
+            self.set_default(child)
+
+
+class ReadWriteLock(object):
+    """
+    Allows many readers or one writer at a time. Waiting writers block new readers, such that they don't starve.
+    Not reentrant.
+    """
+
+    def __init__(self):
+        self.condition = Condition(Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    # the lock itself is used like a normal lock for writing
+    acquire = acquire_write
+    release = release_write
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release_write()
+
+
 class GodMap(object):
     """
     Data structure used by plugins to exchange information.
+    safe_get_data and get_values can run in parallel, while safe_set_data and 'with god_map:' are exclusive.
+    snapshot returns a consistent read only copy, that does not block writers.
+    Dicts and lists in the god map are never replaced by a write, references to them held by plugins stay valid.
     """
 
+    # accessor plans of symbol lists that are no longer used get removed, when there are more than this
+    max_accessor_plans = 20
+
     # TODO give this fucker a lock
     def __init__(self):
         self._data = {}
@@ -69,7 +259,14 @@ class GodMap(object):
         self.expr_to_key = {}
         self.default_value = 0
         self.last_expr_values = {}
-        self.lock = Lock()
+        self.accessor_plans = {}
+        # maps namespaces to the value of self.version at their last write
+        self.namespace_versions = {}
+        self.version = 0
+        self.accessor_plans_lock = Lock()
+        # snapshots that were not released yet, they need a copy of every dict and list before it gets changed
+        self.snapshots = WeakSet()
+        self.lock = ReadWriteLock()
 
     def __copy__(self):
         god_map_copy = GodMap()
@@ -100,9 +297,25 @@ class GodMap(object):
         return get_data(identifier, self._data, self.default_value)
 
     def safe_get_data(self, identifier):
+        self.lock.acquire_read()
+        try:
+            return self.get_data(identifier)
+        finally:
+            self.lock.release_read()
+
+    def snapshot(self):
+        """
+        The snapshot shares all data with the god map. Dicts and lists on the path of a write get copied into the
+        snapshot before they are changed, the snapshot does not see these changes. Attributes of other objects and
+        changes without set_data are shared with the snapshot.
+        Call release on the snapshot when it is no longer needed, such that writes don't have to copy for it anymore.
+        :return: a read only copy of the current state, which can be read without locking
+        :rtype: GodMapSnapshot
+        """
         with self.lock:
-            r = self.get_data(identifier)
-        return r
+            snapshot = GodMapSnapshot(self)
+            self.snapshots.add(snapshot)
+            return snapshot
 
     def to_symbol(self, identifier):
         """
@@ -124,16 +337,26 @@ class GodMap(object):
 
     def get_values(self, symbols):
         """
-        :return: a dict which maps all registered expressions to their values or 0 if there is no number entry
-        :rtype: dict
+        :param symbols: names of registered symbols
+        :type symbols: list
+        :return: the values of the symbols, in the same order, 0 if there is no entry.
+                 The array is overwritten by the next call with the same symbols. Only entries of namespaces that
+                 were written with set_data since then and results of function calls are updated.
+        :rtype: np.ndarray
         """
-        # TODO potential speedup by only updating entries that have changed
-        # its a trap, this function only looks slow with lineprofiler
-        with self.lock:
-            # if exprs is None:
-            #     exprs = self.expr_to_key.keys()
-            # return {expr: self.get_data(self.expr_to_key[expr]) for expr in exprs}
-            return [self.get_data(self.expr_to_key[expr]) for expr in symbols]
+        symbols = tuple(symbols)
+        self.lock.acquire_read()
+        try:
+            with self.accessor_plans_lock:
+                plan = self.accessor_plans.get(symbols)
+                if plan is None:
+                    if len(self.accessor_plans) > self.max_accessor_plans:
+                        self.accessor_plans.clear()
+                    plan = AccessorPlan([self.expr_to_key[expr] for expr in symbols], self.default_value)
+                    self.accessor_plans[symbols] = plan
+                return plan.get_values(self._data, self.namespace_versions)
+        finally:
+            self.lock.release_read()
 
     def get_registered_symbols(self):
         """
@@ -152,12 +375,16 @@ class GodMap(object):
         if len(identifier) == 0:
             raise ValueError(u'key is empty')
         namespace = identifier[0]
+        self.version += 1
+        self.namespace_versions[namespace] = self.version
         if namespace not in self._data:
             if len(identifier) > 1:
                 raise KeyError(u'Can not access member of unknown namespace: {}'.format(identifier))
             else:
                 self._data[namespace] = value
         else:
+            for snapshot in list(self.snapshots):
+                snapshot.detach(self._data, identifier[:-1])
             result = self._data[namespace]
             for member in identifier[1:-1]:
                 result = get_member(result, member)
@@ -175,3 +402,64 @@ class GodMap(object):
     def safe_set_data(self, identifier, value):
         with self.lock:
             self.set_data(identifier, value)
+
+
+class GodMapSnapshot(GodMap):
+    """
+    Read only state of a GodMap, see GodMap.snapshot.
+    """
+
+    def __init__(self, god_map):
+        """
+        :type god_map: GodMap
+        """
+        super(GodMapSnapshot, self).__init__()
+        self._data = copy(god_map._data)
+        self.key_to_expr = god_map.key_to_expr
+        self.expr_to_key = god_map.expr_to_key
+        self.default_value = god_map.default_value
+        # the accessor plans know which namespaces have to be reread, because of the versions
+        self.accessor_plans = god_map.accessor_plans
+        self.accessor_plans_lock = god_map.accessor_plans_lock
+        self.namespace_versions = copy(god_map.namespace_versions)
+        self.god_map = god_map
+
+    def detach(self, data, path):
+        """
+        Copies the dicts and lists on path, that are still shared with data, into this snapshot.
+        :param data: the data of the god map, before it gets changed
+        :type data: dict
+        :param path: identifier of the container that gets changed
+        :type path: list
+        """
+        own = self._data
+        for member in path:
+            if not isinstance(own, (dict, list)):
+                # attributes of objects are shared
+                return
+            try:
+                own_value = get_member(own, member)
+                value = get_member(data, member)
+            except (AttributeError, KeyError, IndexError, TypeError):
+                return
+            if own_value is value and isinstance(value, (dict, list)):
+                own_value = copy(value)
+                own[int(member) if isinstance(own, list) else member] = own_value
+            own = own_value
+            data = value
+
+    def release(self):
+        """
+        Writes to the god map no longer copy data for this snapshot, later changes may be visible in it afterwards.
+        """
+        with self.god_map.lock:
+            self.god_map.snapshots.discard(self)
+
+    def safe_get_data(self, identifier):
+        return self.get_data(identifier)
+
+    def set_data(self, identifier, value):
+        raise TypeError(u'god map snapshots are read only')
+
+    def snapshot(self):
+        return self
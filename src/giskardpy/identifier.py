@@ -13,6 +13,8 @@ closest_point = [u'cpi']
 collisions = [u'collisions']
 collision_goal_identifier = [u'collision_goal']
 soft_constraint_identifier = [u'soft_constraints']
+soft_constraint_blocks = [u'soft_constraint_blocks']
+soft_constraint_fk_links = [u'soft_constraint_fk_links']
 execute = [u'execute']
 next_move_goal = [u'next_move_goal']
 qp_data = [u'qp_data']
@@ -58,6 +60,9 @@ default_joint_cost_identifier = joint_cost + [u'default']
 # qp solver
 qp_solver = rosparam + [u'qp_solver']
 nWSR = qp_solver + [u'nWSR']
+qp_solver_backend = qp_solver + [u'backend']
+record_qp = qp_solver + [u'record']
+qp_compiler = qp_solver + [u'compiler']
 
 # plugins
 plugins = rosparam + [u'plugins']
@@ -75,6 +80,7 @@ tree_tick_rate = behavior_tree + [u'tree_tick_rate']
 
 # collision avoidance
 collision_avoidance = rosparam + [u'collision_avoidance']
+number_of_collision_workers = collision_avoidance + [u'number_of_workers']
 
 distance_thresholds = collision_avoidance + [u'distance_thresholds']
 default_collision_distances = distance_thresholds + [u'default']
@@ -1,3 +1,5 @@
+import sys
+
 import rospy
 
 def logdebug(msg):
@@ -15,3 +17,19 @@ def logerr(msg):
 def logfatal(msg):
     rospy.logfatal(msg)
 
+
+
+def log_to_stdout(prefix):
+    """
+    Redirects all log functions of this module to stdout. Has to be called in worker processes, they are forks of
+    giskard and share its ros connections, writing to /rosout would corrupt them.
+    :param prefix: is put in front of every message
+    :type prefix: str
+    """
+    global logdebug, loginfo, logwarn, logerr, logfatal
+
+    def log(msg):
+        sys.stdout.write(u'[{}] {}\n'.format(prefix, msg))
+        sys.stdout.flush()
+
+    logdebug = loginfo = logwarn = logerr = logfatal = log
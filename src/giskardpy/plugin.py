@@ -13,16 +13,40 @@ from giskardpy import logging
 class GiskardBehavior(Behaviour):
     def __init__(self, name):
         self.god_map = Blackboard().god_map
+        self.snapshot = None
         self.world = None
         self.robot = None
         super(GiskardBehavior, self).__init__(name)
 
+    def tick(self):
+        try:
+            for node in super(GiskardBehavior, self).tick():
+                yield node
+        finally:
+            self.release_snapshot()
+
     def get_god_map(self):
         """
         :rtype: giskardpy.god_map.GodMap
         """
         return self.god_map
 
+    def get_snapshot(self):
+        """
+        Reading from the snapshot doesn't block writers and all reads of one tick see the same state.
+        :return: read only snapshot of the god map, which is taken at the first call during a tick and released at
+                 the end of it
+        :rtype: giskardpy.god_map.GodMapSnapshot
+        """
+        if self.snapshot is None:
+            self.snapshot = self.get_god_map().snapshot()
+        return self.snapshot
+
+    def release_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.release()
+            self.snapshot = None
+
     def get_world(self):
         """
         :rtype: giskardpy.world.World
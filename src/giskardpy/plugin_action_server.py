@@ -46,9 +46,11 @@ class ActionServerHandler(object):
     def has_goal(self):
         return not self.goal_queue.empty()
 
-    def send_feedback(self):
-        # TODO
-        pass
+    def send_feedback(self, feedback):
+        """
+        :type feedback: giskard_msgs.msg.MoveFeedback
+        """
+        self._as.publish_feedback(feedback)
 
     def send_preempted(self, result=None):
         # TODO put shit in queue
@@ -38,9 +38,9 @@ class CollisionChecker(GiskardBehavior):
         return SetBoolResponse()
 
     def initialise(self):
-        collision_goals = self.get_god_map().safe_get_data(identifier.collision_goal_identifier)
+        collision_goals = self.get_snapshot().safe_get_data(identifier.collision_goal_identifier)
         self.collision_matrix = self.get_world().collision_goals_to_collision_matrix(collision_goals,
-                                                                                     self.get_god_map().safe_get_data(
+                                                                                     self.get_snapshot().safe_get_data(
                                                                                          identifier.distance_thresholds))
 
         super(CollisionChecker, self).initialise()
@@ -0,0 +1,160 @@
+from multiprocessing import Process
+from time import time
+
+from giskard_msgs.msg._MoveFeedback import MoveFeedback
+from py_trees import Status
+
+import giskardpy.identifier as identifier
+from giskardpy import logging
+from giskardpy.plugin_action_server import ActionServerBehavior
+from giskardpy.symengine_controller import InstantaneousController
+
+# maps the file names of compiled functions to the BackgroundCompilation that creates them
+_compilations = {}
+
+
+def make_controller(god_map, robot, soft_constraints, soft_constraint_blocks=(), fk_links=()):
+    """
+    :type god_map: giskardpy.god_map.GodMap
+    :type robot: giskardpy.symengine_robot.Robot
+    :type soft_constraints: dict
+    :param soft_constraint_blocks: see InstantaneousController.set_soft_constraint_blocks
+    :type soft_constraint_blocks: list
+    :param fk_links: see InstantaneousController.set_fk_links
+    :type fk_links: set
+    :rtype: InstantaneousController
+    """
+    controller = InstantaneousController(robot,
+                                         u'{}/{}/'.format(god_map.safe_get_data(identifier.data_folder),
+                                                          robot.get_name()),
+                                         god_map.safe_get_data(identifier.qp_solver_backend),
+                                         god_map.safe_get_data(identifier.qp_compiler))
+    controller.set_controlled_joints(robot.controlled_joints)
+    controller.update_soft_constraints(soft_constraints)
+    controller.set_soft_constraint_blocks(soft_constraint_blocks)
+    controller.set_fk_links(set(fk_links))
+    return controller
+
+
+def _compile_controller(controller):
+    """
+    Target of the worker process.
+    :type controller: InstantaneousController
+    """
+    logging.log_to_stdout(u'compile worker')
+    controller.compile()
+
+
+class BackgroundCompilation(object):
+    """
+    Compiles a controller in a worker process, which puts the result into the cache of compiled functions.
+    """
+
+    def __init__(self, controller):
+        """
+        :type controller: InstantaneousController
+        """
+        self.file_names = tuple(controller.get_function_file_names())
+        self.number_of_constraints = len(controller.soft_constraints)
+        self.start_time = time()
+        self.process = Process(target=_compile_controller, args=(controller,))
+        self.process.daemon = True
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def succeeded(self):
+        """
+        :return: whether the worker has finished without errors
+        :rtype: bool
+        """
+        self.process.join(0)
+        return self.process.exitcode == 0
+
+    def get_runtime(self):
+        return time() - self.start_time
+
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+            logging.loginfo(u'canceled compilation of controller with {} constraints after {:.1f}s'.format(
+                self.number_of_constraints, self.get_runtime()))
+        _compilations.pop(self.file_names, None)
+
+
+def compile_in_background(controller):
+    """
+    Starts a worker that compiles controller, unless its function is already cached or being compiled.
+    :type controller: InstantaneousController
+    :return: the worker or None, if there is nothing to do
+    :rtype: BackgroundCompilation
+    """
+    file_names = tuple(controller.get_function_file_names())
+    compilation = _compilations.get(file_names)
+    if compilation is not None and compilation.is_alive():
+        return compilation
+    if controller.is_compiled():
+        return None
+    logging.loginfo(u'compiling controller with {} constraints in the background'.format(
+        len(controller.soft_constraints)))
+    compilation = BackgroundCompilation(controller)
+    _compilations[file_names] = compilation
+    return compilation
+
+
+class CompileController(ActionServerBehavior):
+    """
+    Compiles the controller for the current soft constraints in a worker process, such that the tree keeps ticking
+    and a canceled goal stops the compilation. The ControllerPlugin afterwards loads the compiled function from the
+    cache. If the worker fails, the ControllerPlugin compiles the controller itself.
+    While the worker is running, the action server sends feedback and the progress is logged.
+    """
+    # seconds between progress messages
+    PROGRESS_PERIOD = 2.
+
+    def __init__(self, name, as_name):
+        super(CompileController, self).__init__(name, as_name)
+        self.compilation = None
+        self.last_progress = 0
+
+    def initialise(self):
+        super(CompileController, self).initialise()
+        soft_constraints = self.get_god_map().safe_get_data(identifier.soft_constraint_identifier)
+        soft_constraint_blocks = self.get_god_map().safe_get_data(identifier.soft_constraint_blocks)
+        fk_links = self.get_god_map().safe_get_data(identifier.soft_constraint_fk_links)
+        controller = make_controller(self.get_god_map(), self.get_robot(), soft_constraints, soft_constraint_blocks,
+                                     fk_links)
+        self.compilation = compile_in_background(controller)
+        self.last_progress = time()
+
+    def update(self):
+        if self.compilation is None:
+            return Status.SUCCESS
+        if self.get_as().is_preempt_requested() or self.get_blackboard_exception() is not None:
+            # GoalCanceled ends the planning
+            self.compilation.cancel()
+            self.compilation = None
+            return Status.SUCCESS
+        if self.compilation.is_alive():
+            if time() - self.last_progress > self.PROGRESS_PERIOD:
+                self.last_progress = time()
+                self.get_as().send_feedback(MoveFeedback())
+                logging.loginfo(u'compiling controller with {} constraints for {:.1f}s'.format(
+                    self.compilation.number_of_constraints, self.compilation.get_runtime()))
+            return Status.RUNNING
+        if self.compilation.succeeded():
+            logging.loginfo(u'compiled controller in {:.1f}s'.format(self.compilation.get_runtime()))
+        else:
+            logging.logwarn(u'compilation in the background failed with exit code {}'.format(
+                self.compilation.process.exitcode))
+            _compilations.pop(self.compilation.file_names, None)
+        self.compilation = None
+        return Status.SUCCESS
+
+    def terminate(self, new_status):
+        if new_status == Status.INVALID and self.compilation is not None:
+            self.compilation.cancel()
+            self.compilation = None
+        super(CompileController, self).terminate(new_status)
@@ -8,12 +8,12 @@ from sensor_msgs.msg import JointState
 import giskardpy.identifier as identifier
 from giskardpy.plugin import GiskardBehavior
 from giskardpy.tfwrapper import lookup_pose, wait_for_transform
-from giskardpy.utils import to_joint_state_dict
+from giskardpy.utils import to_joint_states
 
 
 class ConfigurationPlugin(GiskardBehavior):
     """
-    Listens to a joint state topic, transforms it into a dict and writes it to the got map.
+    Listens to a joint state topic, transforms it into JointStates and writes it to the got map.
     Gets replace with a kinematic sim plugin during a parallel universe.
     """
 
@@ -44,7 +44,7 @@ class ConfigurationPlugin(GiskardBehavior):
                 js = self.lock.get()
             else:
                 js = self.lock.get_nowait()
-            self.mjs = to_joint_state_dict(js)
+            self.mjs = to_joint_states(js)
         except Empty:
             pass
 
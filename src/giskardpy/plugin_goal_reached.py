@@ -4,6 +4,7 @@ from time import time
 from py_trees import Status
 
 import giskardpy.identifier as identifier
+from giskardpy.data_types import JointStates
 from giskardpy.plugin import GiskardBehavior
 from giskardpy import logging
 
@@ -15,13 +16,13 @@ class GoalReachedPlugin(GiskardBehavior):
         self.joint_convergence_threshold = self.get_god_map().safe_get_data(identifier.joint_convergence_threshold)
 
     def update(self):
-        current_js = self.get_god_map().safe_get_data(identifier.joint_states)
+        current_js = JointStates.from_dict(self.get_god_map().safe_get_data(identifier.joint_states))
         sample_period = self.get_god_map().safe_get_data(identifier.sample_period)
         planning_time = self.get_god_map().safe_get_data(identifier.time) * sample_period
         # TODO make 1 a parameter
         # FIXME this 1 s only applies to the first traj point
         if planning_time >= 1:
-            if np.abs([v.velocity for v in current_js.values()]).max() < self.joint_convergence_threshold:
+            if np.abs(current_js.velocity).max() < self.joint_convergence_threshold:
                 logging.loginfo(u'found goal trajectory with length {}s in {}s'.format(planning_time,
                                                                              time() - self.get_blackboard().runtime))
                 # self.debug_print()
@@ -4,7 +4,7 @@ import json
 import traceback
 from copy import copy
 from multiprocessing import Process
-from time import time, sleep
+from time import time, sleep, strftime
 
 from giskard_msgs.msg import MoveGoal, MoveCmd
 from py_trees import Status
@@ -16,6 +16,7 @@ from giskardpy.exceptions import InsolvableException, ImplementationException, G
 import giskardpy.identifier as identifier
 from giskardpy.plugin import GiskardBehavior
 from giskardpy.plugin_action_server import GetGoal
+from giskardpy.plugin_compile_controller import make_controller
 from giskardpy.symengine_controller import InstantaneousController
 from giskardpy.tfwrapper import transform_pose
 from giskardpy import logging
@@ -26,30 +27,36 @@ class ControllerPlugin(GiskardBehavior):
         super(ControllerPlugin, self).__init__(name)
         self.path_to_functions = self.get_god_map().safe_get_data(identifier.data_folder)
         self.nWSR = self.get_god_map().safe_get_data(identifier.nWSR)
+        self.record_qp = self.get_god_map().safe_get_data(identifier.record_qp)
         self.soft_constraints = None
+        self.controller = None
         self.qp_data = {}
         self.get_god_map().safe_set_data(identifier.qp_data, self.qp_data) # safe dict on godmap and work on ref
 
     def initialise(self):
         super(ControllerPlugin, self).initialise()
         self.init_controller()
+        if self.record_qp:
+            self.controller.start_recording(u'{}/qp_recordings/{}_{}.pickle.gz'.format(self.path_to_functions,
+                                                                                     self.get_robot().get_name(),
+                                                                                     strftime(u'%Y%m%d-%H%M%S')))
+
+    def terminate(self, new_status):
+        if self.controller is not None:
+            self.controller.stop_recording()
+        super(ControllerPlugin, self).terminate(new_status)
 
     def setup(self, timeout=0.0):
         return super(ControllerPlugin, self).setup(5.0)
 
     def init_controller(self):
-        new_soft_constraints = self.get_god_map().safe_get_data(identifier.soft_constraint_identifier)
+        new_soft_constraints = self.get_snapshot().safe_get_data(identifier.soft_constraint_identifier)
         if self.soft_constraints is None or set(self.soft_constraints.keys()) != set(new_soft_constraints.keys()):
             self.soft_constraints = copy(new_soft_constraints)
-            self.controller = InstantaneousController(self.get_robot(),
-                                                  u'{}/{}/'.format(self.path_to_functions, self.get_robot().get_name()))
-            self.controller.set_controlled_joints(self.get_robot().controlled_joints)
-            self.controller.update_soft_constraints(self.soft_constraints)
-            # p = Process(target=self.controller.compile)
-            # p.start()
-            # while p.is_alive():
-            #     sleep(0.05)
-            # p.join()
+            self.controller = make_controller(self.get_god_map(), self.get_robot(), self.soft_constraints,
+                                              self.get_snapshot().safe_get_data(identifier.soft_constraint_blocks),
+                                              self.get_snapshot().safe_get_data(identifier.soft_constraint_fk_links))
+            # usually loads the function that CompileController has compiled in the background
             self.controller.compile()
 
             self.qp_data[identifier.weight_keys[-1]], \
@@ -58,11 +65,11 @@ class ControllerPlugin(GiskardBehavior):
             self.qp_data[identifier.xdot_keys[-1]] = self.controller.get_qpdata_key_map()
 
     def update(self):
-        last_cmd = self.get_god_map().safe_get_data(identifier.cmd)
+        last_cmd = self.get_snapshot().safe_get_data(identifier.cmd)
         self.get_god_map().safe_set_data(identifier.last_cmd, last_cmd)
 
         expr = self.controller.get_expr()
-        expr = self.god_map.get_values(expr)
+        expr = self.get_snapshot().get_values(expr)
 
         next_cmd, \
         self.qp_data[identifier.H[-1]], \
@@ -1,9 +1,8 @@
-from collections import OrderedDict
-
+import numpy as np
 from py_trees import Status
 
-from giskardpy.data_types import SingleJointState
 import giskardpy.identifier as identifier
+from giskardpy.data_types import JointStates
 from giskardpy.plugin import GiskardBehavior
 
 
@@ -17,24 +16,41 @@ class KinSimPlugin(GiskardBehavior):
         :type sample_period: float
         """
         super(KinSimPlugin, self).__init__(name)
+        # (names of the joint states, commanded joints, index of each commanded joint or -1)
+        self.command_indices = (None, None, None)
 
     def initialise(self):
         self.sample_period = self.get_god_map().safe_get_data(identifier.sample_period)
         super(KinSimPlugin, self).initialise()
 
+    def get_command_indices(self, joint_states, motor_commands):
+        """
+        :type joint_states: giskardpy.data_types.JointStates
+        :type motor_commands: dict
+        :return: index of each joint in motor_commands in the arrays of joint_states, -1 for unknown joints
+        :rtype: np.ndarray
+        """
+        commanded_joints = list(motor_commands.keys())
+        names, last_commanded_joints, indices = self.command_indices
+        if names is not joint_states.names or last_commanded_joints != commanded_joints:
+            indices = np.array([joint_states.get_index(joint_name) if joint_name in joint_states else -1
+                                for joint_name in commanded_joints], dtype=int)
+            self.command_indices = (joint_states.names, commanded_joints, indices)
+        return indices
+
     def update(self):
         motor_commands = self.get_god_map().safe_get_data(identifier.cmd)
-        current_js = self.get_god_map().safe_get_data(identifier.joint_states)
+        current_js = JointStates.from_dict(self.get_god_map().safe_get_data(identifier.joint_states))
         next_js = None
         if motor_commands:
-            next_js = OrderedDict()
-            for joint_name, sjs in current_js.items():
-                if joint_name in motor_commands:
-                    cmd = motor_commands[joint_name]
-                else:
-                    cmd = 0.0
-                next_js[joint_name] = SingleJointState(sjs.name, sjs.position + cmd,
-                                                            velocity=cmd/self.sample_period)
+            indices = self.get_command_indices(current_js, motor_commands)
+            commands = np.fromiter(motor_commands.values(), dtype=float, count=len(indices))
+            known_joints = indices >= 0
+            step = np.zeros(len(current_js))
+            step[indices[known_joints]] = commands[known_joints]
+            next_js = current_js.copy(position=current_js.position + step,
+                                      velocity=step / self.sample_period,
+                                      effort=np.zeros(len(current_js)))
         if next_js is not None:
             self.get_god_map().safe_set_data(identifier.joint_states, next_js)
         else:
@@ -2,6 +2,7 @@ import inspect
 import itertools
 import json
 import traceback
+from collections import OrderedDict
 from time import time
 
 from giskard_msgs.msg import MoveCmd
@@ -10,9 +11,11 @@ from rospy_message_converter.message_converter import convert_ros_message_to_dic
 
 import giskardpy.constraints
 import giskardpy.identifier as identifier
+from giskardpy import logging
 from giskardpy.constraints import JointPosition, SelfCollisionAvoidance, ExternalCollisionAvoidance
 from giskardpy.exceptions import InsolvableException, ImplementationException
 from giskardpy.plugin_action_server import GetGoal
+from giskardpy.plugin_compile_controller import compile_in_background, make_controller
 
 
 def allowed_constraint_names():
@@ -29,6 +32,33 @@ class GoalToConstraints(GetGoal):
         self.controlled_joints = set()
         self.controllable_links = set()
         self.last_urdf = None
+        self.soft_constraints = {}
+        self.soft_constraint_blocks = []
+        # soft constraint key -> links used in its fk expressions
+        self.soft_constraint_fk_links = {}
+
+    def setup(self, timeout=0.0):
+        self.precompile_default_controller()
+        return super(GoalToConstraints, self).setup(timeout)
+
+    def precompile_default_controller(self):
+        """
+        Starts compiling the controller for the default joint and collision constraints in the background.
+        Joint goals have the same constraints, such that the first goal does not have to wait for the compilation.
+        """
+        try:
+            self.get_god_map().safe_set_data(identifier.constraints_identifier, {})
+            self.soft_constraints = {}
+            self.soft_constraint_blocks = []
+            self.soft_constraint_fk_links = {}
+            self.get_robot().pop_fk_expression_links()
+            self.add_js_controller_soft_constraints()
+            self.add_collision_avoidance_soft_constraints()
+            compile_in_background(make_controller(self.get_god_map(), self.get_robot(), self.soft_constraints,
+                                                  self.soft_constraint_blocks, self.get_fk_links()))
+        except Exception:
+            # only an optimization, the controller gets compiled again when the first goal arrives
+            logging.logerr(u'failed to precompile the default controller:\n{}'.format(traceback.format_exc()))
 
     def initialise(self):
         self.get_god_map().safe_set_data(identifier.collision_goal_identifier, None)
@@ -43,8 +73,12 @@ class GoalToConstraints(GetGoal):
 
         self.get_god_map().safe_set_data(identifier.constraints_identifier, {})
 
+        # only the links used by the following constraints are recorded
+        self.get_robot().pop_fk_expression_links()
         if self.has_robot_changed():
             self.soft_constraints = {}
+            self.soft_constraint_blocks = []
+            self.soft_constraint_fk_links = {}
             # TODO split soft contraints into js, coll and cart; update cart always and js/coll only when urdf changed, js maybe never
             self.add_js_controller_soft_constraints()
         self.add_collision_avoidance_soft_constraints()
@@ -69,6 +103,8 @@ class GoalToConstraints(GetGoal):
         self.get_god_map().safe_set_data(identifier.collision_goal_identifier, move_cmd.collisions)
 
         self.get_god_map().safe_set_data(identifier.soft_constraint_identifier, self.soft_constraints)
+        self.get_god_map().safe_set_data(identifier.soft_constraint_blocks, self.soft_constraint_blocks)
+        self.get_god_map().safe_set_data(identifier.soft_constraint_fk_links, self.get_fk_links())
         self.get_blackboard().runtime = time()
         return Status.SUCCESS
 
@@ -93,16 +129,42 @@ class GoalToConstraints(GetGoal):
                     params = convert_ros_message_to_dictionary(constraint)
                     del params[u'type']
                 c = C(self.god_map, **params)
-                soft_constraints = c.get_constraint()
-                self.soft_constraints.update(soft_constraints)
+                self.add_soft_constraint_block(c.get_constraint())
             except TypeError as e:
                 traceback.print_exc()
                 raise ImplementationException(help(c.get_constraint))
 
+    def add_soft_constraint_block(self, soft_constraints):
+        """
+        The soft constraints of each goal are compiled as a separate block, such that other goals can reuse them.
+        Existing soft constraints keep their block, only the parameters on the god map change.
+        The links used in fk expressions since the last block are assigned to these soft constraints.
+        :type soft_constraints: dict
+        """
+        block = [k for k in soft_constraints if k not in self.soft_constraints]
+        if block:
+            self.soft_constraint_blocks.append(block)
+        self.soft_constraints.update(soft_constraints)
+        fk_links = frozenset(self.get_robot().pop_fk_expression_links())
+        for k in soft_constraints:
+            self.soft_constraint_fk_links[k] = fk_links
+
+    def get_fk_links(self):
+        """
+        :return: the links used in the fk expressions of the current soft constraints
+        :rtype: set
+        """
+        fk_links = set()
+        for k in self.soft_constraints:
+            fk_links.update(self.soft_constraint_fk_links.get(k, ()))
+        return fk_links
+
     def add_js_controller_soft_constraints(self):
+        soft_constraints = OrderedDict()
         for joint_name in self.get_robot().controlled_joints:
             c = JointPosition(self.get_god_map(), joint_name, self.get_robot().joint_state[joint_name].position, 0, 0)
-            self.soft_constraints.update(c.get_constraint())
+            soft_constraints.update(c.get_constraint())
+        self.add_soft_constraint_block(soft_constraints)
 
     def has_robot_changed(self):
         new_urdf = self.get_robot().get_urdf_str()
@@ -152,4 +214,4 @@ class GoalToConstraints(GetGoal):
                                                 zero_weight_distance=zero_weight_distance)
             soft_constraints.update(constraint.get_constraint())
 
-        self.soft_constraints.update(soft_constraints)
+        self.add_soft_constraint_block(soft_constraints)
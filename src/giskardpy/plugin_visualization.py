@@ -6,6 +6,7 @@ from geometry_msgs.msg import Point, Quaternion
 from tf.transformations import quaternion_from_euler
 from visualization_msgs.msg import Marker, MarkerArray
 
+import giskardpy.identifier as identifier
 from giskardpy.tfwrapper import pose_to_kdl, kdl_to_pose
 from plugin import GiskardBehavior
 
@@ -19,9 +20,9 @@ class VisualizationBehavior(GiskardBehavior):
 
     def update(self):
         markers = []
-        robot = self.get_robot()
+        robot = self.get_snapshot().safe_get_data(identifier.robot)
         get_fk = robot.get_fk_pose
-        links = [x for x in self.get_robot().get_link_names() if robot.has_link_visuals(x)]
+        links = [x for x in robot.get_link_names() if robot.has_link_visuals(x)]
         for i, link_name in enumerate(links):
             marker = robot.link_as_marker(link_name)
             if marker is None:
@@ -0,0 +1,265 @@
+import os
+import traceback
+from multiprocessing import Pipe, Process
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pybullet as p
+
+from giskardpy import logging
+from giskardpy.exceptions import PhysicsWorldException
+from giskardpy.pybullet_wrapper import random_string
+from giskardpy.utils import resolve_ros_iris_in_urdf, write_to_tmp
+
+SYNC = u'sync'
+CHECK = u'check'
+STOP = u'stop'
+OK = u'ok'
+ERROR = u'error'
+
+# every body in the state buffer starts with its pose version, position and quaternion, followed by its joint positions
+POSE_SIZE = 8
+# every closest point in the result buffer is saved as query index, whether body a of the result is body a of the
+# query, link a, link b, position on a, position on b, normal on b and distance
+RESULT_SIZE = 14
+
+
+def _run_worker(connection, state_buffer, result_buffer):
+    """
+    Target of the worker processes. Mirrors the bodies of the world in its own pybullet client and answers
+    closest point queries.
+    :type connection: multiprocessing.connection.Connection
+    :param state_buffer: shared with the main process, contains the poses and joint states of all bodies
+    :param result_buffer: shared with the main process, the worker writes the closest points into it
+    """
+    logging.log_to_stdout(u'collision worker')
+    client_id = p.connect(p.DIRECT)
+    state = np.frombuffer(state_buffer)
+    results = np.frombuffer(result_buffer)
+    capacity = (len(results) - 1) // RESULT_SIZE
+    # name -> [pybullet id, offset in state buffer, number of joints, pose version]
+    bodies = {}
+    while True:
+        command, args = connection.recv()
+        try:
+            if command == STOP:
+                break
+            elif command == SYNC:
+                removed, added = args
+                for name in removed:
+                    p.removeBody(bodies.pop(name)[0], physicsClientId=client_id)
+                for name, urdf, offset, number_of_joints in added:
+                    file_name = write_to_tmp(u'{}_{}.urdf'.format(os.getpid(), random_string()), urdf)
+                    body_id = p.loadURDF(file_name, flags=p.URDF_USE_SELF_COLLISION_EXCLUDE_PARENT,
+                                         physicsClientId=client_id)
+                    os.remove(file_name)
+                    bodies[name] = [body_id, offset, number_of_joints, None]
+                connection.send((OK, None))
+            elif command == CHECK:
+                for body in bodies.values():
+                    body_id, offset, number_of_joints, version = body
+                    if state[offset] != version:
+                        body[3] = state[offset]
+                        p.resetBasePositionAndOrientation(body_id, state[offset + 1:offset + 4],
+                                                          state[offset + 4:offset + 8], physicsClientId=client_id)
+                        for joint_index in range(number_of_joints):
+                            p.resetJointState(body_id, joint_index, state[offset + POSE_SIZE + joint_index],
+                                              physicsClientId=client_id)
+                number_of_results = 0
+                overflow = []
+                for query_index, (body_a, link_a, body_b, link_b, distance) in args:
+                    body_a_id = bodies[body_a][0]
+                    body_b_id = bodies[body_b][0]
+                    if link_b is None:
+                        closest_points = p.getClosestPoints(body_a_id, body_b_id, distance, link_a,
+                                                            physicsClientId=client_id)
+                    else:
+                        closest_points = p.getClosestPoints(body_a_id, body_b_id, distance, link_a, link_b,
+                                                            physicsClientId=client_id)
+                    for x in closest_points:
+                        row = (query_index, x[1] == body_a_id, x[3], x[4]) + tuple(x[5]) + tuple(x[6]) + \
+                              tuple(x[7]) + (x[8],)
+                        if number_of_results < capacity:
+                            start = 1 + number_of_results * RESULT_SIZE
+                            results[start:start + RESULT_SIZE] = row
+                            number_of_results += 1
+                        else:
+                            overflow.append(row)
+                results[0] = number_of_results
+                connection.send((OK, overflow))
+        except Exception:
+            logging.logerr(traceback.format_exc())
+            connection.send((ERROR, traceback.format_exc()))
+    p.disconnect(physicsClientId=client_id)
+
+
+class CollisionWorkers(object):
+    """
+    Shards closest point queries across worker processes with their own pybullet DIRECT client.
+    The workers mirror the bodies of the world, which are synced whenever a body was added, removed or reinitialized.
+    Poses and joint states are passed through shared memory each cycle, only bodies whose pose_version changed are
+    copied.
+    """
+
+    def __init__(self, number_of_workers, state_capacity=10000, result_capacity=5000):
+        """
+        :type number_of_workers: int
+        :param state_capacity: initial size of the state buffer, grows if the world gets bigger
+        :type state_capacity: int
+        :param result_capacity: closest points per worker and cycle that fit into shared memory, the rest is pickled
+        :type result_capacity: int
+        """
+        self.number_of_workers = number_of_workers
+        self.state_capacity = state_capacity
+        self.result_capacity = result_capacity
+        self.workers = []
+        # name -> [link_name_to_id of the body when it was mirrored, offset in state buffer, number of joints,
+        #          pose version]
+        self.bodies = {}
+        self.state = None
+        self.next_offset = 0
+        # (offset, size) of the parts of the state buffer that belonged to removed bodies
+        self.free_offsets = []
+
+    def start(self):
+        self.stop()
+        state_buffer = RawArray(u'd', self.state_capacity)
+        self.state = np.frombuffer(state_buffer)
+        self.state[:] = np.nan
+        for i in range(self.number_of_workers):
+            result_buffer = RawArray(u'd', 1 + self.result_capacity * RESULT_SIZE)
+            connection, worker_connection = Pipe()
+            process = Process(target=_run_worker, args=(worker_connection, state_buffer, result_buffer))
+            process.daemon = True
+            process.start()
+            self.workers.append((process, connection, np.frombuffer(result_buffer)))
+        logging.loginfo(u'started {} collision workers'.format(self.number_of_workers))
+
+    def stop(self):
+        for process, connection, _ in self.workers:
+            try:
+                connection.send((STOP, None))
+            except IOError:
+                pass
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+        self.bodies = {}
+        self.next_offset = 0
+        self.free_offsets = []
+
+    def allocate(self, size):
+        """
+        :param size: number of entries in the state buffer
+        :type size: int
+        :return: offset of a free part of the state buffer with this size, None if the buffer is too small
+        :rtype: int
+        """
+        for i, (offset, free_size) in enumerate(self.free_offsets):
+            if free_size >= size:
+                if free_size > size:
+                    self.free_offsets[i] = (offset + size, free_size - size)
+                else:
+                    del self.free_offsets[i]
+                return offset
+        if self.next_offset + size > len(self.state):
+            return None
+        offset = self.next_offset
+        self.next_offset += size
+        return offset
+
+    def free(self, offset, size):
+        """
+        Marks a part of the state buffer as free, such that the next body can reuse it.
+        :type offset: int
+        :type size: int
+        """
+        self.state[offset:offset + size] = np.nan
+        self.free_offsets.append((offset, size))
+
+    def __receive(self, connection):
+        status, result = connection.recv()
+        if status == ERROR:
+            raise PhysicsWorldException(u'collision worker failed:\n{}'.format(result))
+        return result
+
+    def sync(self, bodies):
+        """
+        Mirrors added, removed and reinitialized bodies in the workers and copies all changed poses and joint states
+        into shared memory.
+        :param bodies: name -> PyBulletWorldObject
+        :type bodies: dict
+        """
+        if not self.workers:
+            self.start()
+        removed = [name for name, body in self.bodies.items()
+                   if name not in bodies or bodies[name].link_name_to_id is not body[0]]
+        for name in removed:
+            _, offset, number_of_joints, _ = self.bodies.pop(name)
+            self.free(offset, POSE_SIZE + number_of_joints)
+        added = []
+        for name, world_object in bodies.items():
+            if name not in self.bodies:
+                number_of_joints = p.getNumJoints(world_object.get_pybullet_id())
+                offset = self.allocate(POSE_SIZE + number_of_joints)
+                if offset is None:
+                    # restart with a bigger state buffer, which mirrors all bodies again
+                    self.state_capacity = 2 * (self.next_offset + POSE_SIZE + number_of_joints)
+                    self.start()
+                    return self.sync(bodies)
+                self.bodies[name] = [world_object.link_name_to_id, offset, number_of_joints, None]
+                added.append((name, resolve_ros_iris_in_urdf(world_object.get_urdf_str()), offset,
+                              number_of_joints))
+        if removed or added:
+            for _, connection, _ in self.workers:
+                connection.send((SYNC, (removed, added)))
+            for _, connection, _ in self.workers:
+                self.__receive(connection)
+
+        for name, (_, offset, number_of_joints, version) in self.bodies.items():
+            world_object = bodies[name]
+            if world_object.pose_version != version:
+                self.bodies[name][3] = world_object.pose_version
+                pybullet_id = world_object.get_pybullet_id()
+                position, orientation = p.getBasePositionAndOrientation(pybullet_id)
+                self.state[offset + 1:offset + 4] = position
+                self.state[offset + 4:offset + 8] = orientation
+                if number_of_joints > 0:
+                    self.state[offset + POSE_SIZE:offset + POSE_SIZE + number_of_joints] = \
+                        [x[0] for x in p.getJointStates(pybullet_id, range(number_of_joints))]
+                self.state[offset] = world_object.pose_version
+
+    def get_closest_points(self, queries):
+        """
+        Has to be called after sync.
+        :param queries: list of (body_a, link_a, body_b, link_b, distance), with pybullet link ids and
+                        PyBulletWorldObjects as bodies. link_b can be None to query against the whole body.
+        :type queries: list
+        :return: a list of closest points for each query, in the format of p.getClosestPoints
+        :rtype: list
+        """
+        for i, (_, connection, _) in enumerate(self.workers):
+            shard = [(j, (body_a.get_name(), link_a, body_b.get_name(), link_b, distance))
+                     for j, (body_a, link_a, body_b, link_b, distance) in
+                     enumerate(queries) if j % self.number_of_workers == i]
+            connection.send((CHECK, shard))
+        closest_points = [[] for _ in queries]
+        for _, connection, results in self.workers:
+            overflow = self.__receive(connection)
+            number_of_results = int(results[0])
+            rows = results[1:1 + number_of_results * RESULT_SIZE].reshape(number_of_results, RESULT_SIZE).tolist()
+            for row in rows + overflow:
+                body_a, _, body_b, _, _ = queries[int(row[0])]
+                if not row[1]:
+                    body_a, body_b = body_b, body_a
+                closest_points[int(row[0])].append((0,
+                                                    body_a.get_pybullet_id(),
+                                                    body_b.get_pybullet_id(),
+                                                    int(row[2]),
+                                                    int(row[3]),
+                                                    row[4:7],
+                                                    row[7:10],
+                                                    row[10:13],
+                                                    row[13]))
+        return closest_points
@@ -1,36 +1,166 @@
+from collections import defaultdict, namedtuple
+
 import numpy as np
 
 import pybullet as p
-from geometry_msgs.msg import Point, Pose
 from giskard_msgs.msg import CollisionEntry
 
 import giskardpy
-from giskardpy.data_types import ClosestPointInfo, Collisions
+from giskardpy import logging
+from giskardpy.data_types import Collisions
+from giskardpy.pybullet_collision_workers import CollisionWorkers
 from giskardpy.pybullet_world_object import PyBulletWorldObject
-from giskardpy.pybullet_wrapper import ContactInfo
 from giskardpy.utils import resolve_ros_iris
 from giskardpy.world import World
 from giskardpy.world_object import WorldObject
 
+
+class CollisionQueryCache(object):
+    """
+    Remembers the results of the closest point queries of PyBulletWorld.check_collisions, such that queries that can't
+    have a different result are skipped.
+    How far a robot link has moved since a query is bounded by the motion of its frame plus the change of its
+    orientation times its radius, summed over all cycles.
+    """
+    # queries look this much further than the cut off distance, such that a pair without contacts can be skipped until
+    # its links have moved this far
+    margin = 0.05
+
+    def __init__(self):
+        self.link_name_to_id = None
+        # robot link id -> (position, quaternion) of its frame in the last cycle
+        self.link_frames = {}
+        # robot link id -> max distance of its collision geometry to its frame
+        self.link_radii = {}
+        # robot link id -> upper bound of the distance the link has moved since it was first seen
+        self.link_motion = {}
+        # (robot_link, body_b) -> CollisionQuery
+        self.queries = {}
+
+    def update_robot(self, robot, link_ids):
+        """
+        Updates the motion of the robot links, has to be called once per cycle.
+        :type robot: giskardpy.symengine_robot.Robot
+        :type link_ids: set
+        """
+        # the link ids change when the robot is reinitialized, which creates a new dict
+        if robot.link_name_to_id is not self.link_name_to_id:
+            self.__init__()
+            self.link_name_to_id = robot.link_name_to_id
+        robot_id = robot.get_pybullet_id()
+        for link_id in link_ids:
+            if link_id == -1:
+                position, orientation = p.getBasePositionAndOrientation(robot_id)
+            else:
+                link_state = p.getLinkState(robot_id, link_id, computeForwardKinematics=True)
+                position, orientation = link_state[4], link_state[5]
+            position = np.array(position)
+            orientation = np.array(orientation)
+            if link_id in self.link_frames:
+                last_position, last_orientation = self.link_frames[link_id]
+                cos_half_angle = min(abs(np.dot(orientation, last_orientation)), 1.)
+                # a point at distance r of the frame moves at most 2 * sin(angle / 2) * r because of the rotation
+                self.link_motion[link_id] += np.linalg.norm(position - last_position) + \
+                                             2 * np.sqrt(1 - cos_half_angle ** 2) * self.link_radii[link_id]
+            else:
+                # the aabb contains the whole link, so its corners are at least as far away from the frame
+                aabb_min, aabb_max = robot.get_pybullet_aabb(link_id)
+                self.link_radii[link_id] = np.linalg.norm(np.maximum(np.abs(aabb_min - position),
+                                                                     np.abs(aabb_max - position)))
+                self.link_motion[link_id] = 0.
+            self.link_frames[link_id] = position, orientation
+
+    def get_contacts(self, robot_link_id, robot_link, body_b_object, link_bs, all_distance):
+        """
+        :param link_bs: link_b -> cut off distance
+        :type link_bs: dict
+        :param all_distance: cut off distance for all other links of body_b or None
+        :type all_distance: float
+        :return: the contacts of the last query of this pair, if they can't have changed, None otherwise
+        :rtype: list
+        """
+        query = self.queries.get((robot_link, body_b_object.get_name()))
+        if query is None or \
+                query.body_b_object is not body_b_object or \
+                query.link_bs != link_bs or \
+                query.all_distance != all_distance:
+            return None
+        moved = self.link_motion[robot_link_id] - query.robot_link_motion
+        if query.link_b_motion is None:
+            # other bodies are only reused if they haven't changed at all
+            if query.pose_version != body_b_object.pose_version:
+                return None
+        else:
+            moved += max(self.link_motion[link_b_id] - motion for link_b_id, motion in query.link_b_motion.items())
+        if moved == 0 or (not query.contacts and moved < query.margin):
+            return query.contacts
+        return None
+
+    def set_contacts(self, robot_link_id, robot_link, body_b_object, link_bs, all_distance, contacts, margin,
+                     is_self_collision):
+        """
+        :param contacts: list of (pybullet result, key, cut off distance)
+        :type contacts: list
+        :param margin: how much further away than their cut off distance the checked links were at least
+        :type margin: float
+        """
+        if is_self_collision:
+            link_b_motion = {x: self.link_motion[x] for x in
+                             (body_b_object.get_pybullet_link_id(link_b) for link_b in link_bs)}
+        else:
+            link_b_motion = None
+        self.queries[robot_link, body_b_object.get_name()] = CollisionQuery(body_b_object,
+                                                                           body_b_object.pose_version,
+                                                                           dict(link_bs),
+                                                                           all_distance,
+                                                                           self.link_motion[robot_link_id],
+                                                                           link_b_motion,
+                                                                           contacts,
+                                                                           margin)
+
+
+CollisionQuery = namedtuple(u'CollisionQuery', [u'body_b_object', u'pose_version', u'link_bs', u'all_distance',
+                                                u'robot_link_motion', u'link_b_motion', u'contacts', u'margin'])
+
+
+def flip_closest_point(result):
+    """
+    For self collisions, bullet doesn't know which of the two links was link a of the query and sometimes returns the
+    result the other way around.
+    :param result: result of p.getClosestPoints
+    :type result: tuple
+    :return: result with body/link a and b swapped and the normal pointing towards the new a
+    :rtype: tuple
+    """
+    return (result[0], result[2], result[1], result[4], result[3], result[6], result[5],
+            tuple(-x for x in result[7])) + tuple(result[8:])
+
+
 class PyBulletWorld(World):
     """
     Wraps around the shitty pybullet api.
     """
     ground_plane_name = u'ground_plane'
-    hack_name = u'pybullet_hack'
-    hidden_objects = [ground_plane_name, hack_name]
+    hidden_objects = [ground_plane_name]
 
-    def __init__(self, enable_gui=False, path_to_data_folder=u''):
+    def __init__(self, enable_gui=False, path_to_data_folder=u'', number_of_collision_workers=0):
         """
         :type enable_gui: bool
         :param path_to_data_folder: location where compiled collision matrices are stored
         :type path_to_data_folder: str
+        :param number_of_collision_workers: if > 0, collision queries are run in this many processes
+        :type number_of_collision_workers: int
         """
         super(PyBulletWorld, self).__init__(path_to_data_folder)
         self._gui = enable_gui
         self._object_names_to_objects = {}
         self._object_id_to_name = {}
         self._robot = None
+        self.query_cache = CollisionQueryCache()
+        if number_of_collision_workers > 0:
+            self.collision_workers = CollisionWorkers(number_of_collision_workers)
+        else:
+            self.collision_workers = None
         self.setup()
 
     def __get_pybullet_object_id(self, name):
@@ -38,99 +168,173 @@ class PyBulletWorld(World):
 
     def check_collisions(self, cut_off_distances):
         """
+        Entries with the same robot link and body are checked with one query. If they have more than one link_b,
+        the robot link is checked against the whole body and the contacts get filtered by link.
+        Pairs whose bounding boxes are further apart than the cut off distance are skipped. Queries are also skipped,
+        if the links involved can't have moved enough since the last cycle to change the result, see
+        CollisionQueryCache.
         :param cut_off_distances: (robot_link, body_b, link_b) -> cut off distance. Contacts between objects not in this
                                     dict or further away than the cut off distance will be ignored.
         :type cut_off_distances: dict
-        :param self_collision_d: distances grater than this value will be ignored
-        :type self_collision_d: float
-        :type enable_self_collision: bool
-        :return: (robot_link, body_b, link_b) -> ContactInfo
-        :rtype: dict
+        :rtype: Collisions
         """
-        collisions = Collisions(self.robot)
         robot_name = self.robot.get_name()
+        contacts = []
+        # (robot_link, body_b) -> link_b -> cut off distance
+        groups = defaultdict(dict)
+        robot_link_ids = set()
         for (robot_link, body_b, link_b), distance in cut_off_distances.items():
-            if robot_name == body_b:
-                object_id = self.robot.get_pybullet_id()
-                link_b_id = self.robot.get_pybullet_link_id(link_b)
-            else:
-                object_id = self.__get_pybullet_object_id(body_b)
-                if link_b != CollisionEntry.ALL:
-                    link_b_id = self.get_object(body_b).get_pybullet_link_id(link_b)
+            groups[robot_link, body_b][link_b] = distance
+            robot_link_ids.add(self.robot.get_pybullet_link_id(robot_link))
+            if body_b == robot_name:
+                robot_link_ids.add(self.robot.get_pybullet_link_id(link_b))
+        self.query_cache.update_robot(self.robot, robot_link_ids)
+
+        # the narrow phase queries are collected first, such that they can be run in parallel
+        # (body_a, link_a, body_b, link_b, distance) for __get_closest_points
+        queries = []
+        # what is needed to filter the results of each query
+        query_args = []
 
+        for (robot_link, body_b), link_bs in groups.items():
+            if body_b == robot_name:
+                body_b_object = self.robot
+                all_distance = None
+            else:
+                body_b_object = self.get_object(body_b)
+                all_distance = link_bs.pop(CollisionEntry.ALL, None)
             robot_link_id = self.robot.get_pybullet_link_id(robot_link)
-            if body_b == robot_name or link_b != CollisionEntry.ALL:
-                contacts = [ContactInfo(*x) for x in p.getClosestPoints(self.robot.get_pybullet_id(), object_id,
-                                                                        distance * 3,
-                                                                        robot_link_id, link_b_id)]
+            cached_contacts = self.query_cache.get_contacts(robot_link_id, robot_link, body_b_object, link_bs,
+                                                            all_distance)
+            if cached_contacts is not None:
+                contacts.extend(cached_contacts)
+                continue
+            # how much further away than their cut off distance the checked links are at least
+            margin = self.query_cache.margin
+            # broad phase, pairs whose inflated bounding boxes don't overlap keep the default collision of Collisions
+            robot_link_aabb = self.robot.get_pybullet_aabb(robot_link_id)
+            checked_all_distance = all_distance
+            if all_distance is not None:
+                slack = self.__aabb_distance(robot_link_aabb, body_b_object.get_pybullet_aabb()) - all_distance * 3
+                if slack > 0:
+                    checked_all_distance = None
+                    margin = min(margin, slack)
+            # pybullet link id -> (link_b, cut off distance)
+            cut_offs = {}
+            for link_b, distance in link_bs.items():
+                link_b_id = body_b_object.get_pybullet_link_id(link_b)
+                if checked_all_distance is None:
+                    slack = self.__aabb_distance(robot_link_aabb, body_b_object.get_pybullet_aabb(link_b_id)) - \
+                            distance * 3
+                    if slack > 0:
+                        margin = min(margin, slack)
+                        continue
+                cut_offs[link_b_id] = (link_b, distance)
+            if checked_all_distance is None and not cut_offs:
+                self.query_cache.set_contacts(robot_link_id, robot_link, body_b_object, link_bs, all_distance,
+                                              [], margin, body_b == robot_name)
+                continue
+            max_distance = max([d for _, d in cut_offs.values()] + [checked_all_distance or 0]) * 3
+            if checked_all_distance is None and len(cut_offs) == 1:
+                link_b_id = next(iter(cut_offs))
             else:
-                contacts = [ContactInfo(*x) for x in p.getClosestPoints(self.robot.get_pybullet_id(), object_id,
-                                                                        distance * 3,
-                                                                        robot_link_id)]
-            if len(contacts) > 0:
-                try:
-                    body_b_object = self.get_object(body_b)
-                except KeyError:
-                    body_b_object = self.robot
-                for contact in contacts:
-                    if link_b == CollisionEntry.ALL:
-                        link_b = body_b_object.pybullet_link_id_to_name(contact.link_index_b)
-                    k = (robot_link, body_b, link_b)
-                    collisions.add(k,
-                                   ClosestPointInfo(contact.position_on_a,
-                                                        contact.position_on_b,
-                                                        contact.contact_distance,
-                                                        distance,
-                                                        robot_link,
-                                                        body_b,
-                                                        link_b,
-                                                        contact.contact_normal_on_b,
-                                                        k))
+                link_b_id = None
+            # links without result are at least query_distance away, so margin doesn't get bigger than this
+            queries.append((self.robot, robot_link_id, body_b_object, link_b_id,
+                            max_distance + self.query_cache.margin))
+            query_args.append((robot_link, robot_link_id, body_b, body_b_object, link_bs, all_distance, cut_offs,
+                               checked_all_distance, margin))
+
+        for closest_points, (robot_link, robot_link_id, body_b, body_b_object, link_bs, all_distance, cut_offs,
+                             checked_all_distance, margin) in zip(self.__get_closest_points(queries), query_args):
+            group_contacts, margin = self.__filter_closest_points(closest_points, robot_link, robot_link_id, body_b,
+                                                                  body_b_object, cut_offs, checked_all_distance,
+                                                                  margin)
+            self.query_cache.set_contacts(robot_link_id, robot_link, body_b_object, link_bs, all_distance,
+                                          group_contacts, margin, body_b == robot_name)
+            contacts.extend(group_contacts)
+
+        # see Collisions for the columns
+        data = np.array([tuple(x[5]) + tuple(x[6]) + tuple(x[7]) + (x[8], min_dist) for x, _, min_dist in contacts])
+        collisions = Collisions(self.robot, [k for _, k, _ in contacts], data.reshape(-1, Collisions.SIZE))
         return collisions
 
-    def __should_flip_contact_info(self, contact_info):
-        """
-        :type contact_info: ContactInfo
-        :rtype: bool
-        """
-        new_p = Pose()
-        new_p.position = Point(*contact_info.position_on_a)
-        new_p.orientation.w = 1
-
-        self.__move_hack(new_p)
-        hack_id = self.__get_pybullet_object_id(self.hack_name)
-        body_a_id = self.robot.get_pybullet_id()
-        try:
-            contact_info3 = ContactInfo(
-                *[x for x in p.getClosestPoints(hack_id,
-                                                body_a_id, 0.001) if
-                  abs(x[8] + 0.005) < 0.0005][0])
-            return not (contact_info3.body_unique_id_b == body_a_id and
-                        contact_info3.link_index_b == self.robot.get_pybullet_link_id(contact_info.link_a))
-        except Exception as e:
-            return True
-
-    def __flip_contact_info(self, contact_info):
-        return ClosestPointInfo(contact_info.position_on_b,
-                                contact_info.position_on_a,
-                                contact_info.contact_distance,
-                                contact_info.min_dist,
-                                contact_info.link_b,
-                                contact_info.body_b,  # this should always be robot, because we only flip for self coll
-                                contact_info.link_a,
-                                [-contact_info.contact_normal[0],
-                                 -contact_info.contact_normal[1],
-                                 -contact_info.contact_normal[2]],
-                                contact_info.old_key)
+    def __get_closest_points(self, queries):
+        """
+        :param queries: list of (body_a, link_a, body_b, link_b, distance), with pybullet link ids and
+                        PyBulletWorldObjects as bodies. link_b can be None to query against the whole body.
+        :type queries: list
+        :return: the result of p.getClosestPoints for each query
+        :rtype: list
+        """
+        if self.collision_workers is not None and queries:
+            try:
+                bodies = dict(self.get_objects())
+                bodies[self.robot.get_name()] = self.robot
+                self.collision_workers.sync(bodies)
+                return self.collision_workers.get_closest_points(queries)
+            except Exception as e:
+                logging.logerr(u'collision workers failed, checking collisions in the main process from now on: '
+                               u'{}'.format(e))
+                self.collision_workers.stop()
+                self.collision_workers = None
+        closest_points = []
+        for body_a, link_a, body_b, link_b, distance in queries:
+            if link_b is None:
+                closest_points.append(p.getClosestPoints(body_a.get_pybullet_id(), body_b.get_pybullet_id(),
+                                                         distance, link_a))
+            else:
+                closest_points.append(p.getClosestPoints(body_a.get_pybullet_id(), body_b.get_pybullet_id(),
+                                                         distance, link_a, link_b))
+        return closest_points
+
+    def __filter_closest_points(self, closest_points, robot_link, robot_link_id, body_b, body_b_object, cut_offs,
+                                all_distance, margin):
+        """
+        :param closest_points: result of a query of robot_link against body_b
+        :type closest_points: list
+        :param cut_offs: pybullet link id of body_b -> (link_b, cut off distance)
+        :type cut_offs: dict
+        :param all_distance: cut off distance for all other links of body_b or None
+        :type all_distance: float
+        :param margin: how much further away than their cut off distance the links without result are at least
+        :type margin: float
+        :return: list of (pybullet result, key, cut off distance), margin including the links with result
+        :rtype: tuple
+        """
+        contacts = []
+        robot_id = self.robot.get_pybullet_id()
+        for result in closest_points:
+            if result[3] != robot_link_id or result[1] != robot_id:
+                result = flip_closest_point(result)
+            # result[4] is the link of body b, result[8] the contact distance
+            if result[4] in cut_offs:
+                link_b, distance = cut_offs[result[4]]
+            elif all_distance is not None:
+                link_b = body_b_object.pybullet_link_id_to_name(result[4])
+                distance = all_distance
+            else:
+                continue
+            if result[8] > distance * 3:
+                margin = min(margin, result[8] - distance * 3)
+                continue
+            contacts.append((result, (robot_link, body_b, link_b), distance))
+        return contacts, margin
+
+    def __aabb_distance(self, aabb_a, aabb_b):
+        """
+        :return: lower bound for the distance between the objects in the boxes
+        :rtype: float
+        """
+        gaps = np.maximum(np.maximum(aabb_a[0] - aabb_b[1], aabb_b[0] - aabb_a[1]), 0)
+        return np.linalg.norm(gaps)
 
     def setup(self):
         self.__add_ground_plane()
-        self.__add_pybullet_bug_fix_hack()
 
     def soft_reset(self):
         super(PyBulletWorld, self).soft_reset()
         self.__add_ground_plane()
-        self.__add_pybullet_bug_fix_hack()
 
     def __add_ground_plane(self):
         """
@@ -142,16 +346,6 @@ class PyBulletWorld(World):
             plane.set_name(self.ground_plane_name)
             self.add_object(plane)
 
-    def __add_pybullet_bug_fix_hack(self):
-        if not self.has_object(self.hack_name):
-            path = resolve_ros_iris(u'package://giskardpy/urdfs/tiny_ball.urdf')
-            plane = WorldObject.from_urdf_file(path)
-            plane.set_name(self.hack_name)
-            self.add_object(plane)
-
-    def __move_hack(self, pose):
-        self.get_object(self.hack_name).base_pose = pose
-
     def get_objects(self):
         objects = super(PyBulletWorld, self).get_objects()
         return {k: v for k, v in objects.items() if k not in self.hidden_objects}
@@ -170,26 +364,6 @@ class PyBulletWorld(World):
         pwo.joint_state = object_.joint_state
         return super(PyBulletWorld, self).add_object(pwo)
 
-    def transform_contact_info(self, collisions):
-        """
-        :param collisions: (robot_link, body_b, link_b) -> ContactInfo
-        :type collisions: dict
-        :param min_allowed_distance: (robot_link, body_b, link_b) -> min allowed distance
-        :type min_allowed_distance: dict
-        :return: robot_link -> ClosestPointInfo of closest thing
-        :rtype: Collisions
-        """
-        for collision in collisions.items():  # type: ClosestPointInfo
-            if self.__should_flip_contact_info(collision):
-                tmp = collision.position_on_a
-                collision.position_on_a = collision.position_on_b
-                collision.position_on_b = tmp
-                collision.contact_normal = [-collision.contact_normal[0],
-                                            -collision.contact_normal[1],
-                                            -collision.contact_normal[2]]
-        closest_point = super(PyBulletWorld, self).transform_contact_info(collisions)
-        return closest_point
-
     def remove_robot(self):
         self.robot.suicide()
         super(PyBulletWorld, self).remove_robot()
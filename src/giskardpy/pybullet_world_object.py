@@ -1,6 +1,7 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from multiprocessing import Lock
 
+import numpy as np
 import pybullet as p
 from geometry_msgs.msg import Pose
 
@@ -29,6 +30,10 @@ class PyBulletWorldObject(WorldObject):
         """
         self._pybullet_id = None
         self.mimic_cb = {}
+        # pybullet link id -> axis aligned bounding box, None -> aabb of the whole object
+        self._aabbs = {}
+        # increased whenever the base pose or joint state is set
+        self.pose_version = 0
         self.lock = Lock()
         super(PyBulletWorldObject, self).__init__(urdf,
                                                   base_pose=base_pose,
@@ -54,6 +59,8 @@ class PyBulletWorldObject(WorldObject):
                 """
         with self.lock:
             WorldObject.joint_state.fset(self, value)
+            self._aabbs.clear()
+            self.pose_version += 1
             for joint_name, singe_joint_state in value.items():
                 # FIXME hack because pybullet doesn't support mimic joints
                 if not self.is_joint_mimic(joint_name):
@@ -76,6 +83,8 @@ class PyBulletWorldObject(WorldObject):
                 WorldObject.base_pose.fset(self, value)
                 position, orientation = msg_to_pybullet_pose(value)
                 p.resetBasePositionAndOrientation(self._pybullet_id, position, orientation)
+                self._aabbs.clear()
+                self.pose_version += 1
 
     def get_pybullet_id(self):
         return self._pybullet_id
@@ -130,6 +139,8 @@ class PyBulletWorldObject(WorldObject):
                 base_pose = self.base_pose
                 self.suicide()
             self._pybullet_id = load_urdf_string_into_bullet(self.get_urdf_str(), base_pose)
+            self._aabbs.clear()
+            self.pose_version += 1
             self.__sync_with_bullet()
         if joint_state is not None:
             joint_state = {k: v for k, v in joint_state.items() if k in self.get_joint_names()}
@@ -163,6 +174,65 @@ class PyBulletWorldObject(WorldObject):
     def pybullet_link_id_to_name(self, link_id):
         return self.link_id_to_name[link_id]
 
+    def get_pybullet_aabb(self, link_id=None):
+        """
+        The boxes are cached until the base pose or joint state changes.
+        :param link_id: pybullet link id, None for the whole object
+        :type link_id: int
+        :return: min and max corner of the axis aligned bounding box in map
+        :rtype: tuple
+        """
+        aabb = self._aabbs.get(link_id)
+        if aabb is None:
+            if link_id is None:
+                aabbs = [self.get_pybullet_aabb(x) for x in self.link_id_to_name]
+                aabb = (np.min([x[0] for x in aabbs], axis=0), np.max([x[1] for x in aabbs], axis=0))
+            else:
+                aabb_min, aabb_max = p.getAABB(self._pybullet_id, link_id)
+                aabb = (np.array(aabb_min), np.array(aabb_max))
+            self._aabbs[link_id] = aabb
+        return aabb
+
+    def check_collisions(self, link_combinations, distance):
+        """
+        Checks the link pairs with one closest point query per link against the whole object, instead of one query
+        per pair. Every pair is assigned to the link that appears in more pairs, such that few queries cover all
+        pairs.
+        :param link_combinations: set with link name tuples
+        :type link_combinations: set
+        :return: the link name tuples that are closer than distance
+        :rtype: set
+        """
+        pairs_per_link = defaultdict(int)
+        for link_a, link_b in link_combinations:
+            pairs_per_link[link_a] += 1
+            pairs_per_link[link_b] += 1
+        # link id -> link id of other link -> link pairs
+        queries = defaultdict(lambda: defaultdict(list))
+        for link_a, link_b in link_combinations:
+            if pairs_per_link[link_a] >= pairs_per_link[link_b]:
+                query_link, other_link = link_a, link_b
+            else:
+                query_link, other_link = link_b, link_a
+            link_id_a = self.get_pybullet_link_id(query_link)
+            link_id_b = self.get_pybullet_link_id(other_link)
+            queries[link_id_a][link_id_b].append((link_a, link_b))
+        in_collision = set()
+        for link_id_a, pairs in queries.items():
+            if len(pairs) == 1:
+                link_id_b, link_pairs = list(pairs.items())[0]
+                if p.getClosestPoints(self._pybullet_id, self._pybullet_id, distance, link_id_a, link_id_b):
+                    in_collision.update(link_pairs)
+            else:
+                for closest_point in p.getClosestPoints(self._pybullet_id, self._pybullet_id, distance, link_id_a):
+                    # the query link can be link a or link b of a closest point
+                    if closest_point[3] == link_id_a:
+                        other_link_id = closest_point[4]
+                    else:
+                        other_link_id = closest_point[3]
+                    in_collision.update(pairs.pop(other_link_id, ()))
+        return in_collision
+
     def in_collision(self, link_a, link_b, distance):
         link_id_a = self.get_pybullet_link_id(link_a)
         link_id_b = self.get_pybullet_link_id(link_b)
@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 import pickle
 import warnings
@@ -7,7 +8,7 @@ from time import time
 # from giskardpy import BACKEND
 from giskardpy import logging, symbolic_wrapper as w
 from giskardpy.exceptions import QPSolverException
-from giskardpy.qp_solver import QPSolver
+from giskardpy.qp_solver import get_qp_solver_class
 
 
 SoftConstraint = namedtuple(u'SoftConstraint', [u'lower', u'upper', u'weight', u'expression'])
@@ -16,13 +17,25 @@ JointConstraint = namedtuple(u'JointConstraint', [u'lower', u'upper', u'weight']
 
 BIG_NUMBER = 1e9
 
+
+def block_file_name(path_to_functions, keys):
+    """
+    :param keys: of a block of constraints, in the order of its rows
+    :type keys: list
+    :return: where the compiled function of the block is cached
+    :rtype: str
+    """
+    # not sorted, because the rows of a compiled function have the order of the keys it was compiled with
+    return path_to_functions + hashlib.md5(u'\n'.join(str(k) for k in keys)).hexdigest()
+
 class QProblemBuilder(object):
     """
     Wraps around QPOases. Builds the required matrices from constraints.
     """
 
     def __init__(self, joint_constraints_dict, hard_constraints_dict, soft_constraints_dict, controlled_joint_symbols,
-                 free_symbols=None, path_to_functions=''):
+                 free_symbols=None, path_to_functions='', backend=u'qpoases', compiler=None,
+                 soft_constraint_blocks=None):
         """
         :type joint_constraints_dict: dict
         :type hard_constraints_dict: dict
@@ -31,44 +44,58 @@ class QProblemBuilder(object):
         :type free_symbols: set
         :param path_to_functions: location where the compiled functions can be safed.
         :type path_to_functions: str
+        :param backend: name of the qp solver, see qp_solver.get_qp_solver_class
+        :type backend: str
+        :param compiler: if not None, the matrices are computed by c code compiled with this compiler
+        :type compiler: str
+        :param soft_constraint_blocks: lists of soft constraint keys, in the same order as soft_constraints_dict.
+                                       Every block is compiled and cached on its own, such that other controllers
+                                       can reuse it. None to put all soft constraints into one block.
+        :type soft_constraint_blocks: list
         """
         if free_symbols is not None:
             warnings.warn(u'use of free_symbols deprecated', DeprecationWarning)
         assert (not len(controlled_joint_symbols) > len(joint_constraints_dict))
         assert (not len(controlled_joint_symbols) < len(joint_constraints_dict))
         assert (len(hard_constraints_dict) <= len(controlled_joint_symbols))
+        if soft_constraint_blocks is None:
+            soft_constraint_blocks = [list(soft_constraints_dict.keys())]
+        soft_constraint_blocks = [block for block in soft_constraint_blocks if len(block) > 0]
+        assert [k for block in soft_constraint_blocks for k in block] == list(soft_constraints_dict.keys()), \
+            u'soft constraint blocks have to be in the same order as the soft constraints'
         self.path_to_functions = path_to_functions
+        self.compiler = compiler
         self.free_symbols = free_symbols
         self.joint_constraints_dict = joint_constraints_dict
         self.hard_constraints_dict = hard_constraints_dict
         self.soft_constraints_dict = soft_constraints_dict
+        self.soft_constraint_blocks = soft_constraint_blocks
         self.controlled_joints = controlled_joint_symbols
         self.make_matrices()
 
-        self.shape1 = len(self.hard_constraints_dict) + len(self.soft_constraints_dict)
-        self.shape2 = len(self.joint_constraints_dict) + len(self.soft_constraints_dict)
-
-        self.qp_solver = QPSolver(len(self.hard_constraints_dict),
-                                  len(self.joint_constraints_dict),
-                                  len(self.soft_constraints_dict))
+        self.qp_solver = get_qp_solver_class(backend)(len(self.hard_constraints_dict),
+                                                      len(self.joint_constraints_dict),
+                                                      len(self.soft_constraints_dict))
+        self.qp_solver.set_A_sparsity(self.A_sparsity)
         self.lbAs = None  # for debugging purposes
+        self.recorder = None  # type: giskardpy.qp_recorder.QPRecorder
 
     def get_expr(self):
-        return self.cython_big_ass_M.str_params
+        return self.str_params
 
     def make_matrices(self):
         """
-        Turns constrains into a function that computes the matrices needed for QPOases.
+        Turns constrains into functions that compute the matrices needed for QPOases.
+        The joint and hard constraints are one block and every block of soft constraints is another one.
+        Each block is a function, that only computes the entries that depend on symbols and are structurally non zero.
+        They are written directly into preallocated arrays.
         """
-        # TODO split this into smaller functions to increase readability
         t_total = time()
-        # TODO cpu intensive
         weights = []
         lb = []
         ub = []
         lbA = []
         ubA = []
-        soft_expressions = []
         hard_expressions = []
         for k, c in self.joint_constraints_dict.items():
             weights.append(c.weight)
@@ -78,74 +105,123 @@ class QProblemBuilder(object):
             lbA.append(c.lower)
             ubA.append(c.upper)
             hard_expressions.append(c.expression)
-        for k, c in self.soft_constraints_dict.items():
-            weights.append(c.weight)
-            lbA.append(c.lower)
-            ubA.append(c.upper)
-            lb.append(-BIG_NUMBER)
-            ub.append(BIG_NUMBER)
-            assert not w.is_matrix(c.expression), u'Matrices are not allowed as soft constraint expression'
-            soft_expressions.append(c.expression)
-
-        self.cython_big_ass_M = w.load_compiled_function(self.path_to_functions)
-        self.np_g = np.zeros(len(weights))
-
-        if self.cython_big_ass_M is None:
-            logging.loginfo(u'new controller with {} constraints requested; compiling'.format(len(soft_expressions)))
-            h = len(self.hard_constraints_dict)
-            s = len(self.soft_constraints_dict)
-            c = len(self.joint_constraints_dict)
-
-            #       c           s       1      1
-            #   |----------------------------------
-            # h | A hard    |   0    |       |
-            #   | -------------------| lbA   | ubA
-            # s | A soft    |identity|       |
-            #   |-----------------------------------
-            #c+s| H                  | lb    | ub
-            #   | ----------------------------------
-            self.big_ass_M = w.zeros(h+s+s+c, c+s+2)
+        self.compiled_blocks = [self.make_block(list(self.joint_constraints_dict.keys()) +
+                                                list(self.hard_constraints_dict.keys()),
+                                                weights, lb, ub, lbA, ubA, hard_expressions)]
 
-            self.big_ass_M[h+s:,:-2] = w.diag(*weights)
+        for block in self.soft_constraint_blocks:
+            weights = []
+            lbA = []
+            ubA = []
+            soft_expressions = []
+            for k in block:
+                c = self.soft_constraints_dict[k]
+                weights.append(c.weight)
+                lbA.append(c.lower)
+                ubA.append(c.upper)
+                assert not w.is_matrix(c.expression), u'Matrices are not allowed as soft constraint expression'
+                soft_expressions.append(c.expression)
+            self.compiled_blocks.append(self.make_block(block, weights, [], [], lbA, ubA, soft_expressions))
 
-            self.lb = w.Matrix(lb)
-            self.ub = w.Matrix(ub)
+        # the parameters of all blocks, every block picks its own from them
+        self.str_params = []
+        param_indices = {}
+        for f in self.compiled_blocks:
+            for param in f.str_params:
+                if param not in param_indices:
+                    param_indices[param] = len(self.str_params)
+                    self.str_params.append(param)
+        self.block_param_indices = [np.array([param_indices[param] for param in f.str_params], dtype=int)
+                                    for f in self.compiled_blocks]
+        logging.loginfo(u'controller ready {}s'.format(time() - t_total))
+        self.init_buffers()
 
-            # make A
-            # hard part
-            A_hard = w.Matrix(hard_expressions)
-            A_hard = w.jacobian(A_hard, self.controlled_joints)
-            self.big_ass_M[:h, :c] = A_hard
-
-            # soft part
-            A_soft = w.Matrix(soft_expressions)
+    def make_block(self, keys, weights, lb, ub, lbA, ubA, expressions):
+        """
+        Loads the function of a block of constraints from the cache or compiles it.
+        :param keys: of the constraints in this block, used to identify its function in the cache
+        :type keys: list
+        :return: function that computes weights, lb, ub, lbA, ubA and the non zeros of the rows of A of this block
+        :rtype: w.CompiledSparseFunction
+        """
+        file_name = block_file_name(self.path_to_functions, keys) if self.path_to_functions else None
+        f = w.load_compiled_function(file_name) if file_name else None
+        if f is None:
+            logging.loginfo(u'new controller block with {} constraints requested; compiling'.format(len(keys)))
             t = time()
-            A_soft = w.jacobian(A_soft, self.controlled_joints)
+            A = w.jacobian(w.Matrix(expressions), self.controlled_joints)
             logging.loginfo(u'jacobian took {}'.format(time() - t))
-            identity = w.eye(A_soft.shape[0])
-            self.big_ass_M[h:h+s, :c] = A_soft
-            self.big_ass_M[h:h+s, c:c+s] = identity
+            outputs = [w.densify(w.Matrix(x)) for x in [weights, lb, ub, lbA, ubA]]
+            outputs.append(A)
 
+            t = time()
+            free_symbols = self.free_symbols
+            if free_symbols is None:
+                free_symbols = w.free_symbols(w.Matrix(weights + lb + ub + lbA + ubA + expressions))
+            f = w.speed_up_sparse(outputs, free_symbols)
+            logging.loginfo(u'autowrap took {}'.format(time() - t))
+            if file_name:
+                w.safe_compiled_function(f, file_name)
+        else:
+            logging.loginfo(u'controller block loaded {}'.format(file_name))
+        if self.compiler and file_name:
+            f = w.compile_native(f, file_name, self.compiler)
+        return f
 
-            self.lbA = w.Matrix(lbA)
-            self.ubA = w.Matrix(ubA)
+    def init_buffers(self):
+        """
+        Allocates the arrays that are handed to the qp solver and tells the compiled functions where to write.
+        """
+        h = len(self.hard_constraints_dict)
+        s = len(self.soft_constraints_dict)
+        c = len(self.joint_constraints_dict)
 
-            self.big_ass_M[:h+s, c+s] = self.lbA
-            self.big_ass_M[:h+s, c+s+1] = self.ubA
-            self.big_ass_M[h+s:, c+s] = self.lb
-            self.big_ass_M[h+s:, c+s+1] = self.ub
+        self.np_weights = np.zeros(c + s)
+        self.np_H = np.zeros((c + s, c + s))
+        self.np_H_diagonal = self.np_H.reshape(-1)[::c + s + 1]
+        self.np_g = np.zeros(c + s)
 
-            t = time()
-            if self.free_symbols is None:
-                self.free_symbols = w.free_symbols(self.big_ass_M)
-            self.cython_big_ass_M = w.speed_up(self.big_ass_M,
-                                               self.free_symbols)
-            if self.path_to_functions is not None:
-                # safe_compiled_function(self.cython_big_ass_M, self.path_to_functions)
-                logging.loginfo(u'autowrap took {}'.format(time() - t))
-        else:
-            logging.loginfo(u'controller loaded {}'.format(self.path_to_functions))
-            logging.loginfo(u'controller ready {}s'.format(time() - t_total))
+        self.np_lb = np.zeros(c + s)
+        self.np_lb[c:] = -BIG_NUMBER
+        self.np_ub = np.zeros(c + s)
+        self.np_ub[c:] = BIG_NUMBER
+        self.np_lbA = np.zeros(h + s)
+        self.np_ubA = np.zeros(h + s)
+
+        self.np_A = np.zeros((h + s, c + s))
+        self.np_A[h:, c:] = np.eye(s)
+        A_indices = []
+        row_offset = 0
+        for f in self.compiled_blocks:
+            rows, columns = f.sparsity(5)
+            A_indices.append(np.ravel_multi_index((rows + row_offset, columns), self.np_A.shape))
+            row_offset += f.nnz(3)
+        self.A_indices = np.concatenate(A_indices)
+        self.np_A_non_zeros = np.zeros(len(self.A_indices))
+        # the entries of A that can be non zero
+        self.A_sparsity = np.zeros(self.np_A.shape, dtype=bool)
+        self.A_sparsity.flat[self.A_indices] = True
+        self.A_sparsity[h:, c:] = np.eye(s, dtype=bool)
+
+        # the joint block writes lb and ub and the first rows, the soft blocks the following rows
+        row_offset = 0
+        A_offset = 0
+        for i, f in enumerate(self.compiled_blocks):
+            if i == 0:
+                b, bA = c, h
+                weights = self.np_weights[:c]
+                lbA = self.np_lbA[:h]
+                ubA = self.np_ubA[:h]
+            else:
+                b, bA = 0, f.nnz(3)
+                weights = self.np_weights[c + row_offset:c + row_offset + bA]
+                lbA = self.np_lbA[h + row_offset:h + row_offset + bA]
+                ubA = self.np_ubA[h + row_offset:h + row_offset + bA]
+                row_offset += bA
+            for j, buffer in enumerate([weights, self.np_lb[:b], self.np_ub[:b], lbA, ubA,
+                                        self.np_A_non_zeros[A_offset:A_offset + f.nnz(5)]]):
+                f.set_out(j, buffer)
+            A_offset += f.nnz(5)
 
     def save_pickle(self, hash, f):
         with open(u'/tmp/{}'.format(hash), u'w') as file:
@@ -250,13 +326,19 @@ class QProblemBuilder(object):
         :return: joint name -> joint command
         :rtype: dict
         """
-        np_big_ass_M = self.cython_big_ass_M.call2(substitutions)
-        np_H = np_big_ass_M[self.shape1:, :-2].copy()
-        np_A = np_big_ass_M[:self.shape1, :self.shape2].copy()
-        np_lb = np_big_ass_M[self.shape1:, -2].copy()
-        np_ub = np_big_ass_M[self.shape1:, -1].copy()
-        np_lbA = np_big_ass_M[:self.shape1, -2].copy()
-        np_ubA = np_big_ass_M[:self.shape1, -1].copy()
+        substitutions = np.asarray(substitutions, dtype=float)
+        for f, param_indices in zip(self.compiled_blocks, self.block_param_indices):
+            f.call2(substitutions[param_indices])
+        self.np_H_diagonal[:] = self.np_weights
+        self.np_A.put(self.A_indices, self.np_A_non_zeros)
+        np_H = self.np_H
+        np_A = self.np_A
+        np_lb = self.np_lb
+        np_ub = self.np_ub
+        np_lbA = self.np_lbA
+        np_ubA = self.np_ubA
+        if self.recorder is not None:
+            self.recorder.record(np_H, np_A, np_lb, np_ub, np_lbA, np_ubA)
         # self.debug_print(np_H, np_A, np_lb, np_ub, np_lbA, np_ubA)
         try:
             xdot_full = self.qp_solver.solve(np_H, self.np_g, np_A, np_lb, np_ub, np_lbA, np_ubA, nWSR)
@@ -266,7 +348,7 @@ class QProblemBuilder(object):
         if xdot_full is None:
             return None
         # TODO enable debug print in an elegant way, preferably without slowing anything down
-        self.debug_print(np_H, np_A, np_lb, np_ub, np_lbA, np_ubA, xdot_full)
+        # self.debug_print(np_H, np_A, np_lb, np_ub, np_lbA, np_ubA, xdot_full)
         return OrderedDict((observable, xdot_full[i]) for i, observable in enumerate(self.controlled_joints)), \
                np_H, np_A, np_lb, np_ub, np_lbA, np_ubA, xdot_full
 
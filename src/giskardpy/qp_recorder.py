@@ -0,0 +1,82 @@
+import gzip
+import pickle
+
+import numpy as np
+
+from giskardpy import logging
+from giskardpy.utils import create_path
+
+RECORDING_VERSION = 1
+
+
+class QPRecorder(object):
+    """
+    Streams the qp problems of every control cycle into a gzip compressed file.
+    The first entry is a header with the dimensions of the problem and the constraint key maps,
+    every following entry is one cycle. Use load_recording to read it.
+    """
+
+    def __init__(self, file_name, dimensions, key_maps, **kwargs):
+        """
+        :type file_name: str
+        :param dimensions: number of hard, joint and soft constraints
+        :type dimensions: tuple
+        :param key_maps: weight_keys, b_keys, bA_keys and xdot_keys, see InstantaneousController.get_qpdata_key_map
+        :type key_maps: tuple
+        :param kwargs: additional information, that is saved in the header
+        """
+        create_path(file_name)
+        self.file_name = file_name
+        self.file = gzip.open(file_name, u'wb', compresslevel=1)
+        self.cycles = 0
+        header = {u'version': RECORDING_VERSION,
+                  u'dimensions': tuple(dimensions),
+                  u'weight_keys': key_maps[0],
+                  u'b_keys': key_maps[1],
+                  u'bA_keys': key_maps[2],
+                  u'xdot_keys': key_maps[3]}
+        header.update(kwargs)
+        pickle.dump(header, self.file, protocol=2)
+        logging.loginfo(u'recording qp problems to {}'.format(file_name))
+
+    def record(self, H, A, lb, ub, lbA, ubA):
+        """
+        Saves a copy of one problem, H is reduced to its diagonal if possible.
+        """
+        if np.count_nonzero(H) == np.count_nonzero(np.diagonal(H)):
+            H = np.diagonal(H)
+        pickle.dump((H, A, lb, ub, lbA, ubA), self.file, protocol=2)
+        self.cycles += 1
+
+    def close(self):
+        self.file.close()
+        logging.loginfo(u'recorded {} qp problems to {}'.format(self.cycles, self.file_name))
+
+
+def load_recording(file_name):
+    """
+    :type file_name: str
+    :return: header, generator of (H, g, A, lb, ub, lbA, ubA)
+    :rtype: tuple
+    """
+    f = gzip.open(file_name, u'rb')
+    header = pickle.load(f)
+    if header.get(u'version') != RECORDING_VERSION:
+        f.close()
+        raise IOError(u'{} has unsupported version {}'.format(file_name, header.get(u'version')))
+
+    def cycles():
+        try:
+            while True:
+                try:
+                    H, A, lb, ub, lbA, ubA = pickle.load(f)
+                except (EOFError, IOError):
+                    # also happens if the recording was not closed properly
+                    return
+                if H.ndim == 1:
+                    H = np.diag(H)
+                yield H, np.zeros(H.shape[0]), A, lb, ub, lbA, ubA
+        finally:
+            f.close()
+
+    return header, cycles()
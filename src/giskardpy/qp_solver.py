@@ -1,39 +1,65 @@
 import numpy as np
 
-import qpoases
-from qpoases import PyReturnValue
+from giskardpy.exceptions import QPSolverException, MAX_NWSR_REACHEDException
 
-from giskardpy.exceptions import MAX_NWSR_REACHEDException, QPSolverException
-from giskardpy import logging
+
+def get_qp_solver_class(backend):
+    """
+    :param backend: name of the qp solver backend, as used in the qp_solver section of the config
+    :type backend: str
+    :rtype: type
+    """
+    if backend == u'qpoases':
+        from giskardpy.qp_solver_qpoases import QPSolverQPOases
+        return QPSolverQPOases
+    if backend == u'osqp':
+        from giskardpy.qp_solver_osqp import QPSolverOSQP
+        return QPSolverOSQP
+    raise QPSolverException(u'unknown qp solver backend \'{}\''.format(backend))
 
 
 class QPSolver(object):
-    RETURN_VALUE_DICT = {value: name for name, value in vars(PyReturnValue).items()}
+    """
+    Base class for qp solver backends.
+    Removes variables and constraints with weight 0 from the problem and decides whether the next problem can be
+    warm started. Backends have to implement init_problem, hotstart_problem, get_primal_solution and the status
+    mapping.
+    """
+    RETURN_VALUE_DICT = {}
 
     def __init__(self, h, j, s):
         """
-        :param dim_a: number of joint constraints + number of soft constraints
-        :type int
-        :param dim_b: number of hard constraints + number of soft constraints
-        :type int
+        :param h: number of hard constraints
+        :type h: int
+        :param j: number of joint constraints
+        :type j: int
+        :param s: number of soft constraints
+        :type s: int
         """
-        # self.init(dim_a, dim_b)
         self.h = h
         self.j = j
         self.s = s
         self.started = False
         self.shape = (0,0)
-        pass
-
-    def init(self, dim_a, dim_b):
-        self.qpProblem = qpoases.PySQProblem(dim_a, dim_b)
-        options = qpoases.PyOptions()
-        options.setToMPC()
-        options.printLevel = qpoases.PyPrintLevel.NONE
-        self.qpProblem.setOptions(options)
-        self.xdot_full = np.zeros(dim_a)
+        self.mask = None
+        self.plan = None
+        # entries of A that can be non zero, None if unknown
+        self.A_sparsity = None
+        # A_sparsity of the problem without inactive constraints, replaced when the plan changes
+        self.sparsity = None
+        # statistics, updated by the backends
+        self.number_of_inits = 0
+        self.number_of_hotstarts = 0
+        self.iterations = 0
 
-        self.started = False
+    def set_A_sparsity(self, A_sparsity):
+        """
+        Tells the backend which entries of A can be non zero, such that sparse backends don't have to search A for them.
+        :param A_sparsity: bool array with the shape of A, the same for all following problems
+        :type A_sparsity: np.ndarray
+        """
+        self.A_sparsity = A_sparsity
+        self.mask = None
 
     def solve(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
         """
@@ -59,76 +85,121 @@ class QPSolver(object):
         :return: x according to the equations above, len = joint constraints + soft constraints
         :type np.array
         """
-        j_mask = H.sum(axis=1) != 0
-        s_mask = j_mask[self.j:]
-        h_mask = np.concatenate((np.array([True] * self.h), s_mask))
-        A = A[h_mask][:,j_mask].copy()
-        lbA = lbA[h_mask]
-        ubA = ubA[h_mask]
-        lb = lb[j_mask]
-        ub = ub[j_mask]
-        H = H[j_mask][:,j_mask]
-        g = np.zeros(H.shape[0])
+        j_mask = np.diagonal(H) != 0
+        if self.mask is None or not np.array_equal(j_mask, self.mask):
+            self.make_plan(j_mask, A.shape)
+        H, g, A, lb, ub, lbA, ubA = self.apply_plan(H, A, lb, ub, lbA, ubA)
         if A.shape != self.shape:
             self.started = False
             self.shape = A.shape
+        return self.solve_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
 
-        number_of_retries = 2
-        while number_of_retries > 0:
-            if nWSR is None:
-                nWSR = np.array([sum(A.shape) * 2])
-            else:
-                nWSR = np.array([nWSR])
-            number_of_retries -= 1
-            if not self.started:
-                self.init(A.shape[1], A.shape[0])
-                success = self.qpProblem.init(H, g, A, lb, ub, lbA, ubA, nWSR)
-                if success == PyReturnValue.MAX_NWSR_REACHED:
-                    self.started = False
-                    raise MAX_NWSR_REACHEDException(u'Failed to initialize QP-problem.')
-            else:
-                success = self.qpProblem.hotstart(H, g, A, lb, ub, lbA, ubA, nWSR)
-                if success == PyReturnValue.MAX_NWSR_REACHED:
-                    self.started = False
-                    raise MAX_NWSR_REACHEDException(u'Failed to hot start QP-problem.')
-            if success == PyReturnValue.SUCCESSFUL_RETURN:
-                self.started = True
-                break
-            elif success == PyReturnValue.NAN_IN_LB:
-                # TODO nans get replaced with 0 document this somewhere
-                # TODO might still be buggy when nan occur when the qp problem is already initialized
-                lb[np.isnan(lb)] = 0
-                nWSR = None
-                self.started = False
-                number_of_retries += 1
-                continue
-            elif success == PyReturnValue.NAN_IN_UB:
-                ub[np.isnan(ub)] = 0
-                nWSR = None
-                self.started = False
-                number_of_retries += 1
-                continue
-            elif success == PyReturnValue.NAN_IN_LBA:
-                lbA[np.isnan(lbA)] = 0
-                nWSR = None
-                self.started = False
-                number_of_retries += 1
-                continue
-            elif success == PyReturnValue.NAN_IN_UBA:
-                ubA[np.isnan(ubA)] = 0
-                nWSR = None
-                self.started = False
-                number_of_retries += 1
-                continue
-            else:
-                logging.loginfo(u'{}; retrying with A rounded to 5 decimal places'.format(self.RETURN_VALUE_DICT[success]))
-                r = 5
-                A = np.round(A, r)
-                nWSR = None
-                self.started = False
-        else:  # if not break
-            self.started = False
-            raise QPSolverException(self.RETURN_VALUE_DICT[success])
+    def solve_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        Solves the problem without inactive constraints, warm starts if the last problem had the same shape.
+        :return: x
+        :rtype: np.array
+        """
+        if not self.started:
+            status = self.init_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
+        else:
+            status = self.hotstart_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
+        if self.is_success(status):
+            self.started = True
+            return self.get_primal_solution()
+        self.started = False
+        if self.is_max_iterations_reached(status):
+            raise MAX_NWSR_REACHEDException(self.status_to_str(status))
+        raise QPSolverException(self.status_to_str(status))
+
+    def init_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        Sets up a new problem and solves it without warm start.
+        Has to increase number_of_inits and set iterations.
+        :return: status of the solver
+        """
+        raise NotImplementedError()
+
+    def hotstart_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        Solves a problem with the same shape as the last one, using the last solution as warm start.
+        Has to increase number_of_hotstarts and set iterations.
+        :return: status of the solver
+        """
+        raise NotImplementedError()
+
+    def get_primal_solution(self):
+        """
+        :return: x of the last successful solve
+        :rtype: np.array
+        """
+        raise NotImplementedError()
+
+    def is_success(self, status):
+        """
+        :rtype: bool
+        """
+        raise NotImplementedError()
+
+    def is_max_iterations_reached(self, status):
+        """
+        :rtype: bool
+        """
+        return False
 
-        self.qpProblem.getPrimalSolution(self.xdot_full)
-        return self.xdot_full
+    def status_to_str(self, status):
+        """
+        :rtype: str
+        """
+        return self.RETURN_VALUE_DICT.get(status, str(status))
+
+    def make_plan(self, j_mask, A_shape):
+        """
+        Computes the indices of rows and columns that belong to constraints with a weight != 0 and allocates the
+        buffers for the reduced problem. The plan is reused until the set of active weights changes.
+        :param j_mask: True for every variable with a weight != 0
+        :type j_mask: np.array
+        :type A_shape: tuple
+        """
+        self.mask = j_mask
+        if self.A_sparsity is None:
+            A_sparsity = np.ones(A_shape, dtype=bool)
+        else:
+            A_sparsity = self.A_sparsity
+        if j_mask.all():
+            # nothing to remove, the matrices are passed to qpoases as they are
+            self.plan = None
+            self.g = np.zeros(len(j_mask))
+            self.sparsity = A_sparsity
+            return
+        j_index = np.flatnonzero(j_mask)
+        h_index = np.concatenate((np.arange(self.h), self.h + np.flatnonzero(j_mask[self.j:])))
+        self.sparsity = A_sparsity[np.ix_(h_index, j_index)]
+        self.plan = (j_index,
+                     h_index,
+                     (j_index[:, None] * len(j_mask) + j_index).ravel(),
+                     (h_index[:, None] * A_shape[1] + j_index).ravel())
+        self.H = np.zeros((len(j_index), len(j_index)))
+        self.g = np.zeros(len(j_index))
+        self.A = np.zeros((len(h_index), len(j_index)))
+        self.lb = np.zeros(len(j_index))
+        self.ub = np.zeros(len(j_index))
+        self.lbA = np.zeros(len(h_index))
+        self.ubA = np.zeros(len(h_index))
+
+    def apply_plan(self, H, A, lb, ub, lbA, ubA):
+        """
+        Copies the active part of the problem into the buffers of the current plan.
+        :return: H, g, A, lb, ub, lbA, ubA of the reduced problem
+        :rtype: tuple
+        """
+        if self.plan is None:
+            return H, self.g, A, lb, ub, lbA, ubA
+        j_index, h_index, H_index, A_index = self.plan
+        np.take(H, H_index, out=self.H.reshape(-1))
+        np.take(A, A_index, out=self.A.reshape(-1))
+        np.take(lb, j_index, out=self.lb)
+        np.take(ub, j_index, out=self.ub)
+        np.take(lbA, h_index, out=self.lbA)
+        np.take(ubA, h_index, out=self.ubA)
+        return self.H, self.g, self.A, self.lb, self.ub, self.lbA, self.ubA
@@ -0,0 +1,100 @@
+import numpy as np
+import osqp
+from scipy import sparse
+
+from giskardpy.qp_solver import QPSolver
+
+
+class QPSolverOSQP(QPSolver):
+    """
+    Sparse ADMM solver, warm starts from the last primal and dual solution.
+    OSQP solves min 0.5 x^T*P*x + q^T*x s.t. l < C*x < u, the variable bounds are added as identity rows to C.
+    The structure of C is built from the sparsity of A, see QPSolver.set_A_sparsity, and reused until the rows or
+    columns of the problem change, in between only the values get updated. H has to be diagonal.
+    NaNs in the bounds are replaced with 0, like in the qpoases backend.
+    """
+    RETURN_VALUE_DICT = {
+        1: u'SOLVED',
+        2: u'SOLVED_INACCURATE',
+        -2: u'MAX_ITER_REACHED',
+        -3: u'PRIMAL_INFEASIBLE',
+        3: u'PRIMAL_INFEASIBLE_INACCURATE',
+        -4: u'DUAL_INFEASIBLE',
+        4: u'DUAL_INFEASIBLE_INACCURATE',
+        -5: u'SIGINT',
+        -6: u'TIME_LIMIT_REACHED',
+        -7: u'NON_CVX',
+        -10: u'UNSOLVED',
+    }
+    SETTINGS = {
+        u'verbose': False,
+        u'eps_abs': 1e-5,
+        u'eps_rel': 1e-5,
+        u'max_iter': 10000,
+        u'polish': True,
+        u'warm_start': True,
+    }
+
+    def init_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        nWSR is ignored, the number of iterations is limited by SETTINGS['max_iter'].
+        """
+        dim_b, dim_a = A.shape
+        # column major order, because that is how csc matrices store their values
+        C_sparsity = np.vstack((self.sparsity, np.eye(dim_a, dtype=bool)))
+        C_columns, C_rows = np.nonzero(C_sparsity.T)
+        A_entries = C_rows < dim_b
+        # position of the entries of A in Cx and in A, the entries of the bounds stay 1
+        self.Cx_A_index = np.flatnonzero(A_entries)
+        self.A_index = np.ravel_multi_index((C_rows[A_entries], C_columns[A_entries]), A.shape)
+        self.Cx = np.ones(len(C_rows))
+        self.C_sparsity = self.sparsity
+        self.l = np.zeros(dim_b + dim_a)
+        self.u = np.zeros(dim_b + dim_a)
+        # H is diagonal
+        self.Px = np.zeros(dim_a)
+        self.fill(H, A, lb, ub, lbA, ubA)
+        P_index = np.arange(dim_a)
+        self.number_of_inits += 1
+        self.qpProblem = osqp.OSQP()
+        self.qpProblem.setup(P=sparse.csc_matrix((self.Px, (P_index, P_index)), shape=H.shape),
+                             q=g,
+                             A=sparse.csc_matrix((self.Cx, (C_rows, C_columns)), shape=C_sparsity.shape),
+                             l=self.l,
+                             u=self.u,
+                             **self.SETTINGS)
+        return self.solve_osqp()
+
+    def hotstart_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        if self.sparsity is not self.C_sparsity:
+            # a new plan with the same shape but other rows
+            return self.init_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
+        self.fill(H, A, lb, ub, lbA, ubA)
+        self.number_of_hotstarts += 1
+        self.qpProblem.update(Px=self.Px, Ax=self.Cx, q=g, l=self.l, u=self.u)
+        return self.solve_osqp()
+
+    def fill(self, H, A, lb, ub, lbA, ubA):
+        dim_b = A.shape[0]
+        self.Px[:] = np.diagonal(H)
+        self.Cx.put(self.Cx_A_index, A.take(self.A_index))
+        self.l[:dim_b] = lbA
+        self.l[dim_b:] = lb
+        self.u[:dim_b] = ubA
+        self.u[dim_b:] = ub
+        self.l[np.isnan(self.l)] = 0
+        self.u[np.isnan(self.u)] = 0
+
+    def solve_osqp(self):
+        self.results = self.qpProblem.solve()
+        self.iterations = self.results.info.iter
+        return self.results.info.status_val
+
+    def get_primal_solution(self):
+        return self.results.x
+
+    def is_success(self, status):
+        return status in (1, 2)
+
+    def is_max_iterations_reached(self, status):
+        return status == -2
@@ -0,0 +1,115 @@
+import numpy as np
+
+import qpoases
+from qpoases import PyReturnValue
+
+from giskardpy.exceptions import MAX_NWSR_REACHEDException, QPSolverException
+from giskardpy import logging
+from giskardpy.qp_solver import QPSolver
+
+
+class QPSolverQPOases(QPSolver):
+    """
+    Dense active set solver, warm starts through qpoases' hotstart.
+    """
+    RETURN_VALUE_DICT = {value: name for name, value in vars(PyReturnValue).items()}
+
+    def init(self, dim_a, dim_b):
+        self.qpProblem = qpoases.PySQProblem(dim_a, dim_b)
+        options = qpoases.PyOptions()
+        options.setToMPC()
+        options.printLevel = qpoases.PyPrintLevel.NONE
+        self.qpProblem.setOptions(options)
+        self.xdot_full = np.zeros(dim_a)
+
+        self.started = False
+
+    def solve_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        number_of_retries = 2
+        while number_of_retries > 0:
+            if nWSR is None:
+                nWSR = np.array([sum(A.shape) * 2])
+            else:
+                nWSR = np.array([nWSR])
+            number_of_retries -= 1
+            if not self.started:
+                success = self.init_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
+                if success == PyReturnValue.MAX_NWSR_REACHED:
+                    self.started = False
+                    raise MAX_NWSR_REACHEDException(u'Failed to initialize QP-problem.')
+            else:
+                success = self.hotstart_problem(H, g, A, lb, ub, lbA, ubA, nWSR)
+                if success == PyReturnValue.MAX_NWSR_REACHED:
+                    self.started = False
+                    raise MAX_NWSR_REACHEDException(u'Failed to hot start QP-problem.')
+            if success == PyReturnValue.SUCCESSFUL_RETURN:
+                self.started = True
+                break
+            elif success == PyReturnValue.NAN_IN_LB:
+                # TODO nans get replaced with 0 document this somewhere
+                # TODO might still be buggy when nan occur when the qp problem is already initialized
+                lb[np.isnan(lb)] = 0
+                nWSR = None
+                self.started = False
+                number_of_retries += 1
+                continue
+            elif success == PyReturnValue.NAN_IN_UB:
+                ub[np.isnan(ub)] = 0
+                nWSR = None
+                self.started = False
+                number_of_retries += 1
+                continue
+            elif success == PyReturnValue.NAN_IN_LBA:
+                lbA[np.isnan(lbA)] = 0
+                nWSR = None
+                self.started = False
+                number_of_retries += 1
+                continue
+            elif success == PyReturnValue.NAN_IN_UBA:
+                ubA[np.isnan(ubA)] = 0
+                nWSR = None
+                self.started = False
+                number_of_retries += 1
+                continue
+            else:
+                logging.loginfo(u'{}; retrying with A rounded to 5 decimal places'.format(self.RETURN_VALUE_DICT[success]))
+                r = 5
+                A = np.round(A, r)
+                nWSR = None
+                self.started = False
+        else:  # if not break
+            self.started = False
+            raise QPSolverException(self.RETURN_VALUE_DICT[success])
+
+        return self.get_primal_solution()
+
+    def init_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        :param nWSR: max number of working set recalculations, contains the number of used ones afterwards
+        :type nWSR: np.array
+        """
+        self.init(A.shape[1], A.shape[0])
+        self.number_of_inits += 1
+        status = self.qpProblem.init(H, g, A, lb, ub, lbA, ubA, nWSR)
+        self.iterations = nWSR[0]
+        return status
+
+    def hotstart_problem(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        :param nWSR: max number of working set recalculations, contains the number of used ones afterwards
+        :type nWSR: np.array
+        """
+        self.number_of_hotstarts += 1
+        status = self.qpProblem.hotstart(H, g, A, lb, ub, lbA, ubA, nWSR)
+        self.iterations = nWSR[0]
+        return status
+
+    def get_primal_solution(self):
+        self.qpProblem.getPrimalSolution(self.xdot_full)
+        return self.xdot_full
+
+    def is_success(self, status):
+        return status == PyReturnValue.SUCCESSFUL_RETURN
+
+    def is_max_iterations_reached(self, status):
+        return status == PyReturnValue.MAX_NWSR_REACHED
@@ -1,8 +1,12 @@
 import hashlib
+import os
 import warnings
 from collections import OrderedDict
 from itertools import chain
-from giskardpy.qp_problem_builder import QProblemBuilder, SoftConstraint
+
+from giskardpy import symbolic_wrapper as w
+from giskardpy.qp_problem_builder import QProblemBuilder, SoftConstraint, block_file_name
+from giskardpy.qp_recorder import QPRecorder
 from giskardpy.symengine_robot import Robot
 
 
@@ -14,18 +18,26 @@ class InstantaneousController(object):
     # TODO should anybody who uses this class know about constraints?
 
 
-    def __init__(self, robot, path_to_functions):
+    def __init__(self, robot, path_to_functions, backend=u'qpoases', compiler=None):
         """
         :type robot: Robot
         :param path_to_functions: location where compiled functions are stored
         :type: str
+        :param backend: name of the qp solver
+        :type backend: str
+        :param compiler: c compiler used to generate native code for the qp matrices, None to disable
+        :type compiler: str
         """
         self.path_to_functions = path_to_functions
+        self.backend = backend
+        self.compiler = compiler
         self.robot = robot
         self.controlled_joints = []
         self.hard_constraints = {}
         self.joint_constraints = {}
         self.soft_constraints = {}
+        self.soft_constraint_blocks = []
+        self.fk_links = set()
         self.free_symbols = None
         self.qp_problem_builder = None
 
@@ -63,37 +75,104 @@ class InstantaneousController(object):
             xdot_keys.append(key)
         return weights_keys, b_keys, bA_keys, xdot_keys
 
+    def get_qp_dimensions(self):
+        """
+        :return: number of hard, joint and soft constraints
+        :rtype: tuple
+        """
+        return len(self.hard_constraints), len(self.joint_constraints), len(self.soft_constraints)
+
     def update_soft_constraints(self, soft_constraints, free_symbols=None):
         """
-        Triggers a recompile if the number of soft constraints has changed.
+        Adds soft constraints, constraints with an existing key get replaced. They are used by the next call of compile,
+        which only compiles the blocks whose keys aren't cached yet, see get_function_file_names.
         :type soft_constraints: dict
         :type free_symbols: set
         """
         if free_symbols is not None:
             warnings.warn(u'use of free_symbols deprecated', DeprecationWarning)
-        # TODO bug if soft constraints get replaced, actual amount does not change.
-        last_number_of_constraints = len(self.soft_constraints)
-        if free_symbols is not None:
             if self.free_symbols is None:
                 self.free_symbols = set()
             self.free_symbols.update(free_symbols)
         self.soft_constraints.update(soft_constraints)
-        if last_number_of_constraints != len(self.soft_constraints):
-            self.qp_problem_builder = None
 
+    def set_soft_constraint_blocks(self, soft_constraint_blocks):
+        """
+        Every block of soft constraints is compiled and cached separately, such that controllers with different
+        combinations of constraints can reuse them.
+        :param soft_constraint_blocks: lists of soft constraint keys
+        :type soft_constraint_blocks: list
+        """
+        self.soft_constraint_blocks = soft_constraint_blocks
+
+    def set_fk_links(self, fk_links):
+        """
+        Only the kinematics of these links and of the original urdf are part of the file names of the compiled
+        functions, such that attaching objects, which are not used by the soft constraints, doesn't trigger a recompile.
+        :param fk_links: links used in the fk expressions of the soft constraints
+        :type fk_links: set
+        """
+        self.fk_links = fk_links
+
+    def get_soft_constraint_blocks(self):
+        """
+        :return: the soft constraint blocks, soft constraints without block are put into an additional one
+        :rtype: list
+        """
+        blocks = []
+        remaining_keys = OrderedDict((k, None) for k in self.soft_constraints)
+        for block in self.soft_constraint_blocks:
+            block = [k for k in block if k in remaining_keys]
+            for k in block:
+                del remaining_keys[k]
+            if block:
+                # sorted, because the rows of a cached function have the order of the keys it was compiled with
+                blocks.append(sorted(block))
+        if remaining_keys:
+            blocks.append(sorted(remaining_keys))
+        return blocks
+
+    def get_path_to_functions(self):
+        """
+        :return: prefix of the file names of the compiled functions, depends on the kinematics of the robot and the
+                 controlled joints
+        :rtype: str
+        """
+        # the columns of A have the order of the controlled joints
+        a = u'\n'.join(str(x) for x in chain(self.controlled_joints, self.hard_constraints.keys()))
+        function_hash = hashlib.md5(a + self.robot.get_kinematic_hash(sorted(self.fk_links))).hexdigest()
+        return u'{}{}_'.format(self.path_to_functions, function_hash)
+
+    def get_function_file_names(self):
+        """
+        :return: where the compiled functions of the joint constraints and each soft constraint block are cached
+        :rtype: list
+        """
+        path_to_functions = self.get_path_to_functions()
+        return [block_file_name(path_to_functions, list(self.joint_constraints) + list(self.hard_constraints))] + \
+               [block_file_name(path_to_functions, block) for block in self.get_soft_constraint_blocks()]
+
+    def is_compiled(self):
+        """
+        :return: whether compile can load all functions of the current constraints from the cache
+        :rtype: bool
+        """
+        return all(os.path.isfile(w.compiled_function_file_name(file_name))
+                   for file_name in self.get_function_file_names())
 
     def compile(self):
-        a = ''.join(str(x) for x in sorted(chain(self.soft_constraints.keys(),
-                                                 self.hard_constraints.keys(),
-                                                 self.joint_constraints.keys())))
-        function_hash = hashlib.md5(a + self.robot.get_urdf_str()).hexdigest()
-        path_to_functions = self.path_to_functions + function_hash
+        blocks = self.get_soft_constraint_blocks()
+        # the rows of the qp are sorted by block
+        self.soft_constraints = OrderedDict((k, self.soft_constraints[k]) for block in blocks for k in block)
         self.qp_problem_builder = QProblemBuilder(self.joint_constraints,
                                                   self.hard_constraints,
                                                   self.soft_constraints,
                                                   self.joint_to_symbols_str.values(),
                                                   self.free_symbols,
-                                                  path_to_functions)
+                                                  self.get_path_to_functions(),
+                                                  self.backend,
+                                                  self.compiler,
+                                                  blocks)
 
     def get_cmd(self, substitutions, nWSR=None):
         """
@@ -114,3 +193,20 @@ class InstantaneousController(object):
     def get_expr(self):
         return self.qp_problem_builder.get_expr()
 
+    def start_recording(self, file_name):
+        """
+        Saves every following qp problem in file_name, until stop_recording is called.
+        :type file_name: str
+        """
+        self.stop_recording()
+        self.qp_problem_builder.recorder = QPRecorder(file_name,
+                                                      self.get_qp_dimensions(),
+                                                      self.get_qpdata_key_map(),
+                                                      robot=self.robot.get_name(),
+                                                      backend=self.backend)
+
+    def stop_recording(self):
+        if self.qp_problem_builder is not None and self.qp_problem_builder.recorder is not None:
+            self.qp_problem_builder.recorder.close()
+            self.qp_problem_builder.recorder = None
+
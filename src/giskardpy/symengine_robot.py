@@ -1,15 +1,18 @@
+import hashlib
+import json
 import traceback
 from collections import namedtuple, OrderedDict, defaultdict
 from copy import deepcopy
 from itertools import combinations
 
+import numpy as np
 from geometry_msgs.msg import PoseStamped
 
 from giskardpy import WORLD_IMPLEMENTATION, symbolic_wrapper as w
 from giskardpy.pybullet_world_object import PyBulletWorldObject
 from giskardpy.qp_problem_builder import HardConstraint, JointConstraint
 from giskardpy.utils import KeyDefaultDict, \
-    homo_matrix_to_pose, memoize
+    homo_matrix_to_pose, memoize, clear_memo
 from giskardpy.world_object import WorldObject
 
 Joint = namedtuple(u'Joint', [u'symbol', u'velocity_limit', u'lower', u'upper', u'type', u'frame'])
@@ -32,9 +35,20 @@ class Robot(Backend):
         :type joint_vel_limit: Symbol
         """
         self._fk_expressions = {}
-        self._fks = {}
-        self._evaluated_fks = {}
+        self._fks = None
+        # link name -> index of its pose in the result of self._fks
+        self._link_to_fk_index = {}
+        # poses of all links relative to the root for the current joint state
+        self._evaluated_fks = None
+        # link name -> (joint frame of its parent joint, pose relative to the root), reused by init_fast_fks
+        self._root_T_links = {}
         self._joint_to_frame = {}
+        # joint name -> signature of the joint, when its frame and constraints were created
+        self._joint_to_signature = {}
+        self._hard_constraints = OrderedDict()
+        self._joint_constraints = OrderedDict()
+        # links that were passed to get_fk_expression since the last call of pop_fk_expression_links
+        self._fk_expression_links = set()
         if joint_weights is None:
             self._joint_weights = defaultdict(lambda: 0)
         else:
@@ -50,6 +64,8 @@ class Robot(Backend):
             self._joint_acc_limit = joint_acc_limit
         self._joint_position_symbols = KeyDefaultDict(lambda x: w.Symbol(x))  # don't iterate over this map!!
         self._joint_velocity_symbols = KeyDefaultDict(lambda x: 0)  # don't iterate over this map!!
+        # (names of a JointStates, str of the position symbol of each name)
+        self._joint_state_symbol_names = (None, [])
         super(Robot, self).__init__(urdf, base_pose, controlled_joints, path_to_data_folder, calc_self_collision_matrix,
                                     *args, **kwargs)
         self.reinitialize()
@@ -71,10 +87,13 @@ class Robot(Backend):
         :return:
         """
         Backend.joint_state.fset(self, value)
-        self.__joint_state_positions = {str(self._joint_position_symbols[k]): v.position for k, v in
-                                        self.joint_state.items()}
-        # self._evaluated_fks.clear()
-        self.get_fk_np.memo.clear()
+        joint_state = self.joint_state
+        if self._joint_state_symbol_names[0] is not joint_state.names:
+            self._joint_state_symbol_names = (joint_state.names,
+                                              [str(self._joint_position_symbols[k]) for k in joint_state.names])
+        self.__joint_state_positions = dict(zip(self._joint_state_symbol_names[1], joint_state.position.tolist()))
+        self._evaluated_fks = None
+        clear_memo(self, u'get_fk_np')
 
     @memoize
     def get_controlled_parent_joint(self, link_name):
@@ -99,17 +118,33 @@ class Robot(Backend):
             # TODO don't change the input parameter
             self._joint_position_symbols = joint_position_symbols
             self._joint_velocity_symbols = joint_vel_symbols
+            self._joint_to_signature = {}
+            self._joint_state_symbol_names = (None, [])
         self._fk_expressions = {}
-        self._create_frames_expressions()
-        self._create_constraints()
+        self._fk_expression_links = set()
+        # joints whose origin, axis, limits or mimic data changed, new joints included
+        changed_joints = {joint_name for joint_name in self.get_joint_names()
+                          if self._joint_to_signature.get(joint_name) != self.get_joint_signature(joint_name)}
+        self._create_frames_expressions(changed_joints)
+        self._create_constraints(changed_joints)
+        self._joint_to_signature = {joint_name: self.get_joint_signature(joint_name)
+                                    for joint_name in self.get_joint_names()}
         self.init_fast_fks()
 
     def update_self_collision_matrix(self, added_links=None, removed_links=None):
         if self._calc_self_collision_matrix:
             super(Robot, self).update_self_collision_matrix(added_links, removed_links)
 
-    def _create_frames_expressions(self):
+    def _create_frames_expressions(self, changed_joints):
+        """
+        Creates the frames of changed joints, the frames of all other joints are kept.
+        :type changed_joints: set
+        """
+        joint_to_frame = {}
         for joint_name, urdf_joint in self._urdf_robot.joint_map.items():
+            if joint_name not in changed_joints:
+                joint_to_frame[joint_name] = self._joint_to_frame[joint_name]
+                continue
             if self.is_joint_controllable(joint_name):
                 joint_symbol = self.get_joint_position_symbol(joint_name)
             if self.is_joint_mimic(joint_name):
@@ -136,15 +171,24 @@ class Robot(Backend):
                                                                 translation_axis[1],
                                                                 translation_axis[2]))
 
-            self._joint_to_frame[joint_name] = joint_frame
+            joint_to_frame[joint_name] = joint_frame
+        self._joint_to_frame = joint_to_frame
 
-    def _create_constraints(self):
+    def _create_constraints(self, changed_joints):
         """
-        Creates hard and joint constraints.
+        Creates hard and joint constraints of changed joints, the constraints of all other joints are kept.
+        :type changed_joints: set
         """
+        old_hard_constraints = self._hard_constraints
+        old_joint_constraints = self._joint_constraints
         self._hard_constraints = OrderedDict()
         self._joint_constraints = OrderedDict()
         for i, joint_name in enumerate(self.get_joint_names_controllable()):
+            if joint_name not in changed_joints and joint_name in old_joint_constraints:
+                if joint_name in old_hard_constraints:
+                    self._hard_constraints[joint_name] = old_hard_constraints[joint_name]
+                self._joint_constraints[joint_name] = old_joint_constraints[joint_name]
+                continue
             lower_limit, upper_limit = self.get_joint_limits(joint_name)
             joint_symbol = self.get_joint_position_symbol(joint_name)
             velocity_limit = self.get_joint_velocity_limit_expr(joint_name)
@@ -187,6 +231,7 @@ class Robot(Backend):
         :return: 4d matrix describing the transformation from root_link to tip_link
         :rtype: spw.Matrix
         """
+        self._fk_expression_links.update((root_link, tip_link))
         fk = w.eye(4)
         root_chain, _, tip_chain = self.get_split_chain(root_link, tip_link, links=False)
         for joint_name in root_chain:
@@ -196,6 +241,32 @@ class Robot(Backend):
         # FIXME there is some reference fuckup going on, but i don't know where; deepcopy is just a quick fix
         return deepcopy(fk)
 
+    def pop_fk_expression_links(self):
+        """
+        :return: the links that were passed to get_fk_expression since the last call of this function
+        :rtype: set
+        """
+        links = self._fk_expression_links
+        self._fk_expression_links = set()
+        return links
+
+    def get_kinematic_hash(self, link_names=()):
+        """
+        Hash of the joints of the original urdf and of the joints on the chains of link_names. Compiled functions
+        that don't use attached objects stay valid, when objects get attached or detached.
+        :param link_names: links used in the fk expressions of the compiled functions
+        :type link_names: iterable
+        :rtype: str
+        """
+        joint_names = set(joint_name for joint_name in self.get_joint_names()
+                          if self.is_joint_from_original_urdf(joint_name))
+        root = self.get_root()
+        for link_name in link_names:
+            if self.has_link(link_name):
+                joint_names.update(self.get_chain(root, link_name, links=False))
+        signatures = [(joint_name, self.get_joint_signature(joint_name)) for joint_name in sorted(joint_names)]
+        return hashlib.md5(json.dumps(signatures)).hexdigest()
+
     def get_fk_pose(self, root, tip):
         try:
             homo_m = self.get_fk_np(root, tip)
@@ -207,18 +278,71 @@ class Robot(Backend):
             pass
         return p
 
-    @memoize
+    def get_root_fks_np(self):
+        """
+        Evaluates the poses of all links relative to the root, once per joint state.
+        :return: array of 4x4 matrices, see self._link_to_fk_index for the order
+        :rtype: np.ndarray
+        """
+        if self._evaluated_fks is None:
+            joint_state_positions = self.get_joint_state_positions()
+            try:
+                positions = [joint_state_positions[x] for x in self._fks.str_params]
+            except KeyError as e:
+                # the names of the position symbols are the joint names
+                raise KeyError(u'joint state of \'{}\' has no position for joint \'{}\''.format(self.get_name(),
+                                                                                               e.args[0]))
+            fks = self._fks.call2(positions)
+            self._evaluated_fks = np.array(fks).reshape(-1, 4, 4)
+        return self._evaluated_fks
+
+    @memoize(maxsize=1000)
     def get_fk_np(self, root, tip):
-        return self._fks[root, tip](**self.get_joint_state_positions())
+        """
+        :type root: str
+        :type tip: str
+        :return: 4x4 matrix describing the transformation from root to tip
+        :rtype: np.ndarray
+        """
+        fks = self.get_root_fks_np()
+        r_T_tip = fks[self._link_to_fk_index[tip]]
+        if root == self.get_root():
+            return r_T_tip
+        r_T_root = fks[self._link_to_fk_index[root]]
+        root_T_r = np.eye(4)
+        root_T_r[:3, :3] = r_T_root[:3, :3].T
+        root_T_r[:3, 3] = -np.dot(r_T_root[:3, :3].T, r_T_root[:3, 3])
+        return np.dot(root_T_r, r_T_tip)
 
     def init_fast_fks(self):
-        def f(key):
-            root, tip = key
-            fk = self.get_fk_expression(root, tip)
-            m = w.speed_up(fk, w.free_symbols(fk))
-            return m
-
-        self._fks = KeyDefaultDict(f)
+        """
+        Compiles one function for the poses of all links relative to the root. The pose of every link is computed
+        from the one of its parent, such that the kinematic tree is evaluated once for all root and tip pairs.
+        Expressions of links whose chain to the root did not change are reused.
+        """
+        root = self.get_root()
+        root_T_links = OrderedDict([(root, w.eye(4))])
+        cached_root_T_links = {root: (None, root_T_links[root])}
+        # links with reused expressions
+        links = [(root, True)]
+        while links:
+            parent_link, parent_reused = links.pop()
+            for joint_name in self.get_child_joints_of_link(parent_link) or []:
+                child_link = self.get_child_link_of_joint(joint_name)
+                joint_frame = self.get_joint_frame(joint_name)
+                cached = self._root_T_links.get(child_link)
+                reused = parent_reused and cached is not None and cached[0] is joint_frame
+                if reused:
+                    root_T_links[child_link] = cached[1]
+                else:
+                    root_T_links[child_link] = w.dot(root_T_links[parent_link], joint_frame)
+                cached_root_T_links[child_link] = (joint_frame, root_T_links[child_link])
+                links.append((child_link, reused))
+        self._root_T_links = cached_root_T_links
+        self._link_to_fk_index = {link_name: i for i, link_name in enumerate(root_T_links)}
+        fks = w.vstack(list(root_T_links.values()))
+        self._fks = w.speed_up(fks, w.free_symbols(fks))
+        self._evaluated_fks = None
 
     # JOINT FUNCTIONS
 
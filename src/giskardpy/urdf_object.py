@@ -1,5 +1,6 @@
 import numpy as np
 from collections import namedtuple
+from copy import deepcopy
 from itertools import chain
 
 import urdf_parser_py.urdf as up
@@ -10,27 +11,28 @@ from visualization_msgs.msg import Marker
 
 from giskardpy.exceptions import DuplicateNameException, UnknownBodyException, CorruptShapeException
 from giskardpy.utils import cube_volume, cube_surface, sphere_volume, cylinder_volume, cylinder_surface, \
-    suppress_stderr, msg_to_list, KeyDefaultDict, memoize
+    suppress_stderr, msg_to_list, KeyDefaultDict, memoize, clear_memo
 
 Joint = namedtuple('Joint', ['symbol', 'velocity_limit', 'lower', 'upper', 'type', 'frame'])
 
 
 def hacky_urdf_parser_fix(urdf_str):
-    # TODO this function is inefficient but the tested urdfs's aren't big enough for it to be a problem
-    fixed_urdf = ''
-    delete = False
     black_list = ['transmission', 'gazebo']
     black_open = ['<{}'.format(x) for x in black_list]
+    if not any(x in urdf_str for x in black_open):
+        return urdf_str
     black_close = ['</{}'.format(x) for x in black_list]
+    fixed_lines = []
+    delete = False
     for line in urdf_str.split('\n'):
-        if len([x for x in black_open if x in line]) > 0:
+        if any(x in line for x in black_open):
             delete = True
-        if len([x for x in black_close if x in line]) > 0:
+        if any(x in line for x in black_close):
             delete = False
             continue
         if not delete:
-            fixed_urdf += line + '\n'
-    return fixed_urdf
+            fixed_lines.append(line)
+    return '\n'.join(fixed_lines) + '\n'
 
 
 FIXED_JOINT = u'fixed'
@@ -44,6 +46,138 @@ TRANSLATIONAL_JOINT_TYPES = [PRISMATIC_JOINT]
 LIMITED_JOINTS = [PRISMATIC_JOINT, REVOLUTE_JOINT]
 
 
+class KinematicTree(object):
+    """
+    Integer indexed copy of the kinematic tree of an urdf, built once per urdf.
+    Lowest common ancestors are found in O(1) with a sparse table over the Euler tour of the tree, ancestors are
+    checked in O(1) by comparing the positions of the links in the tour.
+    """
+
+    def __init__(self, urdf_robot, root):
+        """
+        :type urdf_robot: up.Robot
+        :param root: name of the root link
+        :type root: str
+        """
+        self.link_names = []
+        self.link_to_index = {}
+        # index of the parent link, -1 for the root
+        self.parents = []
+        # name of the parent joint, None for the root
+        self.parent_joints = []
+        self.parent_joint_is_fixed = []
+        self.depths = []
+        # position of the first and last visit of every link in the Euler tour
+        self.first = []
+        self.last = []
+
+        child_map = urdf_robot.child_map
+        # links are added in the order of a depth first search, such that every sub tree is a range of indices
+        euler_tour = [self._add_link(root, -1, None, False, 0)]
+        stack = [(0, iter(child_map.get(root, [])))]
+        while stack:
+            i, children = stack[-1]
+            for joint_name, child_link in children:
+                is_fixed = urdf_robot.joint_map[joint_name].type == FIXED_JOINT
+                child = self._add_link(child_link, i, joint_name, is_fixed, len(euler_tour))
+                euler_tour.append(child)
+                stack.append((child, iter(child_map.get(child_link, []))))
+                break
+            else:
+                stack.pop()
+                self.last[i] = len(euler_tour) - 1
+                if stack:
+                    euler_tour.append(stack[-1][0])
+
+        self.sub_tree_sizes = [1] * len(self.link_names)
+        for i in reversed(range(1, len(self.link_names))):
+            self.sub_tree_sizes[self.parents[i]] += self.sub_tree_sizes[i]
+
+        depths = np.array(self.depths)
+        # sparse_table[k][j] is the link with the smallest depth in euler_tour[j:j + 2**k]
+        self.sparse_table = [np.array(euler_tour)]
+        k = 1
+        while 2 ** k <= len(euler_tour):
+            previous = self.sparse_table[-1]
+            half = 2 ** (k - 1)
+            a = previous[:-half]
+            b = previous[half:]
+            self.sparse_table.append(np.where(depths[a] <= depths[b], a, b))
+            k += 1
+
+    def _add_link(self, link_name, parent, parent_joint, parent_joint_is_fixed, first):
+        i = len(self.link_names)
+        self.link_names.append(link_name)
+        self.link_to_index[link_name] = i
+        self.parents.append(parent)
+        self.parent_joints.append(parent_joint)
+        self.parent_joint_is_fixed.append(parent_joint_is_fixed)
+        self.depths.append(0 if parent == -1 else self.depths[parent] + 1)
+        self.first.append(first)
+        self.last.append(first)
+        return i
+
+    def get_lowest_common_ancestor(self, link_a, link_b):
+        """
+        :type link_a: str
+        :type link_b: str
+        :return: the link farthest from the root that is an ancestor of both links, a link is its own ancestor
+        :rtype: str
+        """
+        i = self.first[self.link_to_index[link_a]]
+        j = self.first[self.link_to_index[link_b]]
+        if i > j:
+            i, j = j, i
+        k = (j - i + 1).bit_length() - 1
+        x = self.sparse_table[k][i]
+        y = self.sparse_table[k][j - 2 ** k + 1]
+        return self.link_names[x if self.depths[x] <= self.depths[y] else y]
+
+    def is_ancestor(self, ancestor_link, link):
+        """
+        :type ancestor_link: str
+        :type link: str
+        :return: whether ancestor_link is on the path from link to the root, a link is its own ancestor
+        :rtype: bool
+        """
+        a = self.link_to_index[ancestor_link]
+        b = self.link_to_index[link]
+        return self.first[a] <= self.first[b] and self.last[b] <= self.last[a]
+
+    def get_chain_from_ancestor(self, ancestor_link, tip_link, joints=True, links=True, fixed=True):
+        """
+        Like urdf_parser_py's get_chain, but without ancestor_link.
+        :param ancestor_link: has to be an ancestor of tip_link
+        :type ancestor_link: str
+        :type tip_link: str
+        :param joints: whether to include joints
+        :param links: whether to include links
+        :param fixed: whether to include fixed joints
+        :return: joint and link names from ancestor_link to tip_link
+        :rtype: list
+        """
+        ancestor = self.link_to_index[ancestor_link]
+        i = self.link_to_index[tip_link]
+        chain = []
+        while i != ancestor:
+            if links:
+                chain.append(self.link_names[i])
+            if joints and (fixed or not self.parent_joint_is_fixed[i]):
+                chain.append(self.parent_joints[i])
+            i = self.parents[i]
+        chain.reverse()
+        return chain
+
+    def get_sub_tree_link_names(self, link_name):
+        """
+        :type link_name: str
+        :return: link_name and all its descendants
+        :rtype: list
+        """
+        i = self.link_to_index[link_name]
+        return self.link_names[i:i + self.sub_tree_sizes[i]]
+
+
 class URDFObject(object):
     def __init__(self, urdf, *args, **kwargs):
         """
@@ -57,15 +191,15 @@ class URDFObject(object):
         self.original_urdf = hacky_urdf_parser_fix(urdf)
         with suppress_stderr():
             self._urdf_robot = up.URDF.from_xml_string(self.original_urdf)  # type: up.Robot
+        self._original_joint_names = set(self._urdf_robot.joint_map)
         self._link_to_marker = {}
         self.reset_cache()
 
     def reset_cache(self):
-        for method_name in dir(self):
-            try:
-                getattr(self, method_name).memo.clear()
-            except:
-                pass
+        """
+        Invalidates the results of all memoized methods, has to be called whenever the urdf changes.
+        """
+        clear_memo(self)
 
 
     @classmethod
@@ -196,34 +330,39 @@ class URDFObject(object):
         return self._urdf_robot.joint_map.keys()
 
     @memoize
+    def get_kinematic_tree(self):
+        """
+        :rtype: KinematicTree
+        """
+        return KinematicTree(self._urdf_robot, self.get_root())
+
+    @memoize(maxsize=1000)
     def get_split_chain(self, root, tip, joints=True, links=True, fixed=True):
         if root == tip:
             return [], [], []
-        root_chain = self._urdf_robot.get_chain(self.get_root(), root, False, True, True)
-        tip_chain = self._urdf_robot.get_chain(self.get_root(), tip, False, True, True)
-        for i in range(min(len(root_chain), len(tip_chain))):
-            if root_chain[i] != tip_chain[i]:
-                break
-        else:
-            i += 1
-        connection = tip_chain[i - 1]
-        root_chain = self._urdf_robot.get_chain(connection, root, joints, links, fixed)
-        if links:
-            root_chain = root_chain[1:]
+        tree = self.get_kinematic_tree()
+        connection = tree.get_lowest_common_ancestor(root, tip)
+        root_chain = tree.get_chain_from_ancestor(connection, root, joints, links, fixed)
         root_chain.reverse()
-        tip_chain = self._urdf_robot.get_chain(connection, tip, joints, links, fixed)
-        if links:
-            tip_chain = tip_chain[1:]
+        tip_chain = tree.get_chain_from_ancestor(connection, tip, joints, links, fixed)
         return root_chain, [connection] if links else [], tip_chain
 
-    @memoize
+    @memoize(maxsize=1000)
     def get_chain(self, root, tip, joints=True, links=True, fixed=True):
         root_chain, connection, tip_chain = self.get_split_chain(root, tip, joints, links, fixed)
         return root_chain + connection + tip_chain
 
-    @memoize
     def get_connecting_link(self, link1, link2):
-        return self.get_split_chain(link1, link2, joints=False)[1][0]
+        return self.get_kinematic_tree().get_lowest_common_ancestor(link1, link2)
+
+    def is_ancestor(self, ancestor_link, link):
+        """
+        :type ancestor_link: str
+        :type link: str
+        :return: whether ancestor_link is on the chain from link to the root, a link is its own ancestor
+        :rtype: bool
+        """
+        return self.get_kinematic_tree().is_ancestor(ancestor_link, link)
 
     @memoize
     def get_joint_names_from_chain(self, root_link, tip_link):
@@ -281,6 +420,31 @@ class URDFObject(object):
             except AttributeError:
                 return None, None
 
+    @memoize
+    def get_joint_signature(self, joint_name):
+        """
+        :return: everything the frame and the constraints of a joint depend on, can be compared across urdfs
+        :rtype: tuple
+        """
+        joint = self.get_urdf_joint(joint_name)
+
+        def to_tuple(values):
+            return None if values is None else tuple(values)
+
+        origin = None if joint.origin is None else (to_tuple(joint.origin.xyz), to_tuple(joint.origin.rpy))
+        limit = None if joint.limit is None else (joint.limit.lower, joint.limit.upper, joint.limit.velocity)
+        safety_controller = None if joint.safety_controller is None else (joint.safety_controller.soft_lower_limit,
+                                                                          joint.safety_controller.soft_upper_limit)
+        mimic = None if joint.mimic is None else (joint.mimic.joint, joint.mimic.multiplier, joint.mimic.offset)
+        return (joint.type, joint.parent, joint.child, origin, to_tuple(joint.axis), limit, safety_controller, mimic)
+
+    def is_joint_from_original_urdf(self, joint_name):
+        """
+        :return: False for joints of attached objects
+        :rtype: bool
+        """
+        return joint_name in self._original_joint_names
+
     @memoize
     def get_joint_velocity_limit(self, joint_name):
         limit = self._urdf_robot.joint_map[joint_name].limit
@@ -415,7 +579,7 @@ class URDFObject(object):
 
     @memoize
     def get_links_from_sub_tree(self, joint_name):
-        return self.get_sub_tree_at_joint(joint_name).get_link_names()
+        return self.get_kinematic_tree().get_sub_tree_link_names(self.get_child_link_of_joint(joint_name))
 
     @memoize
     def get_links_with_collision(self):
@@ -476,7 +640,12 @@ class URDFObject(object):
                    isinstance(geo, up.Mesh)
         return False
 
+    @memoize
     def get_urdf_str(self):
+        """
+        The urdf is only generated when it is needed and then cached until it changes.
+        :rtype: str
+        """
         return self._urdf_robot.to_xml_string()
 
     @memoize
@@ -565,9 +734,9 @@ class URDFObject(object):
                          origin=origin)
         self._urdf_robot.add_joint(joint)
         for j in urdf_object._urdf_robot.joints:
-            self._urdf_robot.add_joint(j)
+            self._urdf_robot.add_joint(deepcopy(j))
         for l in urdf_object._urdf_robot.links:
-            self._urdf_robot.add_link(l)
+            self._urdf_robot.add_link(deepcopy(l))
         try:
             del self._link_to_marker[urdf_object.get_name()]
         except:
@@ -604,15 +773,33 @@ class URDFObject(object):
         Detaches all object that have been attached to the robot.
         """
         self._urdf_robot = up.URDF.from_xml_string(self.original_urdf)
+        self._original_joint_names = set(self._urdf_robot.joint_map)
         self.reinitialize()
 
     def __str__(self):
         return self.get_urdf_str()
 
     def reinitialize(self):
-        self._urdf_robot = up.URDF.from_xml_string(self.get_urdf_str())
+        """
+        Has to be called after links or joints were added to or removed from the urdf.
+        """
+        self._update_urdf_maps()
         self.reset_cache()
 
+    def _update_urdf_maps(self):
+        """
+        Rebuilds the maps of the urdf robot in memory, because remove_aggregate of urdf_parser_py does not update them.
+        """
+        urdf_robot = self._urdf_robot
+        urdf_robot.link_map = {link.name: link for link in urdf_robot.links}
+        urdf_robot.joint_map = {}
+        urdf_robot.parent_map = {}
+        urdf_robot.child_map = {}
+        for joint in urdf_robot.joints:
+            urdf_robot.joint_map[joint.name] = joint
+            urdf_robot.parent_map[joint.child] = (joint.name, joint.parent)
+            urdf_robot.child_map.setdefault(joint.parent, []).append((joint.name, joint.child))
+
     def robot_name_to_root_joint(self, name):
         # TODO should this really be a class function?
         return u'{}'.format(name)
@@ -30,7 +30,7 @@ from tf.transformations import quaternion_multiply, quaternion_conjugate
 
 from giskardpy import logging
 from giskardpy.data_types import ClosestPointInfo
-from giskardpy.data_types import SingleJointState
+from giskardpy.data_types import SingleJointState, JointStates
 from giskardpy.plugin import PluginBehavior
 from giskardpy.tfwrapper import kdl_to_pose, np_to_kdl
 
@@ -214,6 +214,23 @@ def to_joint_state_dict(msg):
         mjs[joint_name] = sjs
     return mjs
 
+def to_joint_states(msg):
+    """
+    Converts a ROS message of type sensor_msgs/JointState into JointStates, without creating an object per joint.
+    :param msg: ROS message to convert.
+    :type msg: JointState
+    :return: missing velocities and efforts are 0
+    :rtype: JointStates
+    """
+    number_of_joints = len(msg.name)
+
+    def pad(values):
+        values = list(values[:number_of_joints])
+        return values + [0.] * (number_of_joints - len(values))
+
+    return JointStates(list(msg.name), msg.position, pad(msg.velocity), pad(msg.effort))
+
+
 def to_joint_state_dict2(msg):
     """
     Converts a ROS message of type sensor_msgs/JointState into a dict that maps name to position
@@ -753,17 +770,54 @@ def str_to_unique_number(s):
     return sum(ord(x) for x in s)
 
 
-def memoize(function):
-    memo = function.memo = {}
+def memoize(function=None, maxsize=None):
+    """
+    Caches the results of a method per instance, keyed on its arguments.
+    Use clear_memo to invalidate the caches of an instance, when the data the method depends on changes.
+    Can be used as @memoize or @memoize(maxsize=100).
+    :param maxsize: number of results that are kept per instance, the least recently used result is dropped when
+                    the cache is full, None for no limit
+    :type maxsize: int
+    """
+    if function is None:
+        return lambda f: memoize(f, maxsize)
+
     @wraps(function)
-    def wrapper(*args, **kwargs):
-        # key = cPickle.dumps((args, kwargs))
-        # key = pickle.dumps((args, sorted(kwargs.items()), -1))
+    def wrapper(self, *args, **kwargs):
         key = (args, frozenset(kwargs.items()))
+        memo = self.__dict__.get(u'_memo')
+        if memo is None:
+            memo = self.__dict__[u'_memo'] = {}
+        cache = memo.get(function)
+        if cache is None:
+            cache = memo[function] = {} if maxsize is None else OrderedDict()
         try:
-            return memo[key]
+            rv = cache[key]
         except KeyError:
-            rv = function(*args, **kwargs)
-            memo[key] = rv
+            rv = function(self, *args, **kwargs)
+            cache[key] = rv
+            if maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
             return rv
-    return wrapper
\ No newline at end of file
+        if maxsize is not None:
+            # move the key to the end, results are dropped from the front
+            cache[key] = cache.pop(key, rv)
+        return rv
+
+    return wrapper
+
+
+def clear_memo(obj, *method_names):
+    """
+    Invalidates the results that memoize has cached for obj.
+    :param method_names: names of the methods whose caches are cleared, all if none are given
+    :type method_names: str
+    """
+    memo = obj.__dict__.get(u'_memo')
+    if memo:
+        if method_names:
+            for function in list(memo):
+                if function.__name__ in method_names:
+                    del memo[function]
+        else:
+            memo.clear()
@@ -2,13 +2,13 @@ import PyKDL
 from geometry_msgs.msg import PoseStamped
 from giskard_msgs.msg import CollisionEntry
 
-from giskardpy.data_types import ClosestPointInfo
+from giskardpy.data_types import Collisions
 from giskardpy.exceptions import RobotExistsException, DuplicateNameException, PhysicsWorldException, \
     UnknownBodyException, UnsupportedOptionException
 from giskardpy.symengine_robot import Robot
 from giskardpy.tfwrapper import msg_to_kdl, kdl_to_pose, np_to_kdl, to_np
 from giskardpy.urdf_object import URDFObject, FIXED_JOINT
-from giskardpy.utils import KeyDefaultDict, np_point, np_vector
+from giskardpy.utils import KeyDefaultDict
 from giskardpy.world_object import WorldObject
 from giskardpy import logging
 import numpy as np
@@ -457,18 +457,9 @@ class World(object):
 
     
     def transform_contact_info(self, collisions):
-        root_T_map = to_np(self.robot.root_T_map)
-        robot_root = self.robot.get_root()
-        for contact_info in collisions.items():  # type: ClosestPointInfo
-            movable_joint = self.robot.get_controlled_parent_joint(contact_info.link_a)
-            f = self.robot.get_child_link_of_joint(movable_joint)
-            f_T_r = self.robot.get_fk_np(f, robot_root)
-            contact_info.frame = f
-
-            f_P_pa = np.dot(np.dot(f_T_r, root_T_map), np_point(*contact_info.position_on_a))
-            r_P_pb = np.dot(root_T_map, np_point(*contact_info.position_on_b))
-            r_V_n = np.dot(root_T_map, np_vector(*contact_info.contact_normal))
-            contact_info.position_on_a = f_P_pa[:-1]
-            contact_info.position_on_b = r_P_pb[:-1]
-            contact_info.contact_normal = r_V_n[:-1]
+        """
+        :type collisions: Collisions
+        :rtype: Collisions
+        """
+        collisions.transform(to_np(self.robot.root_T_map))
         return collisions
@@ -1,18 +1,20 @@
 import errno
 import hashlib
+import json
 import numpy as np
 import os
-import pickle
 from itertools import product
 from time import time
 
+import urdf_parser_py.urdf as up
 from geometry_msgs.msg import Pose, Quaternion
 from tf.transformations import euler_from_quaternion, rotation_from_matrix, quaternion_matrix
 
 from giskardpy import logging
-from giskardpy.data_types import SingleJointState
+from giskardpy.data_types import JointStates
 from giskardpy.tfwrapper import msg_to_kdl
 from giskardpy.urdf_object import URDFObject
+from giskardpy.utils import clear_memo
 
 
 class WorldObject(URDFObject):
@@ -45,10 +47,11 @@ class WorldObject(URDFObject):
 
     @joint_state.setter
     def joint_state(self, value):
-        new_js = {}
-        new_js.update(self._js)
-        self._js = new_js
-        self._js.update(value)
+        """
+        :param value: joint name -> SingleJointState, joints that are not in value keep their state
+        :type value: dict
+        """
+        self._js = self._js.merge(value)
 
     @property
     def base_pose(self):
@@ -79,6 +82,7 @@ class WorldObject(URDFObject):
     def controlled_joints(self, value):
         self._controlled_links = None
         self._controlled_joints = value
+        clear_memo(self, u'get_controlled_parent_joint')
 
     def suicide(self):
         pass
@@ -104,7 +108,8 @@ class WorldObject(URDFObject):
         """
         return self._self_collision_matrix
 
-    def calc_collision_matrix(self, link_combinations, d=0.05, d2=0.0, num_rnd_tries=2000):
+    def calc_collision_matrix(self, link_combinations, d=0.05, d2=0.0, num_rnd_tries=2000,
+                              num_unchanged_tries=200):
         """
         :param link_combinations: set with link name tuples
         :type link_combinations: set
@@ -112,15 +117,17 @@ class WorldObject(URDFObject):
         :type d: float
         :param d2: distance threshold to find links that are sometimes in collision
         :type d2: float
-        :param num_rnd_tries:
+        :param num_rnd_tries: maximum number of random joint states
         :type num_rnd_tries: int
+        :param num_unchanged_tries: stop sampling after this many random joint states without a new collision
+        :type num_unchanged_tries: int
         :return: set of link name tuples which are sometimes in collision.
         :rtype: set
         """
-        # TODO computational expansive because of too many collision checks
-        logging.loginfo(u'calculating self collision matrix')
+        logging.loginfo(u'calculating self collision matrix for {} link pairs'.format(len(link_combinations)))
         t = time()
         np.random.seed(1337)
+        joint_state = self.joint_state
         always = set()
 
         # find meaningless self-collisions
@@ -141,13 +148,20 @@ class WorldObject(URDFObject):
         sometimes2 = self.check_collisions(rest, d2)
         rest = rest.difference(sometimes2)
         sometimes = sometimes.union(sometimes2)
+        unchanged_tries = 0
         for i in range(num_rnd_tries):
+            if not rest or unchanged_tries >= num_unchanged_tries:
+                break
             self.joint_state = self.get_rnd_joint_state()
             sometimes2 = self.check_collisions(rest, d2)
             if len(sometimes2) > 0:
                 rest = rest.difference(sometimes2)
                 sometimes = sometimes.union(sometimes2)
+                unchanged_tries = 0
+            else:
+                unchanged_tries += 1
         sometimes = sometimes.union(self.added_pairs)
+        self.joint_state = joint_state
         logging.loginfo(u'calculated self collision matrix in {:.3f}s'.format(time() - t))
         return sometimes
 
@@ -162,6 +176,12 @@ class WorldObject(URDFObject):
         return possible_collisions
 
     def check_collisions(self, link_combinations, distance):
+        """
+        :param link_combinations: set with link name tuples
+        :type link_combinations: set
+        :return: the link name tuples that are closer than distance
+        :rtype: set
+        """
         in_collision = set()
         for link_a, link_b in link_combinations:
             if self.in_collision(link_a, link_b, distance):
@@ -207,16 +227,11 @@ class WorldObject(URDFObject):
     def generate_joint_state(self, f):
         """
         :param f: lambda joint_info: float
-        :return:
+        :rtype: JointStates
         """
         # TODO possible optimization, if some joints are not controlled, the collision matrix might get smaller
-        js = {}
-        for joint_name in self.get_controllable_joints():
-            sjs = SingleJointState()
-            sjs.name = joint_name
-            sjs.position = f(joint_name)
-            js[joint_name] = sjs
-        return js
+        joint_names = list(self.get_controllable_joints())
+        return JointStates(joint_names, [f(joint_name) for joint_name in joint_names])
 
     def add_self_collision_entries(self, object_name):
         link_pairs = {(object_name, link_name) for link_name in self.get_link_names()}
@@ -236,36 +251,132 @@ class WorldObject(URDFObject):
                 removed_links = set()
             self._self_collision_matrix = {x for x in self._self_collision_matrix if x[0] not in removed_links and
                                            x[1] not in removed_links}
-            self._self_collision_matrix.update(self.calc_collision_matrix(added_links))
+            # only pairs with new links have to be checked, the rest of the matrix does not change
+            if added_links:
+                self._self_collision_matrix.update(self.calc_collision_matrix(added_links))
             self.safe_self_collision_matrix(self.path_to_data_folder)
 
+    def get_collision_hash(self, round_to=3):
+        """
+        Hash of everything the self collision matrix depends on: kinematic structure, position limits, collision
+        geometry and the ignored and added pairs. Visuals, inertias, colors or velocity limits don't change it.
+        :param round_to: number of decimals of lengths and angles, such that poses of attached objects that differ
+                         by rounding errors have the same hash
+        :type round_to: int
+        :rtype: str
+        """
+
+        def r(values):
+            if values is None:
+                return None
+            return [None if x is None else round(float(x), round_to) for x in values]
+
+        def origin_to_list(origin):
+            if origin is None:
+                return None
+            return r(origin.xyz) + r(origin.rpy)
+
+        def geometry_to_list(geometry):
+            if isinstance(geometry, up.Box):
+                return [u'box', r(geometry.size)]
+            if isinstance(geometry, up.Sphere):
+                return [u'sphere', r([geometry.radius])]
+            if isinstance(geometry, up.Cylinder):
+                return [u'cylinder', r([geometry.radius, geometry.length])]
+            if isinstance(geometry, up.Mesh):
+                return [u'mesh', geometry.filename, r(geometry.scale)]
+            return [geometry.__class__.__name__]
+
+        joints = []
+        for joint_name in sorted(self.get_joint_names()):
+            joint = self.get_urdf_joint(joint_name)
+            mimic = None
+            if joint.mimic is not None:
+                mimic = [joint.mimic.joint] + r([joint.mimic.multiplier, joint.mimic.offset])
+            joints.append([joint_name, joint.type, joint.parent, joint.child, origin_to_list(joint.origin),
+                           r(joint.axis), r(self.get_joint_limits(joint_name)), mimic])
+        links = []
+        for link_name in sorted(self.get_link_names()):
+            link = self.get_urdf_link(link_name)
+            collisions = getattr(link, u'collisions', None)
+            if collisions is None:
+                collisions = [] if link.collision is None else [link.collision]
+            links.append([link_name, [[origin_to_list(c.origin), geometry_to_list(c.geometry)] for c in collisions]])
+        description = [joints,
+                       links,
+                       sorted(list(x) for x in self.ignored_pairs),
+                       sorted(list(x) for x in self.added_pairs)]
+        return hashlib.md5(json.dumps(description, sort_keys=True)).hexdigest()
+
+    def get_self_collision_matrix_file_name(self, path):
+        """
+        :param path: folder with the collision matrices of all robots
+        :type path: str
+        :rtype: str
+        """
+        return u'{}/{}/{}.json'.format(path, self.get_name(), self.get_collision_hash())
+
     def load_self_collision_matrix(self, path):
         """
+        :param path: folder with the collision matrices of all robots, can be shared by identical robots
+        :type path: str
         :rtype: bool
         """
-        urdf_hash = hashlib.md5(self.get_urdf_str()).hexdigest()
-        path = u'{}/{}/{}'.format(path, self.get_name(), urdf_hash)
-        if os.path.isfile(path):
-            with open(path) as f:
-                self._self_collision_matrix = pickle.load(f)
-                logging.loginfo(u'loaded self collision matrix {}'.format(path))
-                return True
-        return False
-
-    def safe_self_collision_matrix(self, path):
-        urdf_hash = hashlib.md5(self.get_urdf_str()).hexdigest()
-        path = u'{}/{}/{}'.format(path, self.get_name(), urdf_hash)
-        if not os.path.exists(os.path.dirname(path)):
+        file_name = self.get_self_collision_matrix_file_name(path)
+        try:
+            with open(file_name) as f:
+                self._self_collision_matrix = {tuple(x) for x in json.load(f)}
+        except (IOError, ValueError):
+            return False
+        try:
+            # the modification time is used to evict the least recently used matrices
+            os.utime(file_name, None)
+        except OSError:
+            pass
+        logging.loginfo(u'loaded self collision matrix {}'.format(file_name))
+        return True
+
+    def safe_self_collision_matrix(self, path, max_cached_matrices=20):
+        """
+        Saves the self collision matrix as json and removes the least recently used matrices of this robot, if there
+        are more than max_cached_matrices.
+        :param path: folder with the collision matrices of all robots, can be shared by identical robots
+        :type path: str
+        :type max_cached_matrices: int
+        """
+        file_name = self.get_self_collision_matrix_file_name(path)
+        dir_name = os.path.dirname(file_name)
+        if not os.path.exists(dir_name):
             try:
-                dir_name = os.path.dirname(path)
-                if dir_name != u'':
-                    os.makedirs(dir_name)
+                os.makedirs(dir_name)
             except OSError as exc:  # Guard against race condition
                 if exc.errno != errno.EEXIST:
                     raise
-        with open(path, u'w') as file:
-            logging.loginfo(u'saved self collision matrix {}'.format(path))
-            pickle.dump(self._self_collision_matrix, file)
+        # write to a temporary file first, such that other processes never load a partially written matrix
+        tmp_file_name = u'{}.{}.tmp'.format(file_name, os.getpid())
+        with open(tmp_file_name, u'w') as f:
+            json.dump(sorted(list(x) for x in self._self_collision_matrix), f)
+        os.rename(tmp_file_name, file_name)
+        logging.loginfo(u'saved self collision matrix {}'.format(file_name))
+
+        cached_matrices = []
+        for cached_file_name in os.listdir(dir_name):
+            if cached_file_name.endswith(u'.json'):
+                cached_file_name = os.path.join(dir_name, cached_file_name)
+                # the matrix that was just saved is the most recently used one, even if the clock went backwards
+                if cached_file_name == file_name:
+                    continue
+                try:
+                    cached_matrices.append((os.path.getmtime(cached_file_name), cached_file_name))
+                except OSError:
+                    pass
+        number_of_evicted_matrices = max(0, len(cached_matrices) + 1 - max_cached_matrices)
+        for _, cached_file_name in sorted(cached_matrices)[:number_of_evicted_matrices]:
+            try:
+                os.remove(cached_file_name)
+                logging.loginfo(u'removed self collision matrix {}'.format(cached_file_name))
+            except OSError:
+                pass
 
     def as_marker_msg(self, ns=u'', id=1):
         m = super(WorldObject, self).as_marker_msg(ns, id)
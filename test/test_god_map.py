@@ -1,6 +1,7 @@
 import numpy as np
 
 import giskardpy
+from giskardpy.data_types import JointStates, SingleJointState
 from giskardpy.utils import KeyDefaultDict
 
 giskardpy.WORLD_IMPLEMENTATION = None
@@ -261,6 +262,91 @@ class TestGodMap(unittest.TestCase):
             gm.to_symbol([key])
         self.assertEqual(len(gm.get_values(keys)), len(keys))
 
+    def test_get_values(self):
+        class Collisions(object):
+            def __init__(self):
+                self.calls = 0
+
+            def get_external_collisions(self, joint_name):
+                self.calls += 1
+                return [{u'min_dist': 0.1, u'contact_normal': [1, 2, 3]}]
+
+        gm = GodMap()
+        collisions = Collisions()
+        gm.safe_set_data([u'cpi'], collisions)
+        gm.safe_set_data([u'js'], {u'j{}'.format(i): {u'position': i, u'velocity': -i} for i in range(5)})
+        gm.safe_set_data([u'l'], [1., 2., 3.])
+        identifiers = [[u'js', u'j{}'.format(i), member] for i in range(5) for member in [u'position', u'velocity']]
+        identifiers += [[u'cpi', u'get_external_collisions', (u'j{}'.format(i),), 0, u'min_dist'] for i in range(2)]
+        identifiers += [[u'cpi', u'get_external_collisions', (u'j0',), 0, u'contact_normal', i] for i in range(3)]
+        identifiers += [[u'js', u'muh', u'position'], [u'l', -1], [u'l', 5], [u'cpi', u'muh']]
+        symbols = [str(gm.to_symbol(identifier)) for identifier in identifiers]
+        for i in range(2):
+            collisions.calls = 0
+            values = gm.get_values(symbols)
+            self.assertEqual(collisions.calls, 2)
+            self.assertEqual(values.dtype, np.float64)
+            np.testing.assert_array_equal(values, [gm.safe_get_data(identifier) for identifier in identifiers])
+        # only namespaces that were written with set_data are read again
+        gm.get_data([u'js', u'j1'])[u'position'] = 42
+        self.assertEqual(gm.get_values(symbols)[2], 1)
+        gm.safe_set_data([u'js', u'j0', u'position'], 23)
+        values = gm.get_values(symbols)
+        self.assertEqual(values[0], 23)
+        self.assertEqual(values[2], 42)
+
+    def test_get_values_joint_states(self):
+        gm = GodMap()
+        js = JointStates([u'j0', u'j1'], [0., 1.], [2., 3.])
+        gm.safe_set_data([u'js'], js)
+        identifiers = [[u'js', u'j1', u'position'], [u'js', u'j0', u'velocity'], [u'js', u'muh', u'position']]
+        symbols = [str(gm.to_symbol(identifier)) for identifier in identifiers]
+        np.testing.assert_array_equal(gm.get_values(symbols), [1, 2, 0])
+        gm.safe_set_data([u'js'], js.merge({u'j1': SingleJointState(u'j1', 42), u'muh': SingleJointState(u'muh', 23)}))
+        np.testing.assert_array_equal(gm.get_values(symbols), [42, 2, 23])
+        self.assertEqual(js[u'j1'].position, 1)
+        self.assertEqual(gm.safe_get_data([u'js']).names, [u'j0', u'j1', u'muh'])
+
+    def test_snapshot(self):
+        gm = GodMap()
+        gm.safe_set_data([u'js'], {u'j0': {u'position': 0}, u'j1': {u'position': 1}})
+        gm.safe_set_data([u'l'], [1, 2])
+        snapshot = gm.snapshot()
+        gm.safe_set_data([u'js', u'j0', u'position'], 23)
+        gm.safe_set_data([u'l', 0], 42)
+        self.assertEqual(snapshot.safe_get_data([u'js', u'j0', u'position']), 0)
+        self.assertEqual(snapshot.safe_get_data([u'l']), [1, 2])
+        self.assertEqual(gm.safe_get_data([u'js', u'j0', u'position']), 23)
+        self.assertEqual(gm.safe_get_data([u'l']), [42, 2])
+        symbols = [str(gm.to_symbol([u'js', u'j0', u'position'])), str(gm.to_symbol([u'l', 0]))]
+        np.testing.assert_array_equal(snapshot.get_values(symbols), [0, 1])
+        np.testing.assert_array_equal(gm.get_values(symbols), [23, 42])
+        with self.assertRaises(TypeError):
+            snapshot.safe_set_data([u'l', 0], 1)
+
+    def test_snapshot_keeps_references(self):
+        gm = GodMap()
+        # like ControllerPlugin.qp_data, which is only changed through the reference
+        qp_data = {}
+        gm.safe_set_data([u'qp_data'], qp_data)
+        gm.safe_set_data([u'js'], {u'j0': {u'position': 0}})
+        js = gm.safe_get_data([u'js'])
+        snapshot = gm.snapshot()
+        gm.safe_set_data([u'qp_data', u'A'], 1)
+        gm.safe_set_data([u'js', u'j0', u'position'], 23)
+        qp_data[u'H'] = 2
+        self.assertIs(gm.safe_get_data([u'qp_data']), qp_data)
+        self.assertEqual(gm.safe_get_data([u'qp_data']), {u'A': 1, u'H': 2})
+        self.assertIs(gm.safe_get_data([u'js']), js)
+        self.assertEqual(js[u'j0'][u'position'], 23)
+        self.assertEqual(snapshot.safe_get_data([u'qp_data']), {})
+        self.assertEqual(snapshot.safe_get_data([u'js', u'j0', u'position']), 0)
+        snapshot.release()
+        self.assertEqual(len(gm.snapshots), 0)
+        gm.safe_set_data([u'js', u'j0', u'position'], 42)
+        self.assertEqual(snapshot.safe_get_data([u'js', u'j0', u'position']), 0)
+        self.assertIs(gm.safe_get_data([u'js']), js)
+
     def test_god_map_with_world(self):
         gm = GodMap()
         w = World()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from geometry_msgs.msg import PoseStamped
+from py_trees import Blackboard, Status
+from sensor_msgs.msg import JointState
+
+import giskardpy
+
+giskardpy.WORLD_IMPLEMENTATION = None
+
+from giskardpy import identifier
+from giskardpy.data_types import JointStates
+from giskardpy.god_map import GodMap
+from giskardpy.plugin_goal_reached import GoalReachedPlugin
+from giskardpy.plugin_kinematic_sim import KinSimPlugin
+from giskardpy.utils import KeyDefaultDict, to_joint_states
+from giskardpy.world import World
+from giskardpy.world_object import WorldObject
+from utils_for_tests import pr2_urdf
+
+
+@pytest.fixture()
+def god_map():
+    god_map = GodMap()
+    world = World()
+    world.add_robot(robot=WorldObject(pr2_urdf()),
+                    base_pose=PoseStamped(),
+                    controlled_joints=[],
+                    joint_vel_limit=KeyDefaultDict(lambda key: 0),
+                    joint_acc_limit=KeyDefaultDict(lambda key: 0),
+                    joint_weights=KeyDefaultDict(lambda key: 0),
+                    calc_self_collision_matrix=False,
+                    ignored_pairs=set(),
+                    added_pairs=set())
+    god_map.safe_set_data(identifier.world, world)
+    god_map.safe_set_data(identifier.rosparam, {u'general_options': {u'sample_period': 0.05,
+                                                                     u'joint_convergence_threshold': 0.01}})
+    god_map.safe_set_data(identifier.time, 0)
+    Blackboard().god_map = god_map
+    return god_map
+
+
+def joint_state_msg(positions):
+    msg = JointState()
+    msg.name = list(positions.keys())
+    msg.position = list(positions.values())
+    return msg
+
+
+def test_kin_sim_update(god_map):
+    # like the ConfigurationPlugin does it
+    god_map.safe_set_data(identifier.joint_states, to_joint_states(joint_state_msg({u'torso_lift_joint': 0.1,
+                                                                                   u'head_pan_joint': 0.2})))
+    god_map.safe_set_data(identifier.cmd, {u'torso_lift_joint': 0.01,
+                                           u'r_elbow_flex_joint': -0.02,
+                                           u'no_joint': 1})
+    kin_sim = KinSimPlugin(u'kin sim')
+    kin_sim.initialise()
+    for i in range(2):
+        kin_sim.update()
+    js = god_map.safe_get_data(identifier.joint_states)
+    assert isinstance(js, JointStates)
+    np.testing.assert_almost_equal(js[u'torso_lift_joint'].position, 0.12)
+    np.testing.assert_almost_equal(js[u'torso_lift_joint'].velocity, 0.2)
+    np.testing.assert_almost_equal(js[u'r_elbow_flex_joint'].position, -0.04)
+    np.testing.assert_almost_equal(js[u'head_pan_joint'].position, 0.2)
+    assert js[u'head_pan_joint'].velocity == 0
+    assert u'no_joint' not in js
+
+
+def test_kin_sim_update_with_dict(god_map):
+    god_map.safe_set_data(identifier.cmd, {u'torso_lift_joint': 0.01})
+    god_map.safe_set_data(identifier.joint_states,
+                          JointStates([u'torso_lift_joint'], [0.1]).to_dict())
+    kin_sim = KinSimPlugin(u'kin sim')
+    kin_sim.initialise()
+    kin_sim.update()
+    np.testing.assert_almost_equal(god_map.safe_get_data(identifier.joint_states)[u'torso_lift_joint'].position, 0.11)
+    goal_reached = GoalReachedPlugin(u'goal reached')
+    assert goal_reached.update() == Status.RUNNING
@@ -1,6 +1,8 @@
 from collections import defaultdict
-from itertools import product, combinations_with_replacement
+from copy import deepcopy
+from itertools import product, combinations_with_replacement, combinations
 
+import numpy as np
 import pybullet as p
 import shutil
 
@@ -8,7 +10,9 @@ import pytest
 from geometry_msgs.msg import Pose, Point, Quaternion, PoseStamped
 from giskard_msgs.msg import CollisionEntry
 
-from giskardpy.pybullet_world import PyBulletWorld
+from giskardpy.pybullet_collision_workers import CollisionWorkers
+from giskardpy.data_types import Collisions, SingleJointState
+from giskardpy.pybullet_world import PyBulletWorld, CollisionQueryCache, flip_closest_point
 from giskardpy.pybullet_world_object import PyBulletWorldObject
 import giskardpy.pybullet_wrapper as pbw
 from giskardpy.symengine_robot import Robot
@@ -20,6 +24,54 @@ import test_world
 
 folder_name = u'tmp_data/'
 
+
+def collision_set(collisions, decimals=4):
+    """
+    :type collisions: Collisions
+    :return: (key, rounded row) of each closest point
+    :rtype: set
+    """
+    return {(key, tuple(np.round(row, decimals))) for key, row in zip(collisions.keys, collisions.data)}
+
+
+def naive_check_collisions(world, cut_off_distances, decimals=4):
+    """
+    Checks every entry with its own p.getClosestPoints query, without grouping, broad phase or query cache.
+    :type world: PyBulletWorld
+    :type cut_off_distances: dict
+    :return: the closest points in the format of collision_set
+    :rtype: set
+    """
+    robot = world.robot
+    robot_id = robot.get_pybullet_id()
+    closest_points = set()
+    for (robot_link, body_b, link_b), distance in cut_off_distances.items():
+        robot_link_id = robot.get_pybullet_link_id(robot_link)
+        if body_b == robot.get_name():
+            body_b_object = robot
+        else:
+            body_b_object = world.get_object(body_b)
+        if link_b == CollisionEntry.ALL:
+            results = p.getClosestPoints(robot_id, body_b_object.get_pybullet_id(), distance * 3, robot_link_id)
+        else:
+            results = p.getClosestPoints(robot_id, body_b_object.get_pybullet_id(), distance * 3, robot_link_id,
+                                         body_b_object.get_pybullet_link_id(link_b))
+        for result in results:
+            if result[3] != robot_link_id or result[1] != robot_id:
+                result = flip_closest_point(result)
+            if result[8] > distance * 3:
+                continue
+            if link_b == CollisionEntry.ALL:
+                key = (robot_link, body_b, body_b_object.pybullet_link_id_to_name(result[4]))
+                # links with their own entry use its cut off distance
+                if key in cut_off_distances:
+                    continue
+            else:
+                key = (robot_link, body_b, link_b)
+            row = tuple(result[5]) + tuple(result[6]) + tuple(result[7]) + (result[8], distance)
+            closest_points.add((key, tuple(np.round(row, decimals))))
+    return closest_points
+
 @pytest.fixture(scope=u'module')
 def module_setup(request):
     logging.loginfo(u'starting pybullet')
@@ -91,6 +143,16 @@ class TestPyBulletWorldObject(test_world.TestWorldObj):
         assert_num_pybullet_objects(1)
         assert u'pointy' in pbw.get_body_names()
 
+    def test_check_collisions(self, function_setup):
+        for urdf in [pr2_urdf(), donbot_urdf()]:
+            r = self.cls(urdf)
+            link_combinations = set(combinations(r.get_link_names_with_collision(), 2))
+            for joint_state in [r.get_zero_joint_state(), r.get_min_joint_state(), r.get_max_joint_state()]:
+                r.joint_state = joint_state
+                # the batched queries have to find the same pairs as one query per pair
+                assert r.check_collisions(link_combinations, 0.05) == \
+                       WorldObject.check_collisions(r, link_combinations, 0.05)
+
 
 class TestPyBulletRobot(test_world.TestRobot):
     cls = Robot
@@ -326,7 +388,241 @@ class TestPyBulletWorld(test_world.TestWorld):
             assert len(w.check_collisions(cut_off_distances)) == 36
 
 
-    # TODO test that has collision entries of robot links without collision geometry
+    def test_check_collisions_with_collision_workers(self, test_folder):
+        def check_collisions(world):
+            # the query cache would answer the second check
+            world.query_cache = CollisionQueryCache()
+            collisions = world.check_collisions(world.collision_goals_to_collision_matrix([], min_dist))
+            return {(key, tuple(np.round(row, 5))) for key, row in zip(collisions.keys, collisions.data)}
+
+        w = self.world_cls(number_of_collision_workers=2)
+        r = self.cls(pr2_urdf())
+        w.add_robot(r, None, r.controlled_joints, None, None, None, False, [], [])
+        pr22 = self.cls(pr2_urdf())
+        pr22.set_name('pr22')
+        w.add_object(pr22)
+        base_pose = Pose()
+        base_pose.position.x = 0.05
+        base_pose.orientation.w = 1
+        w.set_object_pose('pr22', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        box = WorldObject.from_world_body(make_world_body_box())
+        box_pose = Pose()
+        box_pose.orientation.w = 1
+        workers = w.collision_workers
+        try:
+            state_sizes = []
+            for attach in [False, True, False, True]:
+                if attach:
+                    w.robot.attach_urdf_object(box, u'r_gripper_tool_frame', box_pose)
+                elif box.get_name() in w.robot.get_link_names():
+                    w.robot.detach_sub_tree(box.get_name())
+                with_workers = check_collisions(w)
+                assert w.collision_workers is workers
+                w.collision_workers = None
+                in_process = check_collisions(w)
+                w.collision_workers = workers
+                assert len(with_workers) > 0
+                assert with_workers == in_process
+                state_sizes.append(workers.next_offset)
+            # the reloaded robot reuses the part of the state buffer of the robot it replaced
+            assert state_sizes[3] == state_sizes[1]
+        finally:
+            workers.stop()
+
+    def make_cluttered_world_with_pr2(self):
+        """
+        pr2 with its arms crossed, a second pr2 overlapping it, a sphere in front of its right gripper and a third pr2
+        far away.
+        :rtype: PyBulletWorld
+        """
+        w = self.world_cls()
+        r = self.cls(pr2_urdf())
+        w.add_robot(r, None, r.controlled_joints, None, None, None, False, [], [])
+        w.robot.joint_state = {u'r_shoulder_pan_joint': SingleJointState(u'r_shoulder_pan_joint', 0.7),
+                               u'l_shoulder_pan_joint': SingleJointState(u'l_shoulder_pan_joint', -0.7)}
+        for name, x in [(u'pr22', 0.05), (u'pr23', 10)]:
+            pr2 = self.cls(pr2_urdf())
+            pr2.set_name(name)
+            w.add_object(pr2)
+            base_pose = Pose()
+            base_pose.position.x = x
+            base_pose.orientation.w = 1
+            w.set_object_pose(name, base_pose)
+        w.add_object(WorldObject.from_world_body(make_world_body_sphere(radius=0.05)))
+        palm_aabb = w.robot.get_pybullet_aabb(w.robot.get_pybullet_link_id(u'r_gripper_palm_link'))
+        sphere_pose = Pose()
+        sphere_pose.position.x = palm_aabb[1][0] + 0.2
+        sphere_pose.position.y = (palm_aabb[0][1] + palm_aabb[1][1]) / 2
+        sphere_pose.position.z = (palm_aabb[0][2] + palm_aabb[1][2]) / 2
+        sphere_pose.orientation.w = 1
+        w.set_object_pose(u'sphere', sphere_pose)
+        return w
+
+    def get_cluttered_cut_off_distances(self, w):
+        """
+        The default collision matrix of make_cluttered_world_with_pr2, some robot links additionally have explicit
+        entries for links of the other pr2s and self collision entries between the arms.
+        :type w: PyBulletWorld
+        :rtype: dict
+        """
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        robot_links = sorted({robot_link for robot_link, _, _ in cut_off_distances})
+        for robot_link in robot_links[::2]:
+            cut_off_distances[robot_link, u'pr22', u'torso_lift_link'] = 0.05
+            cut_off_distances[robot_link, u'pr23', u'base_link'] = 0.1
+        r_links = [x for x in w.robot.get_links_with_collision() if x.startswith(u'r_forearm') or
+                   x.startswith(u'r_gripper')]
+        l_links = [x for x in w.robot.get_links_with_collision() if x.startswith(u'l_forearm') or
+                   x.startswith(u'l_gripper')]
+        for r_link, l_link in product(r_links, l_links):
+            cut_off_distances[r_link, w.robot.get_name(), l_link] = 0.1
+        return cut_off_distances
+
+    def test_check_collisions_equals_naive_queries(self, test_folder):
+        w = self.make_cluttered_world_with_pr2()
+        cut_off_distances = self.get_cluttered_cut_off_distances(w)
+        robot_links = {robot_link for robot_link, _, _ in cut_off_distances}
+        # pr23 is only checked by the broad phase
+        assert (u'base_link', u'pr23', CollisionEntry.ALL) in cut_off_distances
+        assert [x for x in cut_off_distances if x[1] == u'pr23' and x[2] != CollisionEntry.ALL]
+        for robot_link in robot_links:
+            robot_link_aabb = w.robot.get_pybullet_aabb(w.robot.get_pybullet_link_id(robot_link))
+            pr23_aabb = w.get_object(u'pr23').get_pybullet_aabb()
+            assert np.any(robot_link_aabb[1] + 0.3 < pr23_aabb[0])
+
+        collisions = collision_set(w.check_collisions(cut_off_distances))
+        naive = naive_check_collisions(w, cut_off_distances)
+        assert collisions == naive
+        keys = {key for key, _ in collisions}
+        assert not [x for x in keys if x[1] == u'pr23']
+        assert [x for x in keys if x[1] == u'sphere']
+        assert [x for x in keys if x[1] == w.robot.get_name()]
+        # explicit entries replace the ALL entry for their link, with their own cut off distance
+        explicit = [x for x in collisions if x[0][1:] == (u'pr22', u'torso_lift_link')]
+        assert explicit
+        for (robot_link, _, _), row in explicit:
+            assert row[Collisions.MIN_DIST] == 0.05
+            assert (robot_link, u'pr22', u'torso_lift_link') in cut_off_distances
+
+    def test_check_collisions_query_cache(self, test_folder):
+        def check_collisions(world, cut_off_distances):
+            cached = collision_set(world.check_collisions(cut_off_distances))
+            query_cache = world.query_cache
+            world.query_cache = CollisionQueryCache()
+            uncached = collision_set(world.check_collisions(cut_off_distances))
+            world.query_cache = query_cache
+            assert cached == uncached
+            return cached
+
+        def move_joint(world, joint_name, delta):
+            position = world.robot.joint_state[joint_name].position + delta
+            world.robot.joint_state = {joint_name: SingleJointState(joint_name, position)}
+
+        w = self.make_cluttered_world_with_pr2()
+        cut_off_distances = self.get_cluttered_cut_off_distances(w)
+        collisions = check_collisions(w, cut_off_distances)
+        assert len(collisions) > 0
+        # nothing moved
+        assert check_collisions(w, cut_off_distances) == collisions
+
+        # less than the margin of the cache
+        move_joint(w, u'r_shoulder_pan_joint', -0.001)
+        move_joint(w, u'torso_lift_joint', 0.001)
+        check_collisions(w, cut_off_distances)
+
+        # further than the margin of the cache
+        move_joint(w, u'r_shoulder_pan_joint', -0.3)
+        move_joint(w, u'torso_lift_joint', 0.2)
+        assert check_collisions(w, cut_off_distances) != collisions
+
+        # the objects move, but the robot doesn't
+        pose_version = w.get_object(u'sphere').pose_version
+        sphere_pose = deepcopy(w.get_object(u'sphere').base_pose)
+        sphere_pose.position.x -= 0.1
+        w.set_object_pose(u'sphere', sphere_pose)
+        assert w.get_object(u'sphere').pose_version != pose_version
+        pr22_pose = Pose()
+        pr22_pose.position.x = 0.2
+        pr22_pose.orientation.w = 1
+        w.set_object_pose(u'pr22', pr22_pose)
+        check_collisions(w, cut_off_distances)
+
+        # different cut off distances
+        collisions = check_collisions(w, cut_off_distances)
+        cut_off_distances = {k: v / 2 for k, v in cut_off_distances.items()}
+        assert check_collisions(w, cut_off_distances) != collisions
+        del cut_off_distances[next(x for x in cut_off_distances if x[1] == w.robot.get_name())]
+        check_collisions(w, cut_off_distances)
+
+        # the link ids change when the robot gets reinitialized
+        box_pose = Pose()
+        box_pose.orientation.w = 1
+        box = WorldObject.from_world_body(make_world_body_box(x_length=0.1, y_length=0.1, z_length=0.1))
+        w.robot.attach_urdf_object(box, u'r_gripper_tool_frame', box_pose)
+        cut_off_distances[u'box', u'pr22', CollisionEntry.ALL] = 0.1
+        check_collisions(w, cut_off_distances)
+        w.robot.detach_sub_tree(u'box')
+        del cut_off_distances[u'box', u'pr22', CollisionEntry.ALL]
+        check_collisions(w, cut_off_distances)
+
+    def test_check_self_collisions_link_order(self, test_folder):
+        def check_collisions(link_a, link_b, cut_off_distances):
+            collisions = w.check_collisions(cut_off_distances)
+            rows = [row for key, row in zip(collisions.keys, collisions.data) if key == (link_a, robot_name, link_b)]
+            assert len(rows) > 0
+            aabb_a = w.robot.get_pybullet_aabb(w.robot.get_pybullet_link_id(link_a))
+            aabb_b = w.robot.get_pybullet_aabb(w.robot.get_pybullet_link_id(link_b))
+            for row in rows:
+                position_on_a = row[Collisions.POSITION_ON_A:Collisions.POSITION_ON_A + 3]
+                position_on_b = row[Collisions.POSITION_ON_B:Collisions.POSITION_ON_B + 3]
+                normal = row[Collisions.CONTACT_NORMAL:Collisions.CONTACT_NORMAL + 3]
+                distance = row[Collisions.CONTACT_DISTANCE]
+                assert np.all(position_on_a >= aabb_a[0] - 1e-3) and np.all(position_on_a <= aabb_a[1] + 1e-3)
+                assert np.all(position_on_b >= aabb_b[0] - 1e-3) and np.all(position_on_b <= aabb_b[1] + 1e-3)
+                assert np.isclose(distance, 0.2, atol=1e-3)
+                # the normal points from b towards a
+                np.testing.assert_array_almost_equal(position_on_b + normal * distance, position_on_a, decimal=3)
+                assert np.sign(normal[2]) == np.sign(position_on_a[2] - position_on_b[2])
+
+        w = self.world_cls()
+        r = self.cls(pr2_urdf())
+        w.add_robot(r, None, r.controlled_joints, None, None, None, False, [], [])
+        robot_name = w.robot.get_name()
+        # boxes next to the pr2, stacked on top of each other with gaps of 0.2
+        for name, z in [(u'box_a', 1.0), (u'box_b', 1.3), (u'box_c', 0.7)]:
+            box_pose = Pose()
+            box_pose.position.y = 1
+            box_pose.position.z = z
+            box_pose.orientation.w = 1
+            box = WorldObject.from_world_body(make_world_body_box(name, 0.1, 0.1, 0.1))
+            w.robot.attach_urdf_object(box, u'base_link', box_pose)
+
+        # one link b, the query is between the two links
+        check_collisions(u'box_a', u'box_b', {(u'box_a', robot_name, u'box_b'): 0.1})
+        check_collisions(u'box_b', u'box_a', {(u'box_b', robot_name, u'box_a'): 0.1})
+        # both orders at once
+        cut_off_distances = {(u'box_a', robot_name, u'box_b'): 0.1,
+                             (u'box_b', robot_name, u'box_a'): 0.1}
+        check_collisions(u'box_a', u'box_b', cut_off_distances)
+        check_collisions(u'box_b', u'box_a', cut_off_distances)
+        # several link bs, the query is between box_a and the whole robot
+        cut_off_distances = {(u'box_a', robot_name, u'box_b'): 0.1,
+                             (u'box_a', robot_name, u'box_c'): 0.1}
+        check_collisions(u'box_a', u'box_b', cut_off_distances)
+        check_collisions(u'box_a', u'box_c', cut_off_distances)
 
+    # TODO test that has collision entries of robot links without collision geometry
 
 
+def test_collision_workers_reuse_offsets():
+    workers = CollisionWorkers(1, state_capacity=100)
+    workers.state = np.zeros(100)
+    offset = workers.allocate(10)
+    assert workers.allocate(20) == offset + 10
+    workers.free(offset, 10)
+    assert workers.allocate(8) == offset
+    assert workers.allocate(2) == offset + 8
+    assert workers.allocate(80) is None
+    assert workers.allocate(70) == offset + 30
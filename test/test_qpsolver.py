@@ -1,5 +1,98 @@
+from collections import OrderedDict
+
 import numpy as np
-from giskardpy.qp_solver import QPSolver
+import pytest
+from giskardpy import symbolic_wrapper as w
+from giskardpy.qp_problem_builder import block_file_name, JointConstraint, QProblemBuilder, SoftConstraint
+from giskardpy.qp_recorder import QPRecorder, load_recording
+from giskardpy.qp_solver import get_qp_solver_class
+from giskardpy.qp_solver_qpoases import QPSolverQPOases as QPSolver
+
+backends = [u'qpoases', u'osqp']
+
+
+def small_problem():
+    """
+    One hard constraint x0 == x1, two joints and one soft constraint x0 + x1 + slack == 1.
+    :return: H, g, A, lb, ub, lbA, ubA
+    :rtype: tuple
+    """
+    H = np.diag([0.01, 0.02, 1.])
+    g = np.zeros(3)
+    A = np.array([[1., -1., 0.],
+                  [1., 1., 1.]])
+    lb = np.array([-1., -1., -1e3])
+    ub = np.array([1., 1., 1e3])
+    lbA = np.array([0., 1.])
+    ubA = np.array([0., 1.])
+    return H, g, A, lb, ub, lbA, ubA
+
+
+# x0 == x1 minimizes 0.03 * x0^2 + (1 - 2 * x0)^2
+small_problem_solution = [4 / 8.06, 4 / 8.06, 1 - 8 / 8.06]
+
+
+@pytest.mark.parametrize(u'backend', backends)
+def test_small_problem(backend):
+    qp = get_qp_solver_class(backend)(1, 2, 1)
+    np.testing.assert_array_almost_equal(qp.solve(*small_problem()), small_problem_solution, decimal=4)
+    # warm started with the last solution
+    np.testing.assert_array_almost_equal(qp.solve(*small_problem()), small_problem_solution, decimal=4)
+    assert qp.number_of_inits == 1
+    assert qp.number_of_hotstarts == 1
+
+
+@pytest.mark.parametrize(u'backend', backends)
+def test_small_problem_without_joint(backend):
+    qp = get_qp_solver_class(backend)(1, 2, 1)
+    H, g, A, lb, ub, lbA, ubA = small_problem()
+    # variables with weight 0 are removed from the problem, x0 == x1 turns into x0 == 0
+    H[1, 1] = 0
+    np.testing.assert_array_almost_equal(qp.solve(H, g, A, lb, ub, lbA, ubA), [0, 1], decimal=4)
+
+
+@pytest.mark.parametrize(u'backend', backends)
+def test_small_problem_with_A_sparsity(backend):
+    qp = get_qp_solver_class(backend)(1, 2, 1)
+    H, g, A, lb, ub, lbA, ubA = small_problem()
+    qp.set_A_sparsity(A != 0)
+    np.testing.assert_array_almost_equal(qp.solve(H, g, A, lb, ub, lbA, ubA), small_problem_solution, decimal=4)
+    np.testing.assert_array_almost_equal(qp.solve(H, g, A * 2, lb, ub, lbA * 2, ubA * 2), small_problem_solution,
+                                         decimal=4)
+    # the reduced problems have the same shape, but other columns of A
+    for j in [1, 0]:
+        H2 = H.copy()
+        H2[j, j] = 0
+        np.testing.assert_array_almost_equal(qp.solve(H2, g, A, lb, ub, lbA, ubA), [0, 1], decimal=4)
+    if backend == u'osqp':
+        assert qp.number_of_inits == 3
+        assert qp.number_of_hotstarts == 1
+
+
+def test_qp_recorder_round_trip(tmpdir):
+    file_name = str(tmpdir.join(u'recording.pickle.gz'))
+    key_maps = ([u'j -- a', u'j -- b', u's'], [u'j -- a', u'j -- b'], [u'h -- a', u's'], [u'j -- a', u'j -- b', u's'])
+    H, g, A, lb, ub, lbA, ubA = small_problem()
+    H2 = H.copy()
+    H2[0, 1] = H2[1, 0] = 0.005
+    recorder = QPRecorder(file_name, (1, 2, 1), key_maps, robot=u'muh')
+    recorder.record(H, A, lb, ub, lbA, ubA)
+    recorder.record(H2, A * 2, lb, ub, lbA, ubA)
+    recorder.close()
+
+    header, cycles = load_recording(file_name)
+    assert header[u'dimensions'] == (1, 2, 1)
+    assert header[u'weight_keys'] == key_maps[0]
+    assert header[u'bA_keys'] == key_maps[2]
+    assert header[u'robot'] == u'muh'
+    cycles = list(cycles)
+    assert len(cycles) == 2
+    for recorded, expected in zip(cycles, [(H, g, A, lb, ub, lbA, ubA), (H2, g, A * 2, lb, ub, lbA, ubA)]):
+        for a, b in zip(recorded, expected):
+            np.testing.assert_array_equal(a, b)
+    # the recorded problems can be replayed offline
+    qp = get_qp_solver_class(u'osqp')(*header[u'dimensions'])
+    np.testing.assert_array_almost_equal(qp.solve(*cycles[0]), small_problem_solution, decimal=4)
 
 
 def test_donbot_joint_movement():
@@ -37,4 +130,36 @@ def test_nan():
     np.testing.assert_raises(AssertionError, np.testing.assert_almost_equal, xdot[32], 0)
     np.testing.assert_raises(AssertionError, np.testing.assert_almost_equal, xdot[33], 0)
     np.testing.assert_raises(AssertionError, np.testing.assert_almost_equal, xdot[34], 0)
-    np.testing.assert_array_almost_equal(xdot, xdot2)
\ No newline at end of file
+    np.testing.assert_array_almost_equal(xdot, xdot2)
+
+
+def test_swapped_soft_constraint_gets_its_own_block(tmpdir, monkeypatch):
+    x0 = w.Symbol(u'x0')
+    x1 = w.Symbol(u'x1')
+    joint_constraints = OrderedDict((k, JointConstraint(-1, 1, 0.01)) for k in [u'j0', u'j1'])
+    soft_constraints = {u'a': SoftConstraint(1 - x0, 1 - x0, 1, x0),
+                        u'b': SoftConstraint(-x1, -x1, 1, x1),
+                        u'c': SoftConstraint(1 - x0 - x1, 1 - x0 - x1, 1, x0 + x1)}
+    path_to_functions = u'{}/'.format(tmpdir)
+    compiled_blocks = []
+    speed_up_sparse = w.speed_up_sparse
+
+    def compile_block(*args, **kwargs):
+        compiled_blocks.append(args)
+        return speed_up_sparse(*args, **kwargs)
+
+    monkeypatch.setattr(w, u'speed_up_sparse', compile_block)
+
+    def make_qp(keys):
+        return QProblemBuilder(joint_constraints, {}, OrderedDict((k, soft_constraints[k]) for k in keys), [x0, x1],
+                               path_to_functions=path_to_functions, soft_constraint_blocks=[[k] for k in keys])
+
+    make_qp([u'a', u'b'])
+    assert len(compiled_blocks) == 3
+    # same number of soft constraints, but b got replaced by c
+    make_qp([u'a', u'c'])
+    assert block_file_name(path_to_functions, [u'c']) != block_file_name(path_to_functions, [u'b'])
+    # the joint constraints and a are loaded from the cache
+    assert len(compiled_blocks) == 4
+    make_qp([u'a', u'b'])
+    assert len(compiled_blocks) == 4
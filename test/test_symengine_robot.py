@@ -13,8 +13,11 @@ import pytest
 from urdf_parser_py.urdf import URDF
 
 from giskardpy.symengine_robot import Robot
+from giskardpy.symengine_controller import InstantaneousController
 from utils_for_tests import rnd_joint_state, pr2_urdf, donbot_urdf, boxy_urdf, base_bot_urdf, compare_poses
-from giskardpy.urdf_object import hacky_urdf_parser_fix
+from giskardpy.urdf_object import hacky_urdf_parser_fix, URDFObject
+from giskardpy.utils import make_world_body_box
+from geometry_msgs.msg import Pose, Point, Quaternion
 from kdl_parser import kdl_tree_from_urdf_model
 import numpy as np
 from hypothesis import given
@@ -215,6 +218,43 @@ class TestSymengineController(object):
             compare_poses(kdl_fk, symengine_fk)
 
 
+    def test_attach_keeps_frames(self, parsed_pr2):
+        frame = parsed_pr2.get_joint_frame(u'l_shoulder_pan_joint')
+        box = URDFObject.from_world_body(make_world_body_box())
+        p = Pose()
+        p.position = Point(0, 0, 0.1)
+        p.orientation = Quaternion(0, 0, 0, 1)
+        parsed_pr2.attach_urdf_object(box, u'l_gripper_tool_frame', p)
+        assert parsed_pr2.get_joint_frame(u'l_shoulder_pan_joint') is frame
+        np.testing.assert_array_almost_equal(parsed_pr2.get_fk_np(u'l_gripper_tool_frame', box.get_name())[:3, 3],
+                                             [0, 0, 0.1])
+        parsed_pr2.detach_sub_tree(box.get_name())
+        assert parsed_pr2.get_joint_frame(u'l_shoulder_pan_joint') is frame
+        assert box.get_name() not in parsed_pr2.get_link_names()
+
+    def test_attach_keeps_constraints_and_kinematic_hash(self, parsed_pr2):
+        joint_constraint = parsed_pr2._joint_constraints[u'l_shoulder_pan_joint']
+        kinematic_hash = parsed_pr2.get_kinematic_hash()
+        box = URDFObject.from_world_body(make_world_body_box())
+        p = Pose()
+        p.orientation = Quaternion(0, 0, 0, 1)
+        parsed_pr2.attach_urdf_object(box, u'l_gripper_tool_frame', p)
+        assert parsed_pr2._joint_constraints[u'l_shoulder_pan_joint'] is joint_constraint
+        assert parsed_pr2.get_kinematic_hash() == kinematic_hash
+        parsed_pr2.pop_fk_expression_links()
+        parsed_pr2.get_fk_expression(parsed_pr2.get_root(), box.get_name())
+        fk_links = parsed_pr2.pop_fk_expression_links()
+        assert fk_links == {parsed_pr2.get_root(), box.get_name()}
+        assert parsed_pr2.pop_fk_expression_links() == set()
+        assert parsed_pr2.get_kinematic_hash(fk_links) != kinematic_hash
+        assert parsed_pr2.get_kinematic_hash() == kinematic_hash
+        controller = InstantaneousController(parsed_pr2, u'')
+        path_to_functions = controller.get_path_to_functions()
+        controller.set_fk_links(fk_links)
+        assert controller.get_path_to_functions() != path_to_functions
+        parsed_pr2.detach_sub_tree(box.get_name())
+        assert parsed_pr2.get_kinematic_hash(fk_links) == kinematic_hash
+
     def test_get_controllable_joint_names_pr2(self, parsed_pr2):
         expected = {u'l_shoulder_pan_joint', u'br_caster_l_wheel_joint', u'r_gripper_l_finger_tip_joint',
                     u'r_elbow_flex_joint', u'torso_lift_joint', u'r_gripper_l_finger_joint', u'r_forearm_roll_joint',
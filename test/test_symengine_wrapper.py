@@ -1,4 +1,8 @@
+import os
+import shutil
+import tempfile
 import unittest
+from time import time
 
 import PyKDL
 import hypothesis.strategies as st
@@ -34,6 +38,59 @@ class TestSympyWrapper(unittest.TestCase):
             for j in range(expected.shape[1]):
                 assert w.equivalent(jac[i,j], expected[i,j])
 
+    def test_speed_up_sparse(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        jac = w.jacobian(w.Matrix([a * b, b]), [a, b])
+        f = w.speed_up_sparse([w.densify(w.Matrix([a, 1])), jac], [a, b])
+        dense, jac_nz = f.call2([2, 3])
+        np.testing.assert_array_almost_equal(dense, [2, 1])
+        A = np.zeros((2, 2))
+        A[f.sparsity(1)] = jac_nz
+        np.testing.assert_array_almost_equal(A, [[3, 2], [0, 1]])
+
+    def test_compiled_function_cache(self):
+        folder = tempfile.mkdtemp()
+        file_name = os.path.join(folder, u'function')
+        a = w.Symbol('a')
+        f = w.speed_up_sparse([w.densify(w.Matrix([a * 2, 1]))], [a])
+        self.assertIsNone(w.load_compiled_function(file_name))
+        w.safe_compiled_function(f, file_name)
+        f2 = w.load_compiled_function(file_name)
+        self.assertEqual(f2.str_params, f.str_params)
+        np.testing.assert_array_almost_equal(f2.call2([3])[0], [6, 1])
+
+        # corrupted files get deleted
+        with open(w.compiled_function_file_name(file_name), u'rb') as file:
+            content = file.read()
+        with open(w.compiled_function_file_name(file_name), u'wb') as file:
+            file.write(content[:-10])
+        self.assertIsNone(w.load_compiled_function(file_name))
+        self.assertFalse(os.path.exists(w.compiled_function_file_name(file_name)))
+        with open(w.compiled_function_file_name(file_name), u'wb') as file:
+            file.write(b'{}\n' + content)
+        self.assertIsNone(w.load_compiled_function(file_name))
+        self.assertFalse(os.path.exists(w.compiled_function_file_name(file_name)))
+
+        # least recently used functions get deleted
+        w.safe_compiled_function(f, file_name + u'1')
+        w.safe_compiled_function(f, file_name + u'2', max_cache_size=len(content) * 1.5)
+        self.assertEqual(len(os.listdir(folder)), 1)
+
+        # stale temporary files and folders get deleted
+        stale_file = tempfile.mkstemp(dir=folder, prefix=w.TEMPORARY_FILE_PREFIX)[1]
+        stale_folder = tempfile.mkdtemp(dir=folder, prefix=w.TEMPORARY_FILE_PREFIX)
+        open(os.path.join(stale_folder, u'f.c'), u'w').close()
+        old = time() - w.STALE_TEMPORARY_FILE_AGE - 1
+        os.utime(stale_file, (old, old))
+        os.utime(stale_folder, (old, old))
+        fresh_file = tempfile.mkstemp(dir=folder, prefix=w.TEMPORARY_FILE_PREFIX)[1]
+        w.evict_compiled_functions(folder)
+        self.assertFalse(os.path.exists(stale_file))
+        self.assertFalse(os.path.exists(stale_folder))
+        self.assertTrue(os.path.exists(fresh_file))
+        shutil.rmtree(folder)
+
     # fails if numbers too small or big
     @given(limited_float(outer_limit=1e10))
     def test_abs(self, f1):
@@ -107,6 +107,18 @@ class TestUrdfObject(object):
         assert len(urdf_obj.get_link_names()) == 80
         assert len(urdf_obj.get_joint_names()) == 79
 
+    def test_memoize_per_instance(self, function_setup):
+        parsed_pr2 = self.cls(pr2_urdf())
+        parsed_donbot = self.cls(donbot_urdf())
+        assert len(parsed_pr2.get_link_names()) == 97
+        assert len(parsed_donbot.get_link_names()) != 97
+        box = self.cls.from_world_body(make_world_body_box())
+        p = Pose()
+        p.orientation = Quaternion(0, 0, 0, 1)
+        parsed_pr2.attach_urdf_object(box, u'l_gripper_tool_frame', p)
+        # attaching changes the urdf, which invalidates the cached link names of parsed_pr2
+        assert len(parsed_pr2.get_link_names()) == 98
+
     def test_attach_urdf_object1(self, function_setup):
         parsed_pr2 = self.cls(pr2_urdf())
         num_of_links_before = len(parsed_pr2.get_link_names())
@@ -441,6 +453,19 @@ class TestUrdfObject(object):
         chain = parsed_pr2.get_joint_names_from_chain(root, tip)
         assert chain == [box.get_name()]
 
+    def test_kinematic_tree(self, function_setup):
+        parsed_pr2 = self.cls(pr2_urdf())
+        root = parsed_pr2.get_root()
+        assert parsed_pr2.get_connecting_link(u'l_gripper_tool_frame', u'r_gripper_tool_frame') == u'torso_lift_link'
+        assert parsed_pr2.get_connecting_link(u'l_gripper_tool_frame', u'l_upper_arm_link') == u'l_upper_arm_link'
+        assert parsed_pr2.get_connecting_link(root, u'l_upper_arm_link') == root
+        assert parsed_pr2.is_ancestor(root, u'l_gripper_tool_frame')
+        assert parsed_pr2.is_ancestor(u'l_upper_arm_link', u'l_upper_arm_link')
+        assert not parsed_pr2.is_ancestor(u'l_gripper_tool_frame', u'l_upper_arm_link')
+        assert not parsed_pr2.is_ancestor(u'r_upper_arm_link', u'l_upper_arm_link')
+        assert sorted(parsed_pr2.get_links_from_sub_tree(u'torso_lift_joint')) == \
+               sorted(parsed_pr2.get_sub_tree_at_joint(u'torso_lift_joint').get_link_names())
+
     def test_get_chain_fixed_joints(self, function_setup):
         parsed_donbot = self.cls(donbot_urdf())
         chain = parsed_donbot.get_chain('odom', 'odom_x_frame', joints=False, fixed=False)
@@ -1,5 +1,8 @@
+import os
+import re
 import shutil
 from collections import defaultdict
+from time import time
 
 import giskardpy
 
@@ -10,6 +13,7 @@ import pytest
 from geometry_msgs.msg import Pose, Point, Quaternion
 from giskard_msgs.msg import CollisionEntry
 import test_urdf_object
+from giskardpy.data_types import Collisions
 from giskardpy.exceptions import DuplicateNameException, PhysicsWorldException, UnknownBodyException
 from utils_for_tests import pr2_urdf, donbot_urdf, compare_poses
 from giskardpy.utils import make_world_body_box
@@ -110,6 +114,42 @@ class TestWorldObj(test_urdf_object.TestUrdfObject):
         r.load_self_collision_matrix(test_folder)
         assert scm_with_obj == r.get_self_collision_matrix()
 
+    def test_collision_hash(self, function_setup):
+        urdf = donbot_urdf()
+        r = self.cls(urdf)
+        without_visuals = re.sub(r'<visual>.*?</visual>', u'', urdf, flags=re.S)
+        assert r.get_collision_hash() == self.cls(without_visuals).get_collision_hash()
+        moved_collision = urdf.replace(u'<origin rpy="0 0 0" xyz="0 0 0.071"/>',
+                                       u'<origin rpy="0 0 0" xyz="0 0 0.072"/>')
+        assert r.get_collision_hash() != self.cls(moved_collision).get_collision_hash()
+        assert r.get_collision_hash() != self.cls(urdf, ignored_pairs=[(u'base_link', u'plate')]).get_collision_hash()
+
+    def test_safe_collision_matrix_eviction(self, test_folder, delete_test_folder):
+        r = self.cls(donbot_urdf(), path_to_data_folder=test_folder, calc_self_collision_matrix=True)
+        r.update_self_collision_matrix()
+        for i in range(3):
+            r.added_pairs = {(u'base_link', u'link{}'.format(i))}
+            r.safe_self_collision_matrix(test_folder, max_cached_matrices=2)
+        assert len(os.listdir(u'{}/{}'.format(test_folder, r.get_name()))) == 2
+        assert r.load_self_collision_matrix(test_folder)
+        r.added_pairs = {(u'base_link', u'link0')}
+        assert not r.load_self_collision_matrix(test_folder)
+
+    def test_safe_collision_matrix_eviction_keeps_new_matrix(self, test_folder, delete_test_folder):
+        r = self.cls(donbot_urdf(), path_to_data_folder=test_folder, calc_self_collision_matrix=True)
+        r.update_self_collision_matrix()
+        r.added_pairs = {(u'base_link', u'link0')}
+        r.safe_self_collision_matrix(test_folder, max_cached_matrices=1)
+        folder = u'{}/{}'.format(test_folder, r.get_name())
+        # the other matrix looks more recently used, e.g. because of clock skew between processes
+        future = time() + 60
+        for file_name in os.listdir(folder):
+            os.utime(os.path.join(folder, file_name), (future, future))
+        r.added_pairs = {(u'base_link', u'link1')}
+        r.safe_self_collision_matrix(test_folder, max_cached_matrices=1)
+        assert len(os.listdir(folder)) == 1
+        assert r.load_self_collision_matrix(test_folder)
+
     def test_base_pose1(self, function_setup):
         parsed_pr2 = self.cls(pr2_urdf())
         p = Pose()
@@ -904,3 +944,68 @@ class TestWorld(object):
         #     if body_b == name2:
         #         assert robot_link != robot_link_names[0]
         return world_with_pr2
+
+
+class TestCollisions(object):
+    @pytest.fixture(scope=u'class')
+    def donbot(self):
+        return Robot(donbot_urdf(), calc_self_collision_matrix=False)
+
+    def make_collisions(self, robot, keys, distances, number_of_external_collisions=20):
+        data = np.zeros((len(keys), Collisions.SIZE))
+        data[:, Collisions.CONTACT_DISTANCE] = distances
+        data[:, Collisions.POSITION_ON_B] = distances
+        data[:, Collisions.CONTACT_NORMAL] = 1
+        return Collisions(robot, keys, data, number_of_external_collisions)
+
+    def test_external_collisions_top_k(self, donbot):
+        distances = [0.5, 0.1, 0.4, 0.2, 0.3]
+        keys = [(u'ur5_wrist_3_link', u'box', u'box{}'.format(i)) for i in range(len(distances))]
+        collisions = self.make_collisions(donbot, keys, distances, number_of_external_collisions=3)
+        slots = collisions.external_collisions[u'ur5_wrist_3_joint']
+        assert slots.shape == (3, Collisions.SIZE)
+        np.testing.assert_array_equal(slots[:, Collisions.CONTACT_DISTANCE], [0.1, 0.2, 0.3])
+        cpis = collisions.get_external_collisions(u'ur5_wrist_3_joint')
+        assert [cpi.link_b for cpi in cpis] == [u'box1', u'box3', u'box4']
+        assert cpis[0].frame == u'ur5_wrist_3_link'
+
+    def test_external_collisions_default(self, donbot):
+        collisions = self.make_collisions(donbot, [(u'ur5_wrist_3_link', u'box', u'box')], [0.1],
+                                          number_of_external_collisions=3)
+        slots = collisions.external_collisions[u'ur5_wrist_2_joint']
+        assert slots.shape == (3, Collisions.SIZE)
+        np.testing.assert_array_equal(slots[:, Collisions.CONTACT_DISTANCE], 100)
+        np.testing.assert_array_equal(slots[:, Collisions.CONTACT_NORMAL:Collisions.CONTACT_NORMAL + 3], [[0, 0, 1]] * 3)
+        # unused slots of a joint with contacts are filled with defaults as well
+        slots = collisions.external_collisions[u'ur5_wrist_3_joint']
+        np.testing.assert_array_equal(slots[:, Collisions.CONTACT_DISTANCE], [0.1, 100, 100])
+        assert [cpi.link_b for cpi in collisions.get_external_collisions(u'ur5_wrist_2_joint')] == [u''] * 3
+
+    def test_self_collisions_minimum(self, donbot):
+        robot_name = donbot.get_name()
+        keys = [(u'ur5_wrist_3_link', robot_name, u'ur5_forearm_link'),
+                (u'ur5_wrist_3_link', robot_name, u'ur5_forearm_link'),
+                (u'ur5_wrist_3_link', robot_name, u'ur5_wrist_2_link')]
+        collisions = self.make_collisions(donbot, keys, [0.3, 0.1, 0.2])
+        closest = collisions.self_collisions[u'ur5_wrist_3_link'][u'ur5_forearm_link']
+        assert closest.shape == (1, Collisions.SIZE)
+        assert closest[0, Collisions.CONTACT_DISTANCE] == 0.1
+        assert collisions.self_collisions[u'ur5_wrist_3_link'][u'ur5_wrist_2_link'][0, Collisions.CONTACT_DISTANCE] \
+               == 0.2
+        assert collisions.self_collisions[u'ur5_forearm_link'][u'ur5_wrist_3_link'][0, Collisions.CONTACT_DISTANCE] \
+               == 100
+        assert (u'ur5_wrist_3_link', u'ur5_forearm_link') in collisions
+        # self collisions don't end up in the external slots
+        np.testing.assert_array_equal(
+            collisions.external_collisions[u'ur5_wrist_3_joint'][:, Collisions.CONTACT_DISTANCE], 100)
+
+    def test_transform_invalidates_slots(self, donbot):
+        collisions = self.make_collisions(donbot, [(u'ur5_wrist_3_link', u'box', u'box')], [0.1])
+        assert collisions.external_collisions[u'ur5_wrist_3_joint'][0, Collisions.POSITION_ON_B] == 0.1
+        root_T_map = np.eye(4)
+        root_T_map[0, 3] = 1
+        collisions.transform(root_T_map)
+        np.testing.assert_almost_equal(
+            collisions.external_collisions[u'ur5_wrist_3_joint'][0, Collisions.POSITION_ON_B], 1.1)
+        np.testing.assert_almost_equal(collisions.get_external_collisions(u'ur5_wrist_3_joint')[0].position_on_b[0],
+                                       1.1)
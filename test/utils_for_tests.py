@@ -617,11 +617,12 @@ class GiskardTestWrapper(object):
                                                                                     identifier.distance_thresholds))
         collisions = self.get_world().check_collisions(collision_matrix)
         collisions = self.get_world().transform_contact_info(collisions)
-        collision_list = collisions.external_collision[self.get_robot().get_movable_parent_joint(link)]
-        for key, self_collisions in collisions.self_collisions.items():
-            if link in key:
-                collision_list.update(self_collisions)
-        return collision_list
+        collision_list = collisions.get_external_collisions(self.get_robot().get_movable_parent_joint(link))
+        for link_a, link_bs in collisions.self_collisions.items():
+            for link_b in link_bs:
+                if link in (link_a, link_b):
+                    collision_list.extend(collisions.get_self_collisions(link_a, link_b))
+        return sorted(collision_list, key=lambda x: x.contact_distance)
 
     def check_cpi_geq(self, links, distance_threshold):
         for link in links: